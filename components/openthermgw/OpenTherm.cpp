@@ -10,13 +10,32 @@ using namespace esphome;
 
 OpenTherm::OpenTherm(int inPin, int outPin, bool isSlave):
 	status(OpenThermStatus::NOT_INITIALIZED),
-	inPin(inPin),
-	outPin(outPin),
+	phy(inPin, outPin),
 	isSlave(isSlave),
 	response(0),
 	responseStatus(OpenThermResponseStatus::NONE),
 	responseTimestamp(0),
+	rxFrame(0),
+	rxStartTimestamp(0),
+	lastFrame{0, OpenThermResponseStatus::NONE, 0, 0},
+	droppedFrames(0),
+	receivedFrames(0),
+	txEndTimestamp(0),
+	blockingTime(0),
+	deferredDecoding(false),
+	edgeOverflow(false),
+	responseTimeout(1000000),
+	delayTime(FRAME_DELAY),
+	adaptiveDecoding(false),
+	bitPeriod(1000),
+	invalidFrames(0),
+	filteredGlitches(0),
 	handleInterruptCallback(NULL),
+	handleTimerInterruptCallback(NULL),
+	txTimer(NULL),
+	txFrame(0),
+	txHalfBitIndex(0),
+	txDoneStatus(OpenThermStatus::READY),
 	processResponseCallback(NULL),
 	pCallbackUser(NULL)
 {
@@ -24,12 +43,11 @@ OpenTherm::OpenTherm(int inPin, int outPin, bool isSlave):
 
 void OpenTherm::begin(void(*handleInterruptCallback)(void), void(*processResponseCallback)(unsigned long, OpenThermResponseStatus, void *), void *pCallbackUser)
 {
-	pinMode(inPin, INPUT);
-	pinMode(outPin, OUTPUT);
+	phy.begin();
 	if (handleInterruptCallback != NULL) {
 		this->handleInterruptCallback = handleInterruptCallback;
 		this->pCallbackUser=pCallbackUser;
-		attachInterrupt(digitalPinToInterrupt(inPin), handleInterruptCallback, CHANGE);
+		phy.attachEdgeInterrupt(handleInterruptCallback);
 	}
 	activateBoiler();
 	status = OpenThermStatus::READY;
@@ -41,40 +59,78 @@ void OpenTherm::begin(void(*handleInterruptCallback)(void))
 	begin(handleInterruptCallback, NULL, NULL);
 }
 
+bool OpenTherm::beginTimer(uint8_t timerNum, void(*handleTimerInterruptCallback)(void))
+{
+	if (handleTimerInterruptCallback == NULL)
+		return false;
+#if defined(ESP32) && ESP_ARDUINO_VERSION_MAJOR >= 3
+	// Arduino-ESP32 3.x allocates the next free timer itself, 1 tick per microsecond
+	(void)timerNum;
+	hw_timer_t *timer = timerBegin(1000000);
+	if (timer == NULL)
+		return false;
+	timerAttachInterrupt(timer, handleTimerInterruptCallback);
+	timerAlarm(timer, 500, true, 0);
+	// timerBegin starts the counter, it only runs while a frame is sent
+	timerStop(timer);
+	txTimer = timer;
+#elif defined(ESP32)
+	// 80MHz APB clock / 80 = 1 tick per microsecond
+	hw_timer_t *timer = timerBegin(timerNum, 80, true);
+	if (timer == NULL)
+		return false;
+	// Level-triggered: the timer driver doesn't support edge interrupts
+	timerAttachInterrupt(timer, handleTimerInterruptCallback, false);
+	timerAlarmWrite(timer, 500, true);
+	txTimer = timer;
+#elif defined(ESP8266)
+	// ESP8266 only has timer1, it is attached when a transmission starts. Timers 0 and 1 share it
+	// (the two interfaces of a gateway), the others send blocking. timer1 is also the timer of the core
+	// waveform generator (analogWrite, tone, Servo), the caller only uses it when nothing else does.
+	if (timerNum > 1)
+		return false;
+#else
+	(void)timerNum;
+	return false;
+#endif
+	this->handleTimerInterruptCallback = handleTimerInterruptCallback;
+	return true;
+}
+
 bool IRAM_ATTR OpenTherm::isReady()
 {
 	return status == OpenThermStatus::READY;
 }
 
 int IRAM_ATTR OpenTherm::readState() {
-	return digitalRead(inPin);
+	return phy.read();
 }
 
-void OpenTherm::setActiveState() {
-	digitalWrite(outPin, LOW);
+void IRAM_ATTR OpenTherm::setActiveState() {
+	phy.setActive();
 }
 
-void OpenTherm::setIdleState() {
-	digitalWrite(outPin, HIGH);
+void IRAM_ATTR OpenTherm::setIdleState() {
+	phy.setIdle();
 }
 
 void OpenTherm::activateBoiler() {
 	setIdleState();
-	delay(1000);
+	OpenThermPhy::delay(1000);
 }
 
 void OpenTherm::sendBit(bool high) {
 	if (high) setActiveState(); else setIdleState();
-	delayMicroseconds(500);
+	OpenThermPhy::delayMicroseconds(500);
 	if (high) setIdleState(); else setActiveState();
-	delayMicroseconds(500);
+	OpenThermPhy::delayMicroseconds(500);
 }
 
 bool OpenTherm::sendRequestAsync(unsigned long request)
 {
-	noInterrupts();
+	OpenThermPhy::disableInterrupts();
 	const bool ready = isReady();
-	interrupts();
+	OpenThermPhy::enableInterrupts();
 
 	if (!ready)
 	  return false;
@@ -83,15 +139,18 @@ bool OpenTherm::sendRequestAsync(unsigned long request)
 	response = 0;
 	responseStatus = OpenThermResponseStatus::NONE;
 
+	unsigned long sendStart = OpenThermPhy::micros();
 	sendBit(HIGH); //start bit
 	for (int i = 31; i >= 0; i--) {
 		sendBit(bitRead(request, i));
 	}
 	sendBit(HIGH); //stop bit
 	setIdleState();
+	txEndTimestamp = OpenThermPhy::micros();
+	blockingTime += txEndTimestamp - sendStart;
 
 	status = OpenThermStatus::RESPONSE_WAITING;
-	responseTimestamp = micros();
+	responseTimestamp = OpenThermPhy::micros();
 	return true;
 }
 
@@ -99,12 +158,12 @@ unsigned long OpenTherm::sendRequest(unsigned long request)
 {
 	while (!isReady()) {
 		process();
-		yield();
+		OpenThermPhy::yield();
 	}
-	if (!sendRequestAsync(request)) return 0;
+	if (!sendRequestTimer(request)) return 0;
 	while (!isReady()) {
 		process();
-		yield();
+		OpenThermPhy::yield();
 	}
 
 	return response;
@@ -116,16 +175,119 @@ bool OpenTherm::sendResponse(unsigned long request)
 	response = 0;
 	responseStatus = OpenThermResponseStatus::NONE;
 
+	unsigned long sendStart = OpenThermPhy::micros();
 	sendBit(HIGH); //start bit
 	for (int i = 31; i >= 0; i--) {
 		sendBit(bitRead(request, i));
 	}
 	sendBit(HIGH); //stop bit
 	setIdleState();
-	status = OpenThermStatus::READY;
+	txEndTimestamp = OpenThermPhy::micros();
+	blockingTime += txEndTimestamp - sendStart;
+	// The master has to wait at least 100ms before its next request, so the bus is known idle until then
+	responseTimestamp = OpenThermPhy::micros();
+	status = OpenThermStatus::DELAY;
+	return true;
+}
+
+bool OpenTherm::sendRequestTimer(unsigned long request)
+{
+	if (handleTimerInterruptCallback == NULL)
+		return sendRequestAsync(request);
+
+	OpenThermPhy::disableInterrupts();
+	const bool ready = isReady();
+	OpenThermPhy::enableInterrupts();
+
+	if (!ready)
+	  return false;
+
+	return sendFrameTimer(request, OpenThermStatus::RESPONSE_WAITING);
+}
+
+bool OpenTherm::sendResponseTimer(unsigned long response)
+{
+	if (handleTimerInterruptCallback == NULL || !sendFrameTimer(response, OpenThermStatus::DELAY))
+		return sendResponse(response);
 	return true;
 }
 
+bool OpenTherm::sendFrameTimer(unsigned long frame, OpenThermStatus doneStatus)
+{
+#if defined(ESP8266)
+	// timer1 is shared by all instances, fall back to the caller if another frame is being sent
+	if (timer1_enabled())
+		return false;
+#endif
+	this->response = 0;
+	responseStatus = OpenThermResponseStatus::NONE;
+	txFrame = frame;
+	txDoneStatus = doneStatus;
+	txHalfBitIndex = 0;
+	responseTimestamp = OpenThermPhy::micros();
+	status = OpenThermStatus::REQUEST_SENDING;
+
+	// First half of the start bit is driven right away, the timer takes care of the 67 others
+	setHalfBitState(0);
+	startTimer();
+	return true;
+}
+
+void IRAM_ATTR OpenTherm::setHalfBitState(byte halfBitIndex)
+{
+	// Half-bits 0-1 are the start bit, 2-65 the 32 data bits (MSB first), 66-67 the stop bit
+	byte bitIndex = halfBitIndex >> 1;
+	bool high = (bitIndex == 0 || bitIndex == 33) ? true : bitRead(txFrame, 32 - bitIndex);
+	bool firstHalf = (halfBitIndex & 1) == 0;
+	if (high == firstHalf) setActiveState(); else setIdleState();
+}
+
+void OpenTherm::startTimer()
+{
+#if defined(ESP32) && ESP_ARDUINO_VERSION_MAJOR >= 3
+	timerWrite((hw_timer_t *)txTimer, 0);
+	timerStart((hw_timer_t *)txTimer);
+#elif defined(ESP32)
+	timerWrite((hw_timer_t *)txTimer, 0);
+	timerAlarmEnable((hw_timer_t *)txTimer);
+#elif defined(ESP8266)
+	// 80MHz / 16 = 5 ticks per microsecond
+	timer1_attachInterrupt(handleTimerInterruptCallback);
+	timer1_enable(TIM_DIV16, TIM_EDGE, TIM_LOOP);
+	timer1_write(2500);
+#endif
+}
+
+void IRAM_ATTR OpenTherm::stopTimer()
+{
+#if defined(ESP32) && ESP_ARDUINO_VERSION_MAJOR >= 3
+	timerStop((hw_timer_t *)txTimer);
+#elif defined(ESP32)
+	timerAlarmDisable((hw_timer_t *)txTimer);
+#elif defined(ESP8266)
+	timer1_disable();
+#endif
+}
+
+void IRAM_ATTR OpenTherm::handleTimerInterrupt()
+{
+	if (status != OpenThermStatus::REQUEST_SENDING)
+		return;
+
+	byte halfBitIndex = txHalfBitIndex + 1;
+	txHalfBitIndex = halfBitIndex;
+	if (halfBitIndex < 68) {
+		setHalfBitState(halfBitIndex);
+		return;
+	}
+
+	setIdleState();
+	stopTimer();
+	responseTimestamp = OpenThermPhy::micros();
+	txEndTimestamp = responseTimestamp;
+	status = txDoneStatus;
+}
+
 unsigned long OpenTherm::getLastResponse()
 {
 	return response;
@@ -138,17 +300,57 @@ OpenThermResponseStatus OpenTherm::getLastResponseStatus()
 
 void IRAM_ATTR OpenTherm::handleInterrupt()
 {
-	unsigned long newTs = micros();
-		
-	unsigned long deltaTs = newTs - responseTimestamp;
+	unsigned long newTs = OpenThermPhy::micros();
+
+	if (deferredDecoding) {
+		// Only record the edge and the line level, process() decodes it outside of interrupt context
+		if (!edgeQueue.push(newTs, readState()))
+			edgeOverflow = true;
+		return;
+	}
 
 	// Wait 30us before read state to make sure digitalRead() will return the "correct" value
 	// I don't understand why but sometimes the interrupt is called but the input level is still in transition
-	delayMicroseconds(30);
+	OpenThermPhy::delayMicroseconds(30);
 	
-	int state=readState();
+	decodeEdge(newTs, readState());
+}
+
+void OpenTherm::processEdges()
+{
+	unsigned long ts;
+	int state;
+	while (edgeQueue.pop(ts, state))
+		decodeEdge(ts, state);
+
+	if (edgeOverflow) {
+		edgeOverflow = false;
+		if (status == OpenThermStatus::RESPONSE_START_BIT || status == OpenThermStatus::RESPONSE_RECEIVING)
+			completeFrame(OpenThermResponseStatus::INVALID, OpenThermPhy::micros());
+	}
+}
+
+void IRAM_ATTR OpenTherm::decodeEdge(unsigned long newTs, int state)
+{
+	if (adaptiveDecoding) {
+		// A pulse shorter than MIN_PULSE within a frame is noise: both of its edges are ignored
+		if ((status == OpenThermStatus::RESPONSE_START_BIT || status == OpenThermStatus::RESPONSE_RECEIVING) && newTs - lastInterruptTs < MIN_PULSE) {
+			restoreDecoderState(glitchState);
+			filteredGlitches++;
+			return;
+		}
+		saveDecoderState(glitchState);
+	}
+
+	unsigned long deltaTs = newTs - responseTimestamp;
 
 	lastInterruptTs=newTs;
+
+	// The delay after a frame may have elapsed before process() noticed it
+	if (status == OpenThermStatus::DELAY && (newTs - responseTimestamp) > delayTime) {
+		delayTime = FRAME_DELAY;
+		status = OpenThermStatus::READY;
+	}
 	
 	if (isReady())
 	{
@@ -164,10 +366,10 @@ void IRAM_ATTR OpenTherm::handleInterrupt()
 		if (state == HIGH) {
 			status = OpenThermStatus::RESPONSE_START_BIT;
 			responseTimestamp = newTs;
+			rxStartTimestamp = newTs;
 		}
 		else {
-			status = OpenThermStatus::RESPONSE_INVALID;
-			responseTimestamp = newTs;
+			completeFrame(OpenThermResponseStatus::INVALID, newTs);
 		}
 	}
 	else if (status == OpenThermStatus::RESPONSE_START_BIT) {
@@ -175,89 +377,196 @@ void IRAM_ATTR OpenTherm::handleInterrupt()
 			status = OpenThermStatus::RESPONSE_RECEIVING;
 			responseTimestamp = newTs;
 			responseBitIndex = 0;
+			rxFrame = 0;
+			// The start bit is half a bit period of the sender's clock
+			bitPeriod = 2 * deltaTs;
 		}
-		else {
-			status = OpenThermStatus::RESPONSE_INVALID;
-			responseTimestamp = newTs;
+		else if (!adaptiveDecoding || deltaTs >= 750) {
+			// An early edge may be the start of a glitch, the adaptive decoder waits for the next one
+			completeFrame(OpenThermResponseStatus::INVALID, newTs);
 		}
 	}
 	else if (status == OpenThermStatus::RESPONSE_RECEIVING) {
-		if ((deltaTs) > 750 && deltaTs < 1250) { // bitDuration should not bigger than 1500			
+		unsigned long minBit = adaptiveDecoding ? bitPeriod - bitPeriod / 4 : 750;
+		unsigned long maxBit = adaptiveDecoding ? bitPeriod + bitPeriod / 4 : 1250;
+		if ((deltaTs) > minBit && deltaTs < maxBit) { // bitDuration should not bigger than 1500			
 			if (responseBitIndex < 32) {
-				response = (response << 1) | !state;
+				rxFrame = (rxFrame << 1) | !state;
 				responseTimestamp = newTs;
 				responseBitIndex++;
+				// Follow the drift of the sender's clock along the frame
+				if (adaptiveDecoding)
+					bitPeriod = (3 * bitPeriod + deltaTs) / 4;
 			}
 			else { //stop bit
-				status = OpenThermStatus::RESPONSE_READY;
-				responseTimestamp = newTs;
+				unsigned long frame = rxFrame;
+				if (!isValidParity(frame))
+					completeFrame(OpenThermResponseStatus::INVALID_PARITY, newTs);
+				else
+					completeFrame((isSlave ? isValidRequest(frame) : isValidResponse(frame)) ? OpenThermResponseStatus::SUCCESS : OpenThermResponseStatus::INVALID_MESSAGE, newTs);
 			}
-		} else if(deltaTs > 1250) {
-			status = OpenThermStatus::RESPONSE_INVALID;
-			responseTimestamp = newTs;
+		} else if(deltaTs > maxBit) {
+			completeFrame(OpenThermResponseStatus::INVALID, newTs);
 		}		
 	}
 }
 
+void IRAM_ATTR OpenTherm::saveDecoderState(DecoderState &state)
+{
+	state.status = status;
+	state.responseTimestamp = responseTimestamp;
+	state.lastInterruptTs = lastInterruptTs;
+	state.rxFrame = rxFrame;
+	state.rxStartTimestamp = rxStartTimestamp;
+	state.bitPeriod = bitPeriod;
+	state.responseBitIndex = responseBitIndex;
+}
+
+void IRAM_ATTR OpenTherm::restoreDecoderState(const DecoderState &state)
+{
+	status = state.status;
+	responseTimestamp = state.responseTimestamp;
+	lastInterruptTs = state.lastInterruptTs;
+	rxFrame = state.rxFrame;
+	rxStartTimestamp = state.rxStartTimestamp;
+	bitPeriod = state.bitPeriod;
+	responseBitIndex = state.responseBitIndex;
+}
+
+void IRAM_ATTR OpenTherm::completeFrame(OpenThermResponseStatus frameStatus, unsigned long ts)
+{
+	OpenThermFrame frame;
+	frame.frame = rxFrame;
+	frame.status = frameStatus;
+	frame.startTimestamp = rxStartTimestamp;
+	frame.endTimestamp = ts;
+	if (!frameQueue.push(frame))
+		droppedFrames++;
+	if (frameStatus == OpenThermResponseStatus::INVALID || frameStatus == OpenThermResponseStatus::INVALID_PARITY)
+		invalidFrames++;
+
+	responseTimestamp = ts;
+	// A slave can receive the next request right away, a master has to wait 100ms before its next request.
+	// After an invalid frame the rest of its edges are ignored during the delay.
+	status = (isSlave && frameStatus != OpenThermResponseStatus::INVALID) ? OpenThermStatus::READY : OpenThermStatus::DELAY;
+}
+
+bool IRAM_ATTR OpenThermEdgeQueue::push(unsigned long ts, int state)
+{
+	uint8_t h = head.load(std::memory_order_relaxed);
+	if ((uint8_t)(h - tail.load(std::memory_order_acquire)) >= CAPACITY)
+		return false;
+	edges[h & (CAPACITY - 1)] = ts;
+	states[h & (CAPACITY - 1)] = state;
+	head.store(h + 1, std::memory_order_release);
+	return true;
+}
+
+bool OpenThermEdgeQueue::pop(unsigned long &ts, int &state)
+{
+	uint8_t t = tail.load(std::memory_order_relaxed);
+	if (t == head.load(std::memory_order_acquire))
+		return false;
+	ts = edges[t & (CAPACITY - 1)];
+	state = states[t & (CAPACITY - 1)];
+	tail.store(t + 1, std::memory_order_release);
+	return true;
+}
+
+bool IRAM_ATTR OpenThermFrameQueue::push(const OpenThermFrame &frame)
+{
+	uint8_t h = head.load(std::memory_order_relaxed);
+	if ((uint8_t)(h - tail.load(std::memory_order_acquire)) >= CAPACITY)
+		return false;
+	frames[h & (CAPACITY - 1)] = frame;
+	head.store(h + 1, std::memory_order_release);
+	return true;
+}
+
+bool OpenThermFrameQueue::pop(OpenThermFrame &frame)
+{
+	uint8_t t = tail.load(std::memory_order_relaxed);
+	if (t == head.load(std::memory_order_acquire))
+		return false;
+	frame = frames[t & (CAPACITY - 1)];
+	tail.store(t + 1, std::memory_order_release);
+	return true;
+}
+
+uint8_t OpenThermFrameQueue::size() const
+{
+	return (uint8_t)(head.load(std::memory_order_acquire) - tail.load(std::memory_order_acquire));
+}
+
 bool OpenTherm::process()
 {
-	noInterrupts();
-	OpenThermStatus st = status;
-	unsigned long ts = responseTimestamp;
-	interrupts();
-	
 	bool bDidProcessMessage=false;
-	
-	if (st == OpenThermStatus::READY) 
-		return bDidProcessMessage;
-		
-	unsigned long newTs = micros();		
-	if (st != OpenThermStatus::NOT_INITIALIZED && st != OpenThermStatus::DELAY && (newTs - ts) > 1000000) {
-		status = OpenThermStatus::READY;
-		responseStatus = OpenThermResponseStatus::TIMEOUT;
+
+	if (deferredDecoding)
+		processEdges();
+
+	// Drain every frame completed by the interrupt since the last call
+	OpenThermFrame frame;
+	while (frameQueue.pop(frame)) {
+		receivedFrames++;
+		lastFrame = frame;
+		response = frame.frame;
+		responseStatus = frame.status;
 		if (processResponseCallback != NULL) {
 			processResponseCallback(response, responseStatus, pCallbackUser);
 			bDidProcessMessage=true;
 		}
 	}
-	else if (st == OpenThermStatus::RESPONSE_INVALID) {
-		status = OpenThermStatus::DELAY;
-		responseStatus = OpenThermResponseStatus::INVALID;
-		if (processResponseCallback != NULL) {
-			processResponseCallback(response, responseStatus, pCallbackUser);
-			bDidProcessMessage=true;
+
+	OpenThermPhy::disableInterrupts();
+	OpenThermStatus st = status;
+	unsigned long ts = responseTimestamp;
+	OpenThermPhy::enableInterrupts();
+	
+	if (st == OpenThermStatus::READY) 
+		return bDidProcessMessage;
+		
+	unsigned long newTs = OpenThermPhy::micros();		
+	if (st != OpenThermStatus::NOT_INITIALIZED && st != OpenThermStatus::DELAY && (newTs - ts) > responseTimeout) {
+		// A compliant slave may still be about to answer: a request sent now could collide with its response
+		unsigned long usBusy = RESPONSE_WINDOW + FRAME_TIME + FRAME_DELAY;
+		if (!isSlave && newTs - txEndTimestamp < usBusy) {
+			OpenThermPhy::disableInterrupts();
+			responseTimestamp = txEndTimestamp;
+			delayTime = usBusy;
+			status = OpenThermStatus::DELAY;
+			OpenThermPhy::enableInterrupts();
 		}
-	}
-	else if (st == OpenThermStatus::RESPONSE_READY) {
-		status = OpenThermStatus::DELAY;
-		if(!isValidParity(response))
-			responseStatus=OpenThermResponseStatus::INVALID_PARITY;
 		else
-			responseStatus = (isSlave ? isValidRequest(response) : isValidResponse(response)) ? OpenThermResponseStatus::SUCCESS : OpenThermResponseStatus::INVALID_MESSAGE;
-
+			status = OpenThermStatus::READY;
+		responseStatus = OpenThermResponseStatus::TIMEOUT;
 		if (processResponseCallback != NULL) {
 			processResponseCallback(response, responseStatus, pCallbackUser);
 			bDidProcessMessage=true;
 		}
 	}
 	else if (st == OpenThermStatus::DELAY) {
-		if ((newTs - ts) > 100000) {
+		if ((newTs - ts) > delayTime) {
+			delayTime = FRAME_DELAY;
 			status = OpenThermStatus::READY;
 		}
 	}
 	return bDidProcessMessage;
 }
 
-bool OpenTherm::parity(unsigned long frame) //odd parity
+unsigned long OpenTherm::getRemainingDelay()
 {
-	byte p = 0;
-	unsigned long tmp=frame;
-	while (tmp > 0)
-	{
-		if (tmp & 1) p++;
-		tmp = tmp >> 1;
-	}
-	return (p & 1);
+	OpenThermPhy::disableInterrupts();
+	bool bDelay = status == OpenThermStatus::DELAY;
+	unsigned long usElapsed = OpenThermPhy::micros() - responseTimestamp;
+	unsigned long usDelay = delayTime;
+	OpenThermPhy::enableInterrupts();
+	return (bDelay && usElapsed < usDelay) ? usDelay - usElapsed : 0;
+}
+
+bool IRAM_ATTR OpenTherm::parity(unsigned long frame) //odd parity
+{
+	return OpenThermCodec::parity(frame);
 }
 
 OpenThermMessageType OpenTherm::getMessageType(unsigned long message)
@@ -291,26 +600,36 @@ unsigned long OpenTherm::buildResponse(OpenThermMessageType type, OpenThermMessa
 	return response;
 }
 
-bool OpenTherm::isValidParity(unsigned long message)
+bool IRAM_ATTR OpenTherm::isValidParity(unsigned long message)
 {
 	return (parity(message)==0);
 }
 
-bool OpenTherm::isValidResponse(unsigned long response)
+bool IRAM_ATTR OpenTherm::isValidResponse(unsigned long response)
 {
-	byte msgType = (response << 1) >> 29;
+	OpenThermMessageType msgType = getMessageType(response);
 	return msgType == READ_ACK || msgType == WRITE_ACK;
 }
 
-bool OpenTherm::isValidRequest(unsigned long request)
+bool IRAM_ATTR OpenTherm::isValidRequest(unsigned long request)
 {
-	byte msgType = (request << 1) >> 29;
+	OpenThermMessageType msgType = getMessageType(request);
 	return msgType == READ_DATA || msgType == WRITE_DATA;
 }
 
 void OpenTherm::end() {
 	if (this->handleInterruptCallback != NULL) {
-		detachInterrupt(digitalPinToInterrupt(inPin));
+		phy.detachEdgeInterrupt();
+	}
+	if (this->handleTimerInterruptCallback != NULL) {
+		if (status == OpenThermStatus::REQUEST_SENDING)
+			stopTimer();
+#if defined(ESP32)
+		timerDetachInterrupt((hw_timer_t *)txTimer);
+		timerEnd((hw_timer_t *)txTimer);
+		txTimer = NULL;
+#endif
+		this->handleTimerInterruptCallback = NULL;
 	}
 }
 
@@ -390,16 +709,13 @@ uint16_t OpenTherm::getUInt(const unsigned long response) const {
 }
 
 float OpenTherm::getFloat(const unsigned long response) const {
-	const uint16_t u88 = getUInt(response);
-	const float f = (u88 & 0x8000) ? -(0x10000L - u88) / 256.0f : u88 / 256.0f;
-	return f;
+	return OpenThermCodec::getF88(getUInt(response));
 }
 
 unsigned int OpenTherm::temperatureToData(float temperature) {
 	if (temperature < 0) temperature = 0;
 	if (temperature > 100) temperature = 100;
-	unsigned int data = (unsigned int)(temperature * 256);
-	return data;
+	return OpenThermCodec::setF88(temperature);
 }
 
 //basic requests
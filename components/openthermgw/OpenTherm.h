@@ -14,7 +14,9 @@ P MGS-TYPE SPARE DATA-ID  DATA-VALUE
 #define OpenTherm_h
 
 #include <stdint.h>
-#include <Arduino.h>
+#include <atomic>
+#include "OpenThermPhy.h"
+#include "OpenThermCodec.h"
 
 enum OpenThermResponseStatus {
 	NONE,
@@ -28,17 +30,17 @@ enum OpenThermResponseStatus {
 
 enum OpenThermMessageType {
 	/*  Master to Slave */
-	READ_DATA       = B000,
+	READ_DATA       = 0b000,
 	READ            = READ_DATA, // for backwared compatibility
-	WRITE_DATA      = B001,
+	WRITE_DATA      = 0b001,
 	WRITE           = WRITE_DATA, // for backwared compatibility
-	INVALID_DATA    = B010,
-	RESERVED        = B011,
+	INVALID_DATA    = 0b010,
+	RESERVED        = 0b011,
 	/* Slave to Master */
-	READ_ACK        = B100,
-	WRITE_ACK       = B101,
-	DATA_INVALID    = B110,
-	UNKNOWN_DATA_ID = B111
+	READ_ACK        = 0b100,
+	WRITE_ACK       = 0b101,
+	DATA_INVALID    = 0b110,
+	UNKNOWN_DATA_ID = 0b111
 };
 
 typedef OpenThermMessageType OpenThermRequestType; // for backwared compatibility
@@ -140,13 +142,67 @@ enum OpenThermStatus {
 	RESPONSE_INVALID
 };
 
+// A frame decoded by the edge interrupt, with the timestamps (us) of its start and stop bit edges
+struct OpenThermFrame
+{
+	unsigned long frame;
+	OpenThermResponseStatus status;
+	unsigned long startTimestamp;
+	unsigned long endTimestamp;
+};
+
+// Fixed capacity, lock-free single-producer (ISR) / single-consumer (main loop) queue of decoded frames
+class OpenThermFrameQueue
+{
+public:
+	static const uint8_t CAPACITY = 8; // must be a power of 2
+
+	bool push(const OpenThermFrame &frame);
+	bool pop(OpenThermFrame &frame);
+	uint8_t size() const;
+
+private:
+	OpenThermFrame frames[CAPACITY];
+	std::atomic<uint8_t> head{0}; // next slot written by the producer
+	std::atomic<uint8_t> tail{0}; // next slot read by the consumer
+};
+
+// Fixed capacity, lock-free single-producer (ISR) / single-consumer (main loop) queue of edge timestamps (us)
+// and the line level read after each edge, used when decoding is deferred to the main loop
+class OpenThermEdgeQueue
+{
+public:
+	static const uint8_t CAPACITY = 128; // must be a power of 2, a frame is at most 68 edges
+
+	bool push(unsigned long ts, int state);
+	bool pop(unsigned long &ts, int &state);
+
+private:
+	unsigned long edges[CAPACITY];
+	uint8_t states[CAPACITY];
+	std::atomic<uint8_t> head{0};
+	std::atomic<uint8_t> tail{0};
+};
+
 class OpenTherm
 {
 public:
 	OpenTherm(int inPin = 4, int outPin = 5, bool isSlave = false);
 	volatile OpenThermStatus status;
 	void begin(void(*handleInterruptCallback)(void));
+	// In deferred mode the interrupt only timestamps edges, the Manchester decoding runs in process()
+	void setDeferredDecoding(bool deferred) { deferredDecoding = deferred; }
+	// In adaptive mode pulses shorter than MIN_PULSE are filtered out, and the bit windows follow the bit period
+	// of the sender measured on the start bit, instead of the fixed 750-1250us
+	void setAdaptiveDecoding(bool adaptive) { adaptiveDecoding = adaptive; }
+	// Time after the end of a request at which process() reports a TIMEOUT without a complete response, 1s by default.
+	// A master reporting it before a slave may still answer waits in DELAY until that response and the FRAME_DELAY
+	// after it would be over.
+	void setResponseTimeout(unsigned long usTimeout) { responseTimeout = usTimeout; }
+	// Time left before the bus is ready after a frame or a timeout (us), 0 when it is
+	unsigned long getRemainingDelay();
 	void begin(void(*handleInterruptCallback)(void), void(*processResponseCallback)(unsigned long, OpenThermResponseStatus, void *), void *pCallbackUser);
+	bool beginTimer(uint8_t timerNum, void(*handleTimerInterruptCallback)(void));
 	bool isReady();
 	unsigned long sendRequest(unsigned long request);
 	bool sendResponse(unsigned long request);
@@ -159,6 +215,15 @@ public:
 	unsigned long buildResponse(OpenThermMessageType type, OpenThermMessageID id, unsigned int data);
 	unsigned long getLastResponse();
 	OpenThermResponseStatus getLastResponseStatus();
+	const OpenThermFrame &getLastFrame() const { return lastFrame; }
+	unsigned long getDroppedFrames() const { return droppedFrames; }
+	// Frames dropped as invalid (bad timing or parity), and glitches filtered out by the adaptive decoder
+	unsigned long getInvalidFrames() const { return invalidFrames; }
+	unsigned long getFilteredGlitches() const { return filteredGlitches; }
+	// Instrumentation: frames received, end of the last frame sent (us) and time spent sending frames blocking (us)
+	unsigned long getReceivedFrames() const { return receivedFrames; }
+	unsigned long getTransmitEndTimestamp() const { return txEndTimestamp; }
+	unsigned long getBlockingTime() const { return blockingTime; }
 	const char *statusToString(OpenThermResponseStatus status);
 	void handleInterrupt();
 	bool process();
@@ -202,8 +267,7 @@ public:
 	unsigned char getFault();
 
 private:
-	const int inPin;
-	const int outPin;
+	OpenThermPhy phy;
 	const bool isSlave;
 
 	volatile unsigned long response;
@@ -211,6 +275,53 @@ private:
 	volatile unsigned long responseTimestamp;
 	volatile byte responseBitIndex;
 	volatile unsigned long lastInterruptTs = 0;
+
+	// Frames completed by the edge interrupt, drained by process()
+	volatile unsigned long rxFrame;
+	volatile unsigned long rxStartTimestamp;
+	OpenThermFrameQueue frameQueue;
+	OpenThermFrame lastFrame;
+	volatile unsigned long droppedFrames;
+	unsigned long receivedFrames;
+	volatile unsigned long txEndTimestamp;
+	unsigned long blockingTime;
+
+	void completeFrame(OpenThermResponseStatus frameStatus, unsigned long ts);
+
+	bool deferredDecoding;
+	OpenThermEdgeQueue edgeQueue;
+	volatile bool edgeOverflow;
+	unsigned long responseTimeout;
+
+	// Bus timings of the spec (us): a slave starts its response within RESPONSE_WINDOW after the end of the request,
+	// a frame lasts FRAME_TIME and a master waits FRAME_DELAY after a frame before its next request
+	static const unsigned long RESPONSE_WINDOW = 800000;
+	static const unsigned long FRAME_TIME = 34000;
+	static const unsigned long FRAME_DELAY = 100000;
+	// Length of the current DELAY from responseTimestamp, FRAME_DELAY except after a timeout
+	volatile unsigned long delayTime;
+
+	// Adaptive decoding: decoder state before the last edge, restored when the next edge shows it was a glitch
+	static const unsigned long MIN_PULSE = 100;
+	bool adaptiveDecoding;
+	volatile unsigned long bitPeriod;
+	volatile unsigned long invalidFrames;
+	volatile unsigned long filteredGlitches;
+	struct DecoderState {
+		OpenThermStatus status;
+		unsigned long responseTimestamp;
+		unsigned long lastInterruptTs;
+		unsigned long rxFrame;
+		unsigned long rxStartTimestamp;
+		unsigned long bitPeriod;
+		byte responseBitIndex;
+	};
+	DecoderState glitchState;
+
+	void decodeEdge(unsigned long newTs, int state);
+	void saveDecoderState(DecoderState &state);
+	void restoreDecoderState(const DecoderState &state);
+	void processEdges();
 	
 	int readState();
 	void setActiveState();
@@ -219,16 +330,20 @@ private:
 
 	void sendBit(bool high);
 	void(*handleInterruptCallback)();
+
+	// Timer driven transmitter: the frame is clocked out one half-bit (500us) per timer interrupt
+	void(*handleTimerInterruptCallback)();
+	void *txTimer;
+	volatile unsigned long txFrame;
+	volatile byte txHalfBitIndex;
+	volatile OpenThermStatus txDoneStatus;
+
+	bool sendFrameTimer(unsigned long frame, OpenThermStatus doneStatus);
+	void setHalfBitState(byte halfBitIndex);
+	void startTimer();
+	void stopTimer();
 	void(*processResponseCallback)(unsigned long, OpenThermResponseStatus, void *);
 	void *pCallbackUser;	
 };
 
-#ifndef ICACHE_RAM_ATTR
-#define ICACHE_RAM_ATTR
-#endif
-
-#ifndef IRAM_ATTR
-#define IRAM_ATTR ICACHE_RAM_ATTR
-#endif
-
 #endif // OpenTherm_h
@@ -0,0 +1,67 @@
+/*
+OpenThermCodec.h - Frame parity and data value fields of OpenTherm frames
+
+Branch-free helpers shared by the OpenTherm library and the message_data decoders of the
+gateway. They have no dependency on Arduino or ESPHome, so they also build on the host.
+*/
+
+#ifndef OpenThermCodec_h
+#define OpenThermCodec_h
+
+#include <stdint.h>
+#include <math.h>
+
+namespace OpenThermCodec {
+	// Odd parity of the frame, folded to a nibble looked up in the 16-bit table 0x6996.
+	// Always inlined, it is called from interrupt handlers in IRAM.
+	inline __attribute__((always_inline)) bool parity(uint32_t frame)
+	{
+		frame ^= frame >> 16;
+		frame ^= frame >> 8;
+		frame ^= frame >> 4;
+		return (0x6996 >> (frame & 0xF)) & 1;
+	}
+
+	// Bit of the data value, 0-7 in the low byte and 8-15 in the high byte
+	inline bool getBit(uint16_t data, uint8_t bit)
+	{
+		return (data >> bit) & 1;
+	}
+
+	inline uint16_t setBit(uint16_t data, uint8_t bit, bool value)
+	{
+		return (data & ~(1u << bit)) | ((uint16_t)value << bit);
+	}
+
+	// Byte of the data value, 0 is the low byte and 1 the high byte
+	inline uint8_t getByte(uint16_t data, uint8_t index)
+	{
+		return (data >> (index * 8)) & 0xFF;
+	}
+
+	inline uint16_t setByte(uint16_t data, uint8_t index, uint8_t value)
+	{
+		return (data & ~(0xFFu << (index * 8))) | ((uint16_t)value << (index * 8));
+	}
+
+	// Signed fixed point with 8 fractional bits
+	inline float getF88(uint16_t data)
+	{
+		return (int16_t)data / 256.0f;
+	}
+
+	// Rounded to the nearest 1/256, saturated to the f8.8 range (-128 to 127.996), NaN is 0
+	inline uint16_t setF88(float value)
+	{
+		float scaled = value * 256.0f;
+		if (!(scaled == scaled))
+			return 0;
+		if (scaled <= -32768.0f)
+			return 0x8000;
+		if (scaled >= 32767.0f)
+			return 0x7FFF;
+		return (uint16_t)(int16_t)lroundf(scaled);
+	}
+} // namespace OpenThermCodec
+
+#endif // OpenThermCodec_h
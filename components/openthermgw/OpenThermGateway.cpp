@@ -1,97 +1,211 @@
 #include "OpenThermGateway.h"
 #include "esphome/core/log.h"
+#include "esphome/core/hal.h"
+#ifdef USE_ESP32
+#include <esp_heap_caps.h>
+#endif
  
-namespace esphome { 
-namespace message_data {
-    bool parse_flag8_lb_0(const unsigned long response) { return response & 0b0000000000000001; }
-    bool parse_flag8_lb_1(const unsigned long response) { return response & 0b0000000000000010; }
-    bool parse_flag8_lb_2(const unsigned long response) { return response & 0b0000000000000100; }
-    bool parse_flag8_lb_3(const unsigned long response) { return response & 0b0000000000001000; }
-    bool parse_flag8_lb_4(const unsigned long response) { return response & 0b0000000000010000; }
-    bool parse_flag8_lb_5(const unsigned long response) { return response & 0b0000000000100000; }
-    bool parse_flag8_lb_6(const unsigned long response) { return response & 0b0000000001000000; }
-    bool parse_flag8_lb_7(const unsigned long response) { return response & 0b0000000010000000; }
-    bool parse_flag8_hb_0(const unsigned long response) { return response & 0b0000000100000000; }
-    bool parse_flag8_hb_1(const unsigned long response) { return response & 0b0000001000000000; }
-    bool parse_flag8_hb_2(const unsigned long response) { return response & 0b0000010000000000; }
-    bool parse_flag8_hb_3(const unsigned long response) { return response & 0b0000100000000000; }
-    bool parse_flag8_hb_4(const unsigned long response) { return response & 0b0001000000000000; }
-    bool parse_flag8_hb_5(const unsigned long response) { return response & 0b0010000000000000; }
-    bool parse_flag8_hb_6(const unsigned long response) { return response & 0b0100000000000000; }
-    bool parse_flag8_hb_7(const unsigned long response) { return response & 0b1000000000000000; }
-
-    std::string get_flag_str_value(esphome::text_sensor::TextSensor* sensor, bool bActive)
-    {
-    	if(bActive)
-    		return "ON";
-	else
-    		return "OFF";
-    }
-    std::string parse_flag8_lb_0_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_lb_0(response)); }
-    std::string parse_flag8_lb_1_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_lb_1(response)); }
-    std::string parse_flag8_lb_2_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_lb_2(response)); }
-    std::string parse_flag8_lb_3_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_lb_3(response)); }
-    std::string parse_flag8_lb_4_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_lb_4(response)); }
-    std::string parse_flag8_lb_5_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_lb_5(response)); }
-    std::string parse_flag8_lb_6_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_lb_6(response)); }
-    std::string parse_flag8_lb_7_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_lb_7(response)); }
-    std::string parse_flag8_hb_0_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_hb_0(response)); }
-    std::string parse_flag8_hb_1_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_hb_1(response)); }
-    std::string parse_flag8_hb_2_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_hb_2(response)); }
-    std::string parse_flag8_hb_3_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_hb_3(response)); }
-    std::string parse_flag8_hb_4_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_hb_4(response)); }
-    std::string parse_flag8_hb_5_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_hb_5(response)); }
-    std::string parse_flag8_hb_6_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_hb_6(response)); }
-    std::string parse_flag8_hb_7_str(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return get_flag_str_value(sensor, parse_flag8_hb_7(response)); }
-
-    uint8_t parse_u8_lb(const unsigned long response) { return (uint8_t) (response & 0xff); }
-    uint8_t parse_u8_hb(const unsigned long response) { return (uint8_t) ((response >> 8) & 0xff); }
-    int8_t parse_s8_lb(const unsigned long response) { return (int8_t) (response & 0xff); }
-    int8_t parse_s8_hb(const unsigned long response) { return (int8_t) ((response >> 8) & 0xff); }
-    uint16_t parse_u16(const unsigned long response) { return (uint16_t) (response & 0xffff); }
-    int16_t parse_s16(const unsigned long response) { return (int16_t) (response & 0xffff); }
-    float parse_f88(const unsigned long response) {
-        unsigned int data = response & 0xffff;
-        return (data & 0x8000) ? -(0x10000L - data) / 256.0f : data / 256.0f; 
-    }
-
-    std::string parse_str_date(esphome::text_sensor::TextSensor* sensor, const unsigned long response) { return "00:00 00/00/0000"; }
-
-    unsigned int write_flag8_lb_0(const bool value, const unsigned int data) { return value ? data | 0b0000000000000001 : data & 0b1111111111111110; }
-    unsigned int write_flag8_lb_1(const bool value, const unsigned int data) { return value ? data | 0b0000000000000010 : data & 0b1111111111111101; }
-    unsigned int write_flag8_lb_2(const bool value, const unsigned int data) { return value ? data | 0b0000000000000100 : data & 0b1111111111111011; }
-    unsigned int write_flag8_lb_3(const bool value, const unsigned int data) { return value ? data | 0b0000000000001000 : data & 0b1111111111110111; }
-    unsigned int write_flag8_lb_4(const bool value, const unsigned int data) { return value ? data | 0b0000000000010000 : data & 0b1111111111101111; }
-    unsigned int write_flag8_lb_5(const bool value, const unsigned int data) { return value ? data | 0b0000000000100000 : data & 0b1111111111011111; }
-    unsigned int write_flag8_lb_6(const bool value, const unsigned int data) { return value ? data | 0b0000000001000000 : data & 0b1111111110111111; }
-    unsigned int write_flag8_lb_7(const bool value, const unsigned int data) { return value ? data | 0b0000000010000000 : data & 0b1111111101111111; }
-    unsigned int write_flag8_hb_0(const bool value, const unsigned int data) { return value ? data | 0b0000000100000000 : data & 0b1111111011111111; }
-    unsigned int write_flag8_hb_1(const bool value, const unsigned int data) { return value ? data | 0b0000001000000000 : data & 0b1111110111111111; }
-    unsigned int write_flag8_hb_2(const bool value, const unsigned int data) { return value ? data | 0b0000010000000000 : data & 0b1111101111111111; }
-    unsigned int write_flag8_hb_3(const bool value, const unsigned int data) { return value ? data | 0b0000100000000000 : data & 0b1111011111111111; }
-    unsigned int write_flag8_hb_4(const bool value, const unsigned int data) { return value ? data | 0b0001000000000000 : data & 0b1110111111111111; }
-    unsigned int write_flag8_hb_5(const bool value, const unsigned int data) { return value ? data | 0b0010000000000000 : data & 0b1101111111111111; }
-    unsigned int write_flag8_hb_6(const bool value, const unsigned int data) { return value ? data | 0b0100000000000000 : data & 0b1011111111111111; }
-    unsigned int write_flag8_hb_7(const bool value, const unsigned int data) { return value ? data | 0b1000000000000000 : data & 0b0111111111111111; }
-    unsigned int write_u8_lb(const uint8_t value, const unsigned int data) { return (data & 0xff00) | value; }
-    unsigned int write_u8_hb(const uint8_t value, const unsigned int data) { return (data & 0x00ff) | (value << 8); }
-    unsigned int write_s8_lb(const int8_t value, const unsigned int data) { return (data & 0xff00) | value; }
-    unsigned int write_s8_hb(const int8_t value, const unsigned int data) { return (data & 0x00ff) | (value << 8); }
-    unsigned int write_u16(const uint16_t value, const unsigned int data) { return value; }
-    unsigned int write_s16(const int16_t value, const unsigned int data) { return value; }
-    unsigned int write_f88(const float value, const unsigned int data) { return (unsigned int) (value * 256.0f); }    
-    
-    unsigned int write_str_date(const std::string value, const unsigned int data) { return 0; }
-} // namespace message_data
-}
 #define OPENTHERMGW_IGNORE_1(x)
 #define OPENTHERMGW_IGNORE_2(x, y)
 
 namespace esphome {
     namespace OpenThermGateway {
         static const char * TAG = "OpenThermGateway";
-	OpenTherm *OpenThermGateway::m_otThermostat=NULL;
-	OpenTherm *OpenThermGateway::m_otBoiler=NULL;
+
+	// Logs of the frame handling, compiled out below the configured trace level
+	#if OPENTHERMGW_TRACE_LEVEL>=OPENTHERMGW_TRACE_LEVEL_ERRORS
+	#define OPENTHERMGW_TRACE_ERROR(...) ESP_LOGW(TAG, __VA_ARGS__)
+	#else
+	#define OPENTHERMGW_TRACE_ERROR(...)
+	#endif
+	#if OPENTHERMGW_TRACE_LEVEL>=OPENTHERMGW_TRACE_LEVEL_FRAMES
+	#define OPENTHERMGW_TRACE_FRAME(...) ESP_LOGD(TAG, __VA_ARGS__)
+	#else
+	#define OPENTHERMGW_TRACE_FRAME(...)
+	#endif
+	#if OPENTHERMGW_TRACE_LEVEL>=OPENTHERMGW_TRACE_LEVEL_VERBOSE
+	#define OPENTHERMGW_TRACE_VERBOSE(...) ESP_LOGD(TAG, __VA_ARGS__)
+	#else
+	#define OPENTHERMGW_TRACE_VERBOSE(...)
+	#endif
+
+	// Define the publishers, which publish a response to all entities of that message.
+	// An entity is only published when its raw value changed, at most every min_publish_interval,
+	// and for sensors only when the value moved by at least the deadband. The table is shared by all
+	// gateways, entities of the other gateways are NULL.
+	#define OPENTHERMGW_PUBLISH_SENSOR(key, msg_data, deadband, msMinPublishInterval) \
+		if(gateway->key!=NULL && is_publish_due(gateway->key ## _publish, data, msMinPublishInterval)) \
+		{ \
+			float value=message_data::parse_ ## msg_data(data); \
+			if(!gateway->key ## _publish.bPublished || std::isnan(gateway->key->raw_state) || fabsf(value-gateway->key->raw_state)>=deadband) \
+			{ \
+				set_published(gateway->key ## _publish, data); \
+				gateway->key->publish_state(value); \
+			} \
+		}
+	#define OPENTHERMGW_PUBLISH_BINARY_SENSOR(key, msg_data, deadband, msMinPublishInterval) \
+		if(gateway->key!=NULL && is_publish_due(gateway->key ## _publish, data, msMinPublishInterval)) \
+		{ \
+			set_published(gateway->key ## _publish, data); \
+			gateway->key->publish_state(message_data::parse_ ## msg_data(data)); \
+		}
+	#define OPENTHERMGW_PUBLISH_TEXT_SENSOR(key, msg_data, deadband, msMinPublishInterval) \
+		if(gateway->key!=NULL && is_publish_due(gateway->key ## _publish, data, msMinPublishInterval)) \
+		{ \
+			set_published(gateway->key ## _publish, data); \
+			gateway->key->publish_state(message_data::parse_ ## msg_data(gateway->key, data)); \
+		}
+	#define OPENTHERMGW_PUBLISH_SWITCH(key, msg_data, deadband, msMinPublishInterval) \
+		if(gateway->key!=NULL && !gateway->key->override_enabled && is_publish_due(gateway->key ## _publish, data, msMinPublishInterval)) \
+		{ \
+			set_published(gateway->key ## _publish, data); \
+			gateway->key->publish_state(message_data::parse_ ## msg_data(data)); \
+		}
+	#define OPENTHERMGW_PUBLISH_ENTITY(type, key, msg_data, deadband, msMinPublishInterval) OPENTHERMGW_PUBLISH_ ## type(key, msg_data, deadband, msMinPublishInterval)
+	#define OPENTHERMGW_DEFINE_PUBLISHER(msg, entities) \
+		void OpenThermGateway::publish_ ## msg(OpenThermGateway *gateway, uint16_t data) \
+		{ \
+			OPENTHERMGW_TRACE_VERBOSE("Received %s response", #msg); \
+			entities \
+		}
+	OPENTHERMGW_MESSAGE_PUBLISHERS(OPENTHERMGW_DEFINE_PUBLISHER, OPENTHERMGW_PUBLISH_ENTITY)
+
+	// Define the invalidators, which publish all entities of a message as unknown when the boiler
+	// answers it without data. They are published again on the next acknowledged response.
+	#define OPENTHERMGW_INVALIDATE_SENSOR(key) \
+		if(gateway->key!=NULL && set_invalidated(gateway->key ## _publish)) \
+			gateway->key->publish_state(NAN);
+	#define OPENTHERMGW_INVALIDATE_BINARY_SENSOR(key) \
+		if(gateway->key!=NULL && set_invalidated(gateway->key ## _publish)) \
+			gateway->key->invalidate_state();
+	#define OPENTHERMGW_INVALIDATE_TEXT_SENSOR(key) \
+		if(gateway->key!=NULL && set_invalidated(gateway->key ## _publish)) \
+			gateway->key->publish_state("unknown");
+	#define OPENTHERMGW_INVALIDATE_SWITCH(key) \
+		if(gateway->key!=NULL) \
+			set_invalidated(gateway->key ## _publish);
+	#define OPENTHERMGW_INVALIDATE_ENTITY(type, key, msg_data, deadband, msMinPublishInterval) OPENTHERMGW_INVALIDATE_ ## type(key)
+	#define OPENTHERMGW_DEFINE_INVALIDATOR(msg, entities) \
+		void OpenThermGateway::invalidate_ ## msg(OpenThermGateway *gateway) \
+		{ \
+			entities \
+		}
+	OPENTHERMGW_MESSAGE_PUBLISHERS(OPENTHERMGW_DEFINE_INVALIDATOR, OPENTHERMGW_INVALIDATE_ENTITY)
+
+	#define OPENTHERMGW_PUBLISHER_ADDRESS(msg, entities) &OpenThermGateway::publish_ ## msg,
+	const OpenThermGateway::MessagePublisher OpenThermGateway::s_message_publishers[] = {
+		NULL,
+		OPENTHERMGW_MESSAGE_PUBLISHERS(OPENTHERMGW_PUBLISHER_ADDRESS, )
+	};
+
+	#define OPENTHERMGW_INVALIDATOR_ADDRESS(msg, entities) &OpenThermGateway::invalidate_ ## msg,
+	const OpenThermGateway::MessageInvalidator OpenThermGateway::s_message_invalidators[] = {
+		NULL,
+		OPENTHERMGW_MESSAGE_PUBLISHERS(OPENTHERMGW_INVALIDATOR_ADDRESS, )
+	};
+
+	// Define the rewriters, which patch the data of a thermostat request with the inputs of that message
+	// before it is forwarded, with the message_data encoders. A number overrides the value written by
+	// the thermostat, unless it is 0. An override switch which is off clears its flag, when on the thermostat is in control.
+	#define OPENTHERMGW_REWRITE_NUMBER(key, msg_data) \
+		if(type==OpenThermMessageType::WRITE_DATA && gateway->key!=NULL && gateway->key->has_state() && gateway->key->state!=0) \
+			data=message_data::write_ ## msg_data(gateway->key->state, data);
+	#define OPENTHERMGW_REWRITE_SWITCH(key, msg_data) \
+		if(gateway->key!=NULL && gateway->key->override_enabled && !gateway->key->state) \
+			data=message_data::write_ ## msg_data(false, data);
+	#define OPENTHERMGW_REWRITE_RULE(component, key, msg_data) OPENTHERMGW_REWRITE_ ## component(key, msg_data)
+	#define OPENTHERMGW_DEFINE_REWRITER(msg, rules) \
+		uint16_t OpenThermGateway::rewrite_ ## msg(OpenThermGateway *gateway, OpenThermMessageType type, uint16_t data) \
+		{ \
+			rules \
+			return data; \
+		}
+	OPENTHERMGW_MESSAGE_REWRITERS(OPENTHERMGW_DEFINE_REWRITER, OPENTHERMGW_REWRITE_RULE)
+
+	#define OPENTHERMGW_REWRITER_ADDRESS(msg, rules) &OpenThermGateway::rewrite_ ## msg,
+	const OpenThermGateway::MessageRewriter OpenThermGateway::s_message_rewriters[] = {
+		NULL,
+		OPENTHERMGW_MESSAGE_REWRITERS(OPENTHERMGW_REWRITER_ADDRESS, )
+	};
+
+	bool OpenThermGateway::is_publish_due(SPublishState &state, uint16_t data, unsigned long msMinPublishInterval)
+	{
+		if(!state.bPublished)
+			return true;
+		return state.data!=data && OpenThermPhy::millis()-state.msLastPublish>=msMinPublishInterval;
+	}
+
+	void OpenThermGateway::set_published(SPublishState &state, uint16_t data)
+	{
+		state.data=data;
+		state.bPublished=true;
+		state.bInvalidated=false;
+		state.msLastPublish=OpenThermPhy::millis();
+	}
+
+	// True when the entity has to be published as unknown, once until it is published again
+	bool OpenThermGateway::set_invalidated(SPublishState &state)
+	{
+		if(state.bInvalidated)
+			return false;
+		state.bPublished=false;
+		state.bInvalidated=true;
+		return true;
+	}
+
+	const SMessageHandler OpenThermGateway::s_message_handlers[256] PROGMEM = { OPENTHERMGW_MESSAGE_TABLE };
+
+	void OpenThermGatewayWriter::queue_write()
+	{
+		if(this->gateway!=NULL)
+			this->gateway->queue_write(this->message_id, this->priority);
+	}
+	OpenThermGateway *OpenThermGateway::s_instances[OPENTHERMGW_INSTANCES]={ NULL };
+
+	template<uint8_t INSTANCE> void IRAM_ATTR OpenThermGateway::handleInterruptThermostat()
+	{
+		OpenThermGateway *gateway=s_instances[INSTANCE];
+		if(gateway!=NULL && gateway->m_otThermostat!=NULL)
+			gateway->m_otThermostat->handleInterrupt();
+	}
+
+	template<uint8_t INSTANCE> void IRAM_ATTR OpenThermGateway::handleInterruptBoiler()
+	{
+		OpenThermGateway *gateway=s_instances[INSTANCE];
+		if(gateway!=NULL && gateway->m_otBoiler!=NULL)
+			gateway->m_otBoiler->handleInterrupt();
+	}
+
+	template<uint8_t INSTANCE> void IRAM_ATTR OpenThermGateway::handleTimerInterruptThermostat()
+	{
+		OpenThermGateway *gateway=s_instances[INSTANCE];
+		if(gateway!=NULL && gateway->m_otThermostat!=NULL)
+			gateway->m_otThermostat->handleTimerInterrupt();
+	}
+
+	template<uint8_t INSTANCE> void IRAM_ATTR OpenThermGateway::handleTimerInterruptBoiler()
+	{
+		OpenThermGateway *gateway=s_instances[INSTANCE];
+		if(gateway!=NULL && gateway->m_otBoiler!=NULL)
+			gateway->m_otBoiler->handleTimerInterrupt();
+	}
+
+	// Only the handlers of the configured instances are instantiated (and take IRAM)
+	static_assert(OPENTHERMGW_INSTANCES>=1 && OPENTHERMGW_INSTANCES<=OPENTHERMGW_MAX_INSTANCES, "Unsupported number of gateways");
+	#define OPENTHERMGW_INTERRUPT_HANDLERS(instance) \
+		{ &handleInterruptThermostat<instance>, &handleInterruptBoiler<instance>, &handleTimerInterruptThermostat<instance>, &handleTimerInterruptBoiler<instance> }
+	const OpenThermGateway::SInterruptHandlers OpenThermGateway::s_interrupt_handlers[OPENTHERMGW_INSTANCES] = {
+		OPENTHERMGW_INTERRUPT_HANDLERS(0),
+#if OPENTHERMGW_INSTANCES>1
+		OPENTHERMGW_INTERRUPT_HANDLERS(1),
+#endif
+#if OPENTHERMGW_INSTANCES>2
+		OPENTHERMGW_INTERRUPT_HANDLERS(2),
+#endif
+#if OPENTHERMGW_INSTANCES>3
+		OPENTHERMGW_INTERRUPT_HANDLERS(3),
+#endif
+	};
 
         OpenThermGateway::OpenThermGateway() : PollingComponent(100)
 	{
@@ -110,6 +224,9 @@ namespace esphome {
 			delete m_otBoiler;
 			m_otBoiler=NULL;
 		}		
+
+		if(m_instance<OPENTHERMGW_INSTANCES && s_instances[m_instance]==this)
+			s_instances[m_instance]=NULL;
 	}
 
 	void OpenThermGateway::dump_config() 
@@ -118,11 +235,36 @@ namespace esphome {
 		#define SHOW2(x) #x
 		#define SHOW(x) SHOW2(x)
 	
-		ESP_LOGCONFIG(TAG, "OpenTherm:");
+		ESP_LOGCONFIG(TAG, "OpenTherm gateway %u:", m_instance);
 		ESP_LOGCONFIG(TAG, "  Thermostat In: GPIO%d", m_pinThermostatIn);
 		ESP_LOGCONFIG(TAG, "  Thermostat Out: GPIO%d", m_pinThermostatOut);
 		ESP_LOGCONFIG(TAG, "  Boiler In: GPIO%d", m_pinBoilerIn);
 		ESP_LOGCONFIG(TAG, "  Boiler Out: GPIO%d", m_pinBoilerOut);
+		ESP_LOGCONFIG(TAG, "  Deferred decoding: %s", m_bDeferredDecoding ? "yes" : "no");
+		ESP_LOGCONFIG(TAG, "  Adaptive decoding: %s", m_bAdaptiveDecoding ? "yes" : "no");
+		ESP_LOGCONFIG(TAG, "  Hardware timers: %s", m_bHardwareTimer ? "yes" : "no");
+		ESP_LOGCONFIG(TAG, "  Frame capture: %u records (%u bytes)", m_captureSize, (unsigned int)(m_captureSize*sizeof(SCaptureRecord)));
+		ESP_LOGCONFIG(TAG, "  Read cache: %s (%d messages)", m_bReadCache ? "yes" : "no", OPENTHERMGW_READ_CACHE_SLOTS);
+		ESP_LOGCONFIG(TAG, "  Write queue: %d messages", OPENTHERMGW_REWRITE_SLOTS);
+		ESP_LOGCONFIG(TAG, "  Warm start: %s (%d messages)", m_bWarmStart ? "yes" : "no", OPENTHERMGW_WARM_START_SLOTS);
+		if(m_msReplyDeadline>0)
+			ESP_LOGCONFIG(TAG, "  Reply deadline: %u ms", (unsigned int)m_msReplyDeadline);
+		else
+			ESP_LOGCONFIG(TAG, "  Reply deadline: none");
+		ESP_LOGCONFIG(TAG, "  Boiler response timeout: %lu ms", getBoilerResponseTimeout());
+		if(m_fAutoUpdateBudget>0)
+			ESP_LOGCONFIG(TAG, "  Auto-update budget: %.0f%% of idle bus time", m_fAutoUpdateBudget*100);
+		else
+			ESP_LOGCONFIG(TAG, "  Auto-update budget: 1 message every 2 secs");
+		ESP_LOGCONFIG(TAG, "  RAM: gateway %u bytes (message registries %u), OpenTherm interfaces %u bytes, capture buffer %u bytes",
+			(unsigned int)sizeof(*this),
+			(unsigned int)(sizeof(m_initial_messages)+sizeof(m_auto_update_messages)+sizeof(m_auto_update_heaps)+sizeof(m_cached_responses)),
+			(unsigned int)(2*sizeof(OpenTherm)), (unsigned int)(m_captureSize*sizeof(SCaptureRecord)));
+#if defined(USE_ESP8266)
+		ESP_LOGCONFIG(TAG, "  Free heap: %u bytes, fragmentation %u%%", ESP.getFreeHeap(), (unsigned int)ESP.getHeapFragmentation());
+#elif defined(USE_ESP32)
+		ESP_LOGCONFIG(TAG, "  Free heap: %u bytes, largest block %u bytes", (unsigned int)heap_caps_get_free_size(MALLOC_CAP_8BIT), (unsigned int)heap_caps_get_largest_free_block(MALLOC_CAP_8BIT));
+#endif
 		ESP_LOGCONFIG(TAG, "  Sensors: %s", SHOW(OPENTHERMGW_SENSOR_LIST(ID, )));
 		ESP_LOGCONFIG(TAG, "  Binary sensors: %s", SHOW(OPENTHERMGW_BINARY_SENSOR_LIST(ID, )));
 		ESP_LOGCONFIG(TAG, "  Text sensors: %s", SHOW(OPENTHERMGW_TEXT_SENSOR_LIST(ID, )));
@@ -130,24 +272,71 @@ namespace esphome {
 		ESP_LOGCONFIG(TAG, "  Input sensors: %s", SHOW(OPENTHERMGW_INPUT_SENSOR_LIST(ID, )));
 		ESP_LOGCONFIG(TAG, "  Outputs: %s", SHOW(OPENTHERMGW_OUTPUT_LIST(ID, )));
 		ESP_LOGCONFIG(TAG, "  Numbers: %s", SHOW(OPENTHERMGW_NUMBER_LIST(ID, )));
+		ESP_LOGCONFIG(TAG, "  Diagnostic sensors: %s", SHOW(OPENTHERMGW_DIAGNOSTIC_SENSOR_LIST(ID, )));
 	}
 
         void OpenThermGateway::setup() 
         {
+		if(m_instance>=OPENTHERMGW_INSTANCES || s_instances[m_instance]!=NULL)
+		{
+			ESP_LOGE(TAG, "Gateway %u: no interrupt handlers left", m_instance);
+			mark_failed();
+			return;
+		}
+		s_instances[m_instance]=this;
+		const SInterruptHandlers &handlers=s_interrupt_handlers[m_instance];
+
+		// Hardware timers 2n and 2n+1 for gateway n
 	        m_otThermostat=new OpenTherm(m_pinThermostatIn, m_pinThermostatOut, true);
-	        m_otThermostat->begin(handleInterruptThermostat, processRequestThermostat, this);
+	        m_otThermostat->setDeferredDecoding(m_bDeferredDecoding);
+	        m_otThermostat->setAdaptiveDecoding(m_bAdaptiveDecoding);
+	        m_otThermostat->begin(handlers.thermostat, processRequestThermostat, this);
+	        if(m_bHardwareTimer && !m_otThermostat->beginTimer(2*m_instance, handlers.timerThermostat))
+	        	ESP_LOGW(TAG, "Gateway %u: no hardware timer for thermostat, frames will be sent blocking", m_instance);
 
 	        m_otBoiler=new OpenTherm(m_pinBoilerIn, m_pinBoilerOut);
-	        m_otBoiler->begin(handleInterruptBoiler);	        
+	        m_otBoiler->setDeferredDecoding(m_bDeferredDecoding);
+	        m_otBoiler->setAdaptiveDecoding(m_bAdaptiveDecoding);
+	        m_otBoiler->begin(handlers.boiler, processResponseBoiler, this);
+	        if(m_bHardwareTimer && !m_otBoiler->beginTimer(2*m_instance+1, handlers.timerBoiler))
+	        	ESP_LOGW(TAG, "Gateway %u: no hardware timer for boiler, frames will be sent blocking", m_instance);
 	        
-		m_msLastLoop=millis();
+		m_msLastLoop=OpenThermPhy::millis();
+		m_msStatisticsStart=m_msLastLoop;
+
+		if(m_captureSize>0)
+		{
+			m_pCapture=new SCaptureRecord[m_captureSize];
+			// The services of the other gateways are suffixed with their index
+			std::string suffix=m_instance>0 ? "_"+to_string(m_instance) : "";
+			register_service(&OpenThermGateway::on_capture_export, "capture_export"+suffix);
+			register_service(&OpenThermGateway::on_capture_clear, "capture_clear"+suffix);
+		}
 		
-		m_current_message_iterator = m_initial_messages.begin();
-		m_auto_update_message_iterator = m_map_auto_update_messages.begin();		
+		if(m_bWarmStart)
+			restoreWarmStart();
+
+		// Messages the boiler doesn't support start with the longest update time, those it was never asked
+		// about are discovered after the initial messages
+		for(uint8_t slot=1; slot<=OPENTHERMGW_AUTO_UPDATE_SLOTS; slot++)
+		{
+			SAutoUpdateMessage &message=m_auto_update_messages[slot];
+			if(message.msTimeUpdate==0)
+				continue;
+			uint8_t id=(uint8_t)message.id;
+			if(m_warm_start.unsupported.contains(id))
+				message.backoff=AUTO_UPDATE_MAX_BACKOFF;
+			else if(!m_warm_start.supported.contains(id) && !m_initial_messages.contains(id))
+				m_discovery_messages.add(id);
+			scheduleAutoUpdate(slot, m_msLastLoop+getAutoUpdateTime(message));
+		}
         }
  
 	void OpenThermGateway::on_shutdown() 
 	{
+		if(m_bWarmStart && m_bWarmStartChanged)
+			saveWarmStart();
+
 		if(m_otThermostat!=NULL)
 			m_otThermostat->end();
 
@@ -158,87 +347,703 @@ namespace esphome {
 	void OpenThermGateway::add_initial_message(OpenThermMessageID message_id)
 	{			
 		ESP_LOGD("OpenThermGateway", "Adding initial message %d", message_id);
-		if(std::find(m_initial_messages.begin(), m_initial_messages.end(), message_id)==m_initial_messages.end())
-			m_initial_messages.insert(message_id); 
+		m_initial_messages.add(message_id);
 	}
 
-	void OpenThermGateway::add_auto_update_message(OpenThermMessageID message_id, int32_t secUpdateTime)
+	void OpenThermGateway::add_auto_update_message(OpenThermMessageID message_id, int32_t secUpdateTime, EMessagePriority priority)
 	{
-		ESP_LOGD("OpenThermGateway", "Adding auto update message %d every %d sec", message_id, secUpdateTime);
-		m_map_auto_update_messages[message_id].msTimeSinceLastUpdate=0;
-		if(m_map_auto_update_messages[message_id].msTimeUpdate==0 || m_map_auto_update_messages[message_id].msTimeUpdate>secUpdateTime*1000)
-			m_map_auto_update_messages[message_id].msTimeUpdate=secUpdateTime*1000;
+		ESP_LOGD("OpenThermGateway", "Adding auto update message %d every %d sec (priority %d)", message_id, secUpdateTime, priority);
+		uint8_t slot=progmem_read_byte(&s_message_handlers[(uint8_t)message_id].autoUpdateSlot);
+		if(slot==0)
+		{
+			ESP_LOGW("OpenThermGateway", "No auto update slot for message %d", message_id);
+			return;
+		}
+
+		SAutoUpdateMessage &message=m_auto_update_messages[slot];
+		message.id=message_id;
+		message.priority=priority;
+		if(message.msTimeUpdate==0 || message.msTimeUpdate>secUpdateTime*1000)
+			message.msTimeUpdate=secUpdateTime*1000;
 	}
 
-	void IRAM_ATTR OpenThermGateway::handleInterruptThermostat()
+	void OpenThermGateway::add_cached_message(OpenThermMessageID message_id, int32_t secCacheTime)
 	{
-		if(m_otThermostat!=NULL)
-			m_otThermostat->handleInterrupt();
+		ESP_LOGD("OpenThermGateway", "Caching message %d for %d sec", message_id, secCacheTime);
+		uint8_t slot=progmem_read_byte(&s_message_handlers[(uint8_t)message_id].cacheSlot);
+		if(slot==0)
+		{
+			ESP_LOGW("OpenThermGateway", "No read cache slot for message %d", message_id);
+			return;
+		}
+
+		SCachedResponse &cached=m_cached_responses[slot];
+		cached.id=message_id;
+		if(cached.msCacheTime==0 || cached.msCacheTime>secCacheTime*1000)
+			cached.msCacheTime=secCacheTime*1000;
 	}
 
-	void IRAM_ATTR OpenThermGateway::handleInterruptBoiler()
+	void OpenThermGateway::queue_write(OpenThermMessageID message_id, EMessagePriority priority)
 	{
-		if(m_otBoiler!=NULL)
-			m_otBoiler->handleInterrupt();
+		uint8_t rewriter=progmem_read_byte(&s_message_handlers[(uint8_t)message_id].rewriter);
+		if(rewriter==0)
+		{
+			ESP_LOGW("OpenThermGateway", "No rewriter for message %d", message_id);
+			return;
+		}
+
+		// Last write wins: the request is only built when it is sent, a pending write just keeps its highest priority
+		SQueuedWrite &write=m_queued_writes[rewriter];
+		write.id=message_id;
+		if(!write.bPending)
+		{
+			write.bPending=true;
+			write.priority=priority;
+			write.msQueued=OpenThermPhy::millis();
+		}
+		else if(priority<write.priority)
+			write.priority=priority;
+		OPENTHERMGW_TRACE_VERBOSE("Write of message %d queued", message_id);
 	}
 
 	void OpenThermGateway::processRequestThermostat(unsigned long request, OpenThermResponseStatus status)
 	{
 		if(request==0)
 			return;				
+
+		captureFrame(CAPTURE_FROM_THERMOSTAT, request, status, m_otThermostat->getLastFrame().startTimestamp);
 		
 		OpenThermMessageType requestType=m_otThermostat->getMessageType(request);
 		OpenThermMessageID requestDataID=m_otThermostat->getDataID(request);
 		uint16_t requestData=(uint16_t)request;
 
-		ESP_LOGD(TAG, "Thermostat request (%08X) : MessageType: %s, DataID: %d, Data: %x] (%s)", request, m_otThermostat->messageTypeToString(requestType), requestDataID, requestData, m_otThermostat->statusToString(status));
+		OPENTHERMGW_TRACE_FRAME("Thermostat request (%08X) : MessageType: %s, DataID: %d, Data: %x] (%s)", request, m_otThermostat->messageTypeToString(requestType), requestDataID, requestData, m_otThermostat->statusToString(status));
 
 		if(status==OpenThermResponseStatus::SUCCESS)
 		{			
 			parseRequest(requestType, requestDataID, requestData);
 			if(m_otBoiler!=NULL)
 			{
-				// Handle overrides
-#ifdef OPENTHERMGW_HAS_NUMBER_t_roomset_override
-				if(requestDataID==OpenThermMessageID::TrSet)
+				// Overrides are patched in the request itself, it costs no extra transaction. The request as sent
+				// by the thermostat is kept for the queued writes, and a pending write is done by this one.
+				uint8_t rewriter=progmem_read_byte(&s_message_handlers[(uint8_t)requestDataID].rewriter);
+				if(rewriter!=0 && (requestType==OpenThermMessageType::WRITE_DATA || requestDataID==OpenThermMessageID::Status))
+				{
+					m_queued_writes[rewriter].lastRequest=request;
+					m_queued_writes[rewriter].bPending=false;
+				}
+				request=rewriteRequest(rewriter, requestType, requestDataID, request);
+
+				// Answer reads of static data from the cache, without waiting for the boiler. The response is sent
+				// from advanceTransactions(), once the minimum response time has passed.
+				uint16_t cachedData;
+				if(m_bReadCache && requestType==OpenThermMessageType::READ_DATA && m_thermostatTransaction.state==TRANSACTION_IDLE && getCachedResponse(requestDataID, cachedData))
+				{
+					unsigned long response=m_otThermostat->buildResponse(OpenThermMessageType::READ_ACK, requestDataID, cachedData);
+					OPENTHERMGW_TRACE_FRAME("Thermostat request (%08X) answered from cache (%08X)", request, response);
+					m_thermostatTransaction.request=request;
+					m_thermostatTransaction.response=response;
+					m_thermostatTransaction.responseStatus=OpenThermResponseStatus::SUCCESS;
+					m_thermostatTransaction.usReceived=m_otThermostat->getLastFrame().endTimestamp;
+					m_thermostatTransaction.bReplied=false;
+					m_thermostatTransaction.retries=0;
+					m_thermostatTransaction.state=TRANSACTION_CACHED;
+					return;
+				}
+
+				// The thermostat has to wait for an auto-update, back off
+				if(m_gatewayTransaction.state!=TRANSACTION_IDLE && m_fAutoUpdateBudget>0)
+				{
+					m_fBudgetScale=std::max(m_fBudgetScale/2, 0.125f);
+					OPENTHERMGW_TRACE_VERBOSE("Thermostat request delayed by auto-update, budget scaled to %.3f", m_fBudgetScale);
+				}
+
+				// The previous request got its fallback response, its boiler response is still awaited aside.
+				// Only one late response is awaited, rather than losing track of it the new request is dropped.
+				if(m_thermostatTransaction.bReplied && (m_thermostatTransaction.state==TRANSACTION_FORWARDING || m_thermostatTransaction.state==TRANSACTION_AWAITING_BOILER))
 				{
-					if(this->t_roomset_override_number->has_state())
+					if(m_lateTransaction.state!=TRANSACTION_IDLE)
 					{
-						float fValue=this->t_roomset_override_number->state;
-						if(fValue!=0.)
-						{
-							unsigned int data = m_otBoiler->temperatureToData(fValue);
-							unsigned int requestOverride=m_otBoiler->buildRequest(OpenThermMessageType::WRITE_DATA, requestDataID, data);
-							ESP_LOGD(TAG, "t_roomsetoverride : %f (%x -> %x)", fValue, request, requestOverride);
-
-							request=requestOverride;
-						}
+						OPENTHERMGW_TRACE_ERROR("Thermostat request (%08X) dropped, late boiler response for request (%08X) still pending", request, m_lateTransaction.request);
+						m_droppedRequests++;
+						return;
 					}
+					m_lateTransaction=m_thermostatTransaction;
+					m_thermostatTransaction.state=TRANSACTION_IDLE;
 				}
-#endif
-				unsigned long response = m_otBoiler->sendRequest(request);
-				if (response!=0)
+				else if(m_thermostatTransaction.state!=TRANSACTION_IDLE && m_thermostatTransaction.state!=TRANSACTION_RECEIVED && m_thermostatTransaction.state!=TRANSACTION_CACHED)
 				{
-					OpenThermMessageType responseType=m_otThermostat->getMessageType(response);
-					OpenThermMessageID responseDataID=m_otThermostat->getDataID(response);
-					uint16_t responseData=(uint16_t)response;
-					m_otThermostat->sendResponse(response);
-					parseResponse(responseType, responseDataID, responseData);
+					OPENTHERMGW_TRACE_ERROR("Thermostat request (%08X) dropped, previous request still pending", request);
+					m_droppedRequests++;
+					return;
 				}
+
+				m_thermostatTransaction.request=request;
+				m_thermostatTransaction.response=0;
+				m_thermostatTransaction.responseStatus=OpenThermResponseStatus::NONE;
+				m_thermostatTransaction.usReceived=m_otThermostat->getLastFrame().endTimestamp;
+				m_thermostatTransaction.bReplied=false;
+				m_thermostatTransaction.retries=0;
+				m_thermostatTransaction.state=TRANSACTION_RECEIVED;
+				advanceTransactions();
 			}
 		}
 	}
 
-	void OpenThermGateway::parseRequest(OpenThermMessageType type, OpenThermMessageID dataID, uint16_t data)
+	void OpenThermGateway::processResponseBoiler(unsigned long response, OpenThermResponseStatus status)
+	{
+		captureFrame(CAPTURE_FROM_BOILER, response, status, status==OpenThermResponseStatus::TIMEOUT ? OpenThermPhy::micros() : m_otBoiler->getLastFrame().startTimestamp);
+
+		STransaction *pTransaction=NULL;
+		if(m_lateTransaction.state==TRANSACTION_FORWARDING || m_lateTransaction.state==TRANSACTION_AWAITING_BOILER)
+			pTransaction=&m_lateTransaction;
+		else if(m_thermostatTransaction.state==TRANSACTION_FORWARDING || m_thermostatTransaction.state==TRANSACTION_AWAITING_BOILER)
+			pTransaction=&m_thermostatTransaction;
+		else if(m_gatewayTransaction.state==TRANSACTION_FORWARDING || m_gatewayTransaction.state==TRANSACTION_AWAITING_BOILER)
+			pTransaction=&m_gatewayTransaction;
+		
+		if(pTransaction==NULL)
+			return;
+
+		pTransaction->response=response;
+		pTransaction->responseStatus=status;
+
+		// UNKNOWN_DATA_ID and DATA_INVALID answers fail isValidResponse() but still have to reach the thermostat
+		bool bValid=response!=0 && (status==OpenThermResponseStatus::SUCCESS || status==OpenThermResponseStatus::INVALID_MESSAGE);
+
+		OpenThermMessageType responseType=m_otBoiler->getMessageType(response);
+		OpenThermMessageID responseDataID=m_otBoiler->getDataID(response);
+		uint16_t responseData=(uint16_t)response;
+
+		m_usBusBusy+=OpenThermPhy::micros()-pTransaction->usStart;
+		if(bValid)
+		{
+			unsigned long msResponse=(m_otBoiler->getLastFrame().startTimestamp-m_otBoiler->getTransmitEndTimestamp())/1000;
+			addLatency(m_boilerResponseTime, msResponse);
+		}
+		updateBoilerHealth(bValid, status);
+
+		// The thermostat already got the fallback response, the boiler response only updates the entities
+		if(pTransaction->bReplied)
+		{
+			pTransaction->state=TRANSACTION_IDLE;
+			if(bValid)
+			{
+				OPENTHERMGW_TRACE_FRAME("Late boiler response (%08X) for thermostat request (%08X)", response, pTransaction->request);
+				parseResponse(responseType, responseDataID, responseData);
+			}
+			return;
+		}
+
+		if(pTransaction==&m_thermostatTransaction)
+		{
+			if(bValid)
+			{
+				m_otThermostat->sendResponseTimer(response);
+				captureFrame(CAPTURE_TO_THERMOSTAT, response, status, OpenThermPhy::micros());
+				pTransaction->state=TRANSACTION_REPLYING;
+				parseResponse(responseType, responseDataID, responseData);
+			} else {
+				OPENTHERMGW_TRACE_FRAME("No valid boiler response for thermostat request (%08X) (%s)", pTransaction->request, m_otBoiler->statusToString(status));
+				if(retryThermostatRequest(*pTransaction))
+					return;
+				// Rather than letting the thermostat time out, it gets the fallback response right away
+				if(m_msReplyDeadline>0)
+				{
+					replyFallback();
+					pTransaction->state=TRANSACTION_REPLYING;
+				}
+				else
+					pTransaction->state=TRANSACTION_IDLE;
+			}
+			return;
+		}
+
+		pTransaction->state=TRANSACTION_IDLE;
+		if(m_fAutoUpdateBudget>0)
+		{
+			m_fBusCredit-=OpenThermPhy::millis()-m_msGatewayTransactionStart;
+			m_fBudgetScale=std::min(m_fBudgetScale+0.0625f, 1.0f);
+		}
+		if(bValid)
+		{
+			OPENTHERMGW_TRACE_FRAME("Boiler response (%08X) : MessageType: %s, DataID: %d, Data: %x]", response, m_otBoiler->messageTypeToString(responseType), responseDataID, responseData);
+			m_retried_messages.remove((uint8_t)responseDataID);
+			parseResponse(responseType, responseDataID, responseData);
+		} else {
+			OPENTHERMGW_TRACE_FRAME("No valid boiler response for gateway request (%08X) (%s)", pTransaction->request, m_otBoiler->statusToString(status));
+			retryGatewayRequest(*pTransaction);
+		}
+	}
+
+	// Time from a thermostat request to its response, the reply deadline or the 800ms of the spec without one
+	unsigned long OpenThermGateway::getThermostatDeadline() const
 	{
+		return m_msReplyDeadline>0 ? m_msReplyDeadline : 800;
 	}
 
-	void OpenThermGateway::parseResponse(OpenThermMessageType type, OpenThermMessageID dataID, uint16_t data)
+	// The 800ms of the spec unless boiler_response_timeout is set
+	unsigned long OpenThermGateway::getBoilerResponseTimeout() const
 	{
-		bool bHandled=false;
+		return m_msBoilerResponseTimeout>0 ? m_msBoilerResponseTimeout : BOILER_RESPONSE_TIMEOUT;
+	}
 
-		ESP_LOGD(TAG, "Boiler response [MessageType: %s, DataID: %d, Data: %x]", m_otBoiler->messageTypeToString(type), dataID, data);
-		
+	// Invalid or missing responses are forwarded again while the thermostat can still get the response in time.
+	// After a timeout the boiler bus stays in DELAY until a response of a compliant boiler would be over, the retry
+	// waits for it.
+	bool OpenThermGateway::retryThermostatRequest(STransaction &transaction)
+	{
+		unsigned long msDeadline=getThermostatDeadline();
+		unsigned long msElapsed=(OpenThermPhy::micros()-transaction.usReceived)/1000;
+		unsigned long msBusDelay=m_otBoiler->getRemainingDelay()/1000;
+		if(m_bBoilerOffline || transaction.retries>=THERMOSTAT_MAX_RETRIES || msElapsed+msBusDelay+THERMOSTAT_RETRY_TIME>=msDeadline)
+			return false;
+
+		transaction.retries++;
+		transaction.state=TRANSACTION_RECEIVED;
+		m_boilerRetries++;
+		OPENTHERMGW_TRACE_FRAME("Thermostat request (%08X) forwarded again (retry %u, %lu ms after the request)", transaction.request, transaction.retries, msElapsed);
+		return true;
+	}
+
+	// Auto-updates are read again sooner than their update time, the delay doubling with each failure. Other requests
+	// are retried once in the background, writes by queuing them again.
+	void OpenThermGateway::retryGatewayRequest(const STransaction &transaction)
+	{
+		OpenThermMessageID dataID=m_otBoiler->getDataID(transaction.request);
+		const SMessageHandler *pHandler=&s_message_handlers[(uint8_t)dataID];
+		uint8_t autoUpdateSlot=progmem_read_byte(&pHandler->autoUpdateSlot);
+		uint8_t rewriter=progmem_read_byte(&pHandler->rewriter);
+		bool bWrite=m_otBoiler->getMessageType(transaction.request)==OpenThermMessageType::WRITE_DATA;
+
+		if(!bWrite && autoUpdateSlot!=0 && m_auto_update_messages[autoUpdateSlot].msTimeUpdate>0)
+		{
+			SAutoUpdateMessage &message=m_auto_update_messages[autoUpdateSlot];
+			if(message.failures<AUTO_UPDATE_MAX_BACKOFF)
+				message.failures++;
+			unsigned long msRetry=std::min(AUTO_UPDATE_RETRY_TIME<<(message.failures-1), getAutoUpdateTime(message));
+			OPENTHERMGW_TRACE_FRAME("Auto-update DataID: %d read again in %lu ms", dataID, msRetry);
+			scheduleAutoUpdate(autoUpdateSlot, OpenThermPhy::millis()+msRetry);
+		}
+		else if(m_retried_messages.contains((uint8_t)dataID))
+		{
+			m_retried_messages.remove((uint8_t)dataID);
+			OPENTHERMGW_TRACE_ERROR("Gateway request (%08X) failed again, dropped", transaction.request);
+		}
+		else
+		{
+			m_retried_messages.add((uint8_t)dataID);
+			if(bWrite && rewriter!=0)
+				queue_write(dataID, m_queued_writes[rewriter].priority);
+			else
+				m_retry_messages.add((uint8_t)dataID);
+		}
+	}
+
+	// Counts the outcome of every boiler transaction and takes the boiler offline, or back online
+	void OpenThermGateway::updateBoilerHealth(bool bValid, OpenThermResponseStatus status)
+	{
+		if(bValid)
+		{
+			if(m_bBoilerOffline)
+				ESP_LOGI(TAG, "Gateway %u: boiler back online", m_instance);
+			m_boilerFailures=0;
+			m_bBoilerOffline=false;
+			m_boilerOfflineBackoff=0;
+			return;
+		}
+
+		if(status==OpenThermResponseStatus::TIMEOUT)
+			m_boilerTimeouts++;
+		else
+			m_boilerInvalidResponses++;
+
+		if(m_bBoilerOffline)
+			m_boilerOfflineBackoff=std::min<uint8_t>(m_boilerOfflineBackoff+1, BOILER_OFFLINE_MAX_BACKOFF);
+		else if(++m_boilerFailures>=BOILER_OFFLINE_FAILURES)
+		{
+			m_bBoilerOffline=true;
+			m_boilerOfflineCount++;
+			ESP_LOGW(TAG, "Gateway %u: boiler offline after %u transactions without valid response", m_instance, m_boilerFailures);
+		}
+		else
+			return;
+		m_msBoilerProbe=OpenThermPhy::millis()+(BOILER_OFFLINE_PROBE_TIME<<m_boilerOfflineBackoff);
+	}
+
+	// While the boiler is offline the gateway sends one request per probe time
+	bool OpenThermGateway::isGatewayRequestAllowed()
+	{
+		return !m_bBoilerOffline || (long)(OpenThermPhy::millis()-m_msBoilerProbe)>=0;
+	}
+
+	bool OpenThermGateway::isBoilerBusFree()
+	{
+		return m_otBoiler!=NULL && m_otBoiler->isReady() && m_thermostatTransaction.state==TRANSACTION_IDLE && m_gatewayTransaction.state==TRANSACTION_IDLE && m_lateTransaction.state==TRANSACTION_IDLE;
+	}
+
+	bool OpenThermGateway::startGatewayTransaction(OpenThermMessageID request_id)
+	{
+		if(!isBoilerBusFree())
+			return false;
+
+		return sendGatewayRequest(build_request(request_id));
+	}
+
+	bool OpenThermGateway::sendGatewayRequest(unsigned long request)
+	{
+		if(!isBoilerBusFree())
+			return false;
+		m_otBoiler->setResponseTimeout(getBoilerResponseTimeout()*1000);
+		if(!m_otBoiler->sendRequestTimer(request))
+			return false;
+
+		m_gatewayTransaction.request=request;
+		m_gatewayTransaction.response=0;
+		m_gatewayTransaction.responseStatus=OpenThermResponseStatus::NONE;
+		m_gatewayTransaction.state=TRANSACTION_FORWARDING;
+		m_gatewayTransaction.usStart=OpenThermPhy::micros();
+		captureFrame(CAPTURE_TO_BOILER, request, OpenThermResponseStatus::NONE, m_gatewayTransaction.usStart);
+		m_msGatewayTransactionStart=OpenThermPhy::millis();
+		m_gatewayFrames++;
+		return true;
+	}
+
+	void OpenThermGateway::advanceTransactions()
+	{
+		// OpenTherm gives the boiler 800ms to respond, past the deadline the thermostat gets a fallback response
+		// while the request still goes to the boiler
+		if(m_msReplyDeadline>0 && !m_thermostatTransaction.bReplied
+			&& (m_thermostatTransaction.state==TRANSACTION_RECEIVED || m_thermostatTransaction.state==TRANSACTION_FORWARDING || m_thermostatTransaction.state==TRANSACTION_AWAITING_BOILER)
+			&& OpenThermPhy::micros()-m_thermostatTransaction.usReceived>=m_msReplyDeadline*1000)
+		{
+			OPENTHERMGW_TRACE_ERROR("No boiler response for thermostat request (%08X) within %u ms", m_thermostatTransaction.request, m_msReplyDeadline);
+			replyFallback();
+		}
+
+		if(m_thermostatTransaction.state==TRANSACTION_CACHED && OpenThermPhy::micros()-m_thermostatTransaction.usReceived>=THERMOSTAT_MIN_RESPONSE_TIME*1000)
+		{
+			m_otThermostat->sendResponseTimer(m_thermostatTransaction.response);
+			captureFrame(CAPTURE_TO_THERMOSTAT, m_thermostatTransaction.response, OpenThermResponseStatus::SUCCESS, OpenThermPhy::micros());
+			m_thermostatTransaction.state=TRANSACTION_REPLYING;
+		}
+
+		if(m_thermostatTransaction.state==TRANSACTION_RECEIVED && m_gatewayTransaction.state==TRANSACTION_IDLE && m_lateTransaction.state==TRANSACTION_IDLE && m_otBoiler->isReady())
+		{
+			m_otBoiler->setResponseTimeout(getBoilerResponseTimeout()*1000);
+			if(m_otBoiler->sendRequestTimer(m_thermostatTransaction.request))
+			{
+				m_thermostatTransaction.state=TRANSACTION_FORWARDING;
+				m_thermostatTransaction.usStart=OpenThermPhy::micros();
+				captureFrame(CAPTURE_TO_BOILER, m_thermostatTransaction.request, OpenThermResponseStatus::NONE, m_thermostatTransaction.usStart);
+				addLatency(m_forwardLatency, (m_thermostatTransaction.usStart-m_thermostatTransaction.usReceived)/1000);
+			}
+		}
+
+		if(m_thermostatTransaction.state==TRANSACTION_FORWARDING && m_otBoiler->status!=OpenThermStatus::REQUEST_SENDING)
+			m_thermostatTransaction.state=TRANSACTION_AWAITING_BOILER;
+		if(m_gatewayTransaction.state==TRANSACTION_FORWARDING && m_otBoiler->status!=OpenThermStatus::REQUEST_SENDING)
+			m_gatewayTransaction.state=TRANSACTION_AWAITING_BOILER;
+		if(m_lateTransaction.state==TRANSACTION_FORWARDING && m_otBoiler->status!=OpenThermStatus::REQUEST_SENDING)
+			m_lateTransaction.state=TRANSACTION_AWAITING_BOILER;
+
+		if(m_thermostatTransaction.state==TRANSACTION_REPLYING && m_otThermostat->status!=OpenThermStatus::REQUEST_SENDING)
+			m_thermostatTransaction.state=TRANSACTION_IDLE;
+	}
+
+	// Reads get the last value acknowledged by the boiler, writes are acknowledged when the boiler supports
+	// the ID, anything else is DATA_INVALID
+	void OpenThermGateway::replyFallback()
+	{
+		STransaction &transaction=m_thermostatTransaction;
+		OpenThermMessageType type=m_otThermostat->getMessageType(transaction.request);
+		OpenThermMessageID dataID=m_otThermostat->getDataID(transaction.request);
+		uint16_t data=(uint16_t)transaction.request;
+		unsigned long response;
+		if(type==OpenThermMessageType::READ_DATA && getLastResponse(dataID, data))
+			response=m_otThermostat->buildResponse(OpenThermMessageType::READ_ACK, dataID, data);
+		else if(type==OpenThermMessageType::WRITE_DATA && m_warm_start.supported.contains((uint8_t)dataID))
+			response=m_otThermostat->buildResponse(OpenThermMessageType::WRITE_ACK, dataID, data);
+		else
+			response=m_otThermostat->buildResponse(OpenThermMessageType::DATA_INVALID, dataID, data);
+
+		OPENTHERMGW_TRACE_FRAME("Fallback response (%08X) for thermostat request (%08X)", response, transaction.request);
+		transaction.bReplied=true;
+		m_fallbackReplies++;
+		m_otThermostat->sendResponseTimer(response);
+		captureFrame(CAPTURE_TO_THERMOSTAT, response, OpenThermResponseStatus::NONE, OpenThermPhy::micros());
+	}
+
+	void OpenThermGateway::setLastResponse(OpenThermMessageID dataID, uint16_t data)
+	{
+		SLastResponse &last=m_last_responses[(uint8_t)dataID%LAST_RESPONSE_SLOTS];
+		last.id=(uint8_t)dataID;
+		last.data=data;
+		last.bValid=true;
+	}
+
+	bool OpenThermGateway::getLastResponse(OpenThermMessageID dataID, uint16_t &data)
+	{
+		const SLastResponse &last=m_last_responses[(uint8_t)dataID%LAST_RESPONSE_SLOTS];
+		if(!last.bValid || last.id!=(uint8_t)dataID)
+			return false;
+		data=last.data;
+		return true;
+	}
+
+	bool OpenThermGateway::getCachedResponse(OpenThermMessageID dataID, uint16_t &data)
+	{
+		uint8_t slot=progmem_read_byte(&s_message_handlers[(uint8_t)dataID].cacheSlot);
+		if(slot==0)
+			return false;
+
+		SCachedResponse &cached=m_cached_responses[slot];
+		unsigned long msAge=OpenThermPhy::millis()-cached.msTimestamp;
+		if(!cached.bValid || msAge>=cached.msCacheTime)
+			return false;
+
+		// Keep the entries the thermostat reads fresh, they are read again in the background
+		if(msAge>=cached.msCacheTime/2)
+			cached.bRefresh=true;
+		data=cached.data;
+		return true;
+	}
+
+	bool OpenThermGateway::refreshCachedResponse()
+	{
+		for(uint8_t slot=1; slot<=OPENTHERMGW_READ_CACHE_SLOTS; slot++)
+		{
+			SCachedResponse &cached=m_cached_responses[slot];
+			if(cached.bRefresh)
+			{
+				OPENTHERMGW_TRACE_FRAME("Cache refresh request DataID: %d", cached.id);
+				if(!startGatewayTransaction(cached.id))
+					return false;
+				cached.bRefresh=false;
+				return true;
+			}
+		}
+		return false;
+	}
+
+	bool OpenThermGateway::isDueBefore(uint8_t slotA, uint8_t slotB)
+	{
+		// Signed difference, so that the order survives the millis() wrap-around
+		return (long)(m_auto_update_messages[slotA].msDue-m_auto_update_messages[slotB].msDue)<0;
+	}
+
+	void OpenThermGateway::swapAutoUpdateHeap(SAutoUpdateHeap &heap, uint8_t indexA, uint8_t indexB)
+	{
+		uint8_t slot=heap.slots[indexA];
+		heap.slots[indexA]=heap.slots[indexB];
+		heap.slots[indexB]=slot;
+		m_auto_update_messages[heap.slots[indexA]].heapIndex=indexA;
+		m_auto_update_messages[heap.slots[indexB]].heapIndex=indexB;
+	}
+
+	void OpenThermGateway::scheduleAutoUpdate(uint8_t slot, unsigned long msDue)
+	{
+		SAutoUpdateMessage &message=m_auto_update_messages[slot];
+		SAutoUpdateHeap &heap=m_auto_update_heaps[message.priority];
+		message.msDue=msDue;
+		if(message.heapIndex==0xFF)
+		{
+			message.heapIndex=heap.size;
+			heap.slots[heap.size++]=slot;
+		}
+
+		// Restore the heap order around the changed entry, O(log n)
+		uint8_t index=message.heapIndex;
+		while(index>0 && isDueBefore(slot, heap.slots[(index-1)/2]))
+		{
+			swapAutoUpdateHeap(heap, index, (index-1)/2);
+			index=(index-1)/2;
+		}
+		while(true)
+		{
+			uint8_t first=index;
+			uint8_t left=2*index+1;
+			uint8_t right=2*index+2;
+			if(left<heap.size && isDueBefore(heap.slots[left], heap.slots[first]))
+				first=left;
+			if(right<heap.size && isDueBefore(heap.slots[right], heap.slots[first]))
+				first=right;
+			if(first==index)
+				break;
+			swapAutoUpdateHeap(heap, index, first);
+			index=first;
+		}
+	}
+
+	unsigned long OpenThermGateway::getAutoUpdateTime(const SAutoUpdateMessage &message)
+	{
+		return message.msTimeUpdate<<message.backoff;
+	}
+
+	uint8_t OpenThermGateway::getNextAutoUpdate(unsigned long msNow)
+	{
+		// A message late by more than its own update time goes first whatever its priority,
+		// so that high priority messages can't starve the others
+		for(uint8_t priority=PRIORITY_LOW; priority>PRIORITY_HIGH; priority--)
+		{
+			SAutoUpdateHeap &heap=m_auto_update_heaps[priority];
+			if(heap.size>0)
+			{
+				SAutoUpdateMessage &message=m_auto_update_messages[heap.slots[0]];
+				if((long)(msNow-message.msDue)>=(long)message.msTimeUpdate)
+					return heap.slots[0];
+			}
+		}
+
+		// Otherwise the most urgent due message of the highest priority, earliest deadline first within a priority
+		for(uint8_t priority=PRIORITY_HIGH; priority<PRIORITY_COUNT; priority++)
+		{
+			SAutoUpdateHeap &heap=m_auto_update_heaps[priority];
+			if(heap.size>0 && (long)(msNow-m_auto_update_messages[heap.slots[0]].msDue)>=0)
+				return heap.slots[0];
+		}
+		return 0;
+	}
+
+	bool OpenThermGateway::isAutoUpdateAllowed(unsigned long loopTime)
+	{
+		m_msTimeSinceLastAutoUpdate+=loopTime;
+		if(m_fAutoUpdateBudget<=0)
+			return m_msTimeSinceLastAutoUpdate>=2000;
+
+		// Bus time is earned while the thermostat leaves the bus idle, and spent by the auto-update transactions.
+		// The cap avoids a burst of requests after a long idle period.
+		if(m_otThermostat->status==OpenThermStatus::DELAY && isBoilerBusFree())
+			m_fBusCredit=std::min(m_fBusCredit+loopTime*m_fAutoUpdateBudget*m_fBudgetScale, 500.0f);
+		return m_fBusCredit>0;
+	}
+
+	// Publish the boiler state saved by the previous run, the restored initial messages are then
+	// skipped by the initialization and read again in the background, with the auto-updates
+	void OpenThermGateway::restoreWarmStart()
+	{
+		m_warmStartPreference=global_preferences->make_preference<SWarmStartState>(fnv1_hash("openthermgw_warm_start")+m_instance, true);
+		SWarmStartState state;
+		if(!m_warmStartPreference.load(&state))
+		{
+			ESP_LOGD(TAG, "Gateway %u: no warm start state", m_instance);
+			return;
+		}
+		m_warm_start=state;
+
+		unsigned int restored=0;
+		for(uint8_t slot=1; slot<=OPENTHERMGW_WARM_START_SLOTS; slot++)
+		{
+			uint8_t id=m_warm_start.ids[slot];
+			if(id==0 || !m_initial_messages.contains(id) || progmem_read_byte(&s_message_handlers[id].warmStartSlot)!=slot)
+				continue;
+			s_message_publishers[progmem_read_byte(&s_message_handlers[id].publisher)](this, m_warm_start.data[slot]);
+			setLastResponse((OpenThermMessageID)id, m_warm_start.data[slot]);
+			m_warm_start_refresh.add(id);
+			restored++;
+		}
+		ESP_LOGI(TAG, "Gateway %u: %u boiler responses restored", m_instance, restored);
+	}
+
+	void OpenThermGateway::updateWarmStart(OpenThermMessageID dataID, uint16_t data)
+	{
+		SWarmStartState &state=m_warm_start;
+		uint8_t id=(uint8_t)dataID;
+		uint8_t slot=progmem_read_byte(&s_message_handlers[id].warmStartSlot);
+		if(slot!=0 && (state.ids[slot]!=id || state.data[slot]!=data))
+		{
+			state.ids[slot]=id;
+			state.data[slot]=data;
+			m_bWarmStartChanged=true;
+		}
+	}
+
+	// An acknowledged ID is supported, one answered with UNKNOWN_DATA_ID is not. DATA_INVALID says nothing,
+	// the boiler knows the ID but has no valid value at the moment.
+	void OpenThermGateway::updateSupport(OpenThermMessageType type, OpenThermMessageID dataID)
+	{
+		SWarmStartState &state=m_warm_start;
+		uint8_t id=(uint8_t)dataID;
+		if(type==OpenThermMessageType::READ_ACK || type==OpenThermMessageType::WRITE_ACK)
+		{
+			if(!state.supported.contains(id) || state.unsupported.contains(id))
+			{
+				state.supported.add(id);
+				state.unsupported.remove(id);
+				m_bWarmStartChanged=true;
+			}
+		}
+		else if(type==OpenThermMessageType::UNKNOWN_DATA_ID)
+		{
+			if(state.supported.contains(id) || !state.unsupported.contains(id))
+			{
+				OPENTHERMGW_TRACE_FRAME("Data ID %d not supported by the boiler", id);
+				state.supported.remove(id);
+				state.unsupported.add(id);
+				m_bWarmStartChanged=true;
+			}
+		}
+	}
+
+	void OpenThermGateway::saveWarmStart()
+	{
+		if(!m_warmStartPreference.save(&m_warm_start))
+			OPENTHERMGW_TRACE_ERROR("Gateway %u: warm start state not saved", m_instance);
+		m_bWarmStartChanged=false;
+		m_msWarmStartSaved=OpenThermPhy::millis();
+	}
+
+	// Pending write with the highest priority, the oldest first, 0 when there is none
+	uint8_t OpenThermGateway::getNextQueuedWrite()
+	{
+		uint8_t next=0;
+		for(uint8_t rewriter=1; rewriter<=OPENTHERMGW_REWRITE_SLOTS; rewriter++)
+		{
+			const SQueuedWrite &write=m_queued_writes[rewriter];
+			if(!write.bPending)
+				continue;
+			if(next==0 || write.priority<m_queued_writes[next].priority
+				|| (write.priority==m_queued_writes[next].priority && (long)(write.msQueued-m_queued_writes[next].msQueued)<0))
+				next=rewriter;
+		}
+		return next;
+	}
+
+	bool OpenThermGateway::sendQueuedWrite()
+	{
+		uint8_t rewriter=getNextQueuedWrite();
+		if(rewriter==0)
+			return false;
+
+		// The last request of the thermostat is repeated with the current entity states, without one
+		// the Status request is built by the gateway, and a write only when an entity overrides its data
+		SQueuedWrite &write=m_queued_writes[rewriter];
+		unsigned long request;
+		if(write.lastRequest!=0)
+			request=rewriteRequest(rewriter, m_otBoiler->getMessageType(write.lastRequest), write.id, write.lastRequest);
+		else if(write.id==OpenThermMessageID::Status)
+			request=rewriteRequest(rewriter, OpenThermMessageType::READ_DATA, write.id, build_request(write.id));
+		else
+		{
+			unsigned long emptyRequest=m_otBoiler->buildRequest(OpenThermMessageType::WRITE_DATA, write.id, 0);
+			request=rewriteRequest(rewriter, OpenThermMessageType::WRITE_DATA, write.id, emptyRequest);
+			if(request==emptyRequest)
+			{
+				write.bPending=false;
+				return false;
+			}
+		}
+
+		if(!sendGatewayRequest(request))
+			return false;
+		OPENTHERMGW_TRACE_FRAME("Queued write request (%08X) DataID: %d, queued for %lu ms", request, write.id, OpenThermPhy::millis()-write.msQueued);
+		write.bPending=false;
+		return true;
+	}
+
+	void OpenThermGateway::parseRequest(OpenThermMessageType type, OpenThermMessageID dataID, uint16_t data)
+	{
+		// Master status flags as set by the thermostat, the boiler sees them rewritten by the switches
 		if(dataID==OpenThermMessageID::Status)
 		{
 			m_bCHEnable = message_data::parse_flag8_hb_0(data);
@@ -246,13 +1051,81 @@ namespace esphome {
 			m_bCoolingEnable = message_data::parse_flag8_hb_2(data);
 			m_bOTCActive = message_data::parse_flag8_hb_3(data);
 			m_bCH2Active = message_data::parse_flag8_hb_4(data);
-			m_bStatusReceived=true;
-		}			
-		
+		}
+	}
+
+	unsigned long OpenThermGateway::rewriteRequest(uint8_t rewriter, OpenThermMessageType type, OpenThermMessageID dataID, unsigned long request)
+	{
+		if(rewriter==0)
+			return request;
+
+		uint16_t data=(uint16_t)request;
+		uint16_t rewrittenData=s_message_rewriters[rewriter](this, type, data);
+		if(rewrittenData==data)
+			return request;
+
+		unsigned long rewrittenRequest=m_otBoiler->buildRequest(type, dataID, rewrittenData);
+		OPENTHERMGW_TRACE_VERBOSE("Request %d rewritten (%08X -> %08X)", dataID, request, rewrittenRequest);
+		return rewrittenRequest;
+	}
+
+	void OpenThermGateway::parseResponse(OpenThermMessageType type, OpenThermMessageID dataID, uint16_t data)
+	{
+		OPENTHERMGW_TRACE_FRAME("Boiler response [MessageType: %s, DataID: %d, Data: %x]", m_otBoiler->messageTypeToString(type), dataID, data);
+
+		// One lookup in the generated table gives everything needed to handle the response
+		const SMessageHandler *pHandler=&s_message_handlers[(uint8_t)dataID];
+		uint8_t publisher=progmem_read_byte(&pHandler->publisher);
+		uint8_t decoder=progmem_read_byte(&pHandler->decoder);
+		uint8_t autoUpdateSlot=progmem_read_byte(&pHandler->autoUpdateSlot);
+		uint8_t cacheSlot=progmem_read_byte(&pHandler->cacheSlot);
+		bool bHandled=false;
+
+		// Responses without data are not published, they are read again less often
+		bool bAcknowledged=type==OpenThermMessageType::READ_ACK || type==OpenThermMessageType::WRITE_ACK;
+		updateSupport(type, dataID);
+		if(autoUpdateSlot!=0)
+			m_auto_update_messages[autoUpdateSlot].failures=0;
+		if(type==OpenThermMessageType::READ_ACK)
+		{
+			setLastResponse(dataID, data);
+			if(m_bWarmStart)
+				updateWarmStart(dataID, data);
+		}
+
+		// Only successful reads are cached, anything else means the cached value can't be trusted anymore
+		if(cacheSlot!=0)
+		{
+			SCachedResponse &cached=m_cached_responses[cacheSlot];
+			cached.bValid=type==OpenThermMessageType::READ_ACK;
+			cached.data=data;
+			cached.msTimestamp=OpenThermPhy::millis();
+		}
+
+		if(!bAcknowledged)
+		{
+			if(decoder==DECODER_STATUS)
+				m_bStatusReceived=true;
+			if(publisher!=0)
+				s_message_invalidators[publisher](this);
+			if(autoUpdateSlot!=0 && m_auto_update_messages[autoUpdateSlot].msTimeUpdate>0)
+			{
+				SAutoUpdateMessage &message=m_auto_update_messages[autoUpdateSlot];
+				message.backoff=std::min<uint8_t>(message.backoff+1, AUTO_UPDATE_MAX_BACKOFF);
+				scheduleAutoUpdate(autoUpdateSlot, OpenThermPhy::millis()+getAutoUpdateTime(message));
+			}
+			OPENTHERMGW_TRACE_VERBOSE("Response without data [MessageType: %s, DataID: %d, Data: %x]", m_otBoiler->messageTypeToString(type), dataID, data);
+			return;
+		}
+
 		// Special messages
-		switch(dataID)
+		switch(decoder)
 		{
-			case OpenThermMessageID::DayTime:
+			case DECODER_STATUS:
+				m_bStatusReceived=true;
+				break;
+
+			case DECODER_DAYTIME:
 				m_dateDOW=(data>>13)&0x03;
 				m_dateHour=(uint8_t)data;
 				m_dateMinute=(data>>8)&0x1F;
@@ -260,14 +1133,14 @@ namespace esphome {
 				bHandled=true;
 				break;
 
-			case OpenThermMessageID::Date:
+			case DECODER_DATE:
 				m_dateMonth=data>>8;
 				m_dateDay=(uint8_t)data;
 				publishDate();
 				bHandled=true;
 				break;
 
-			case OpenThermMessageID::Year:
+			case DECODER_YEAR:
 				m_dateYear=data;
 				bHandled=true;
 				publishDate();
@@ -277,60 +1150,208 @@ namespace esphome {
 				break;
 		}
 
-		if(!bHandled)
-		{
-			// Define the handler helpers to publish the results to all sensors
-			#define OPENTHERMGW_MESSAGE_RESPONSE_MESSAGE(msg) \
-				case OpenThermMessageID::msg: \
-				    ESP_LOGD(TAG, "Received %s response", #msg); \
-				    bHandled=true;
-			#define OPENTHERMGW_MESSAGE_RESPONSE_ENTITY(key, msg_data) \
-			    	this->key->publish_state(message_data::parse_ ## msg_data(data));
-			#define OPENTHERMGW_MESSAGE_RESPONSE_TEXT_ENTITY(key, msg_data) \
-			    	this->key->publish_state(message_data::parse_ ## msg_data(this->key, data));
-			#define OPENTHERMGW_MESSAGE_RESPONSE_POSTSCRIPT \
-			    	break;
-
-			// Then use those to create a switch statement for each thing we would want
-			// to report. We use a separate switch statement for each type, because some
-			// messages include results for multiple types, like flags and a number.
-			switch (dataID) 
-			{
-				OPENTHERMGW_SENSOR_MESSAGE_HANDLERS(OPENTHERMGW_MESSAGE_RESPONSE_MESSAGE, OPENTHERMGW_MESSAGE_RESPONSE_ENTITY, , OPENTHERMGW_MESSAGE_RESPONSE_POSTSCRIPT, )			
-				default: break;
-			}
-			
-			switch (dataID) 
-			{
-				OPENTHERMGW_BINARY_SENSOR_MESSAGE_HANDLERS(OPENTHERMGW_MESSAGE_RESPONSE_MESSAGE, OPENTHERMGW_MESSAGE_RESPONSE_ENTITY, , OPENTHERMGW_MESSAGE_RESPONSE_POSTSCRIPT, )
-				default: break;
-			}
-
-			switch (dataID) 
-			{
-				OPENTHERMGW_TEXT_SENSOR_MESSAGE_HANDLERS(OPENTHERMGW_MESSAGE_RESPONSE_MESSAGE, OPENTHERMGW_MESSAGE_RESPONSE_TEXT_ENTITY, , OPENTHERMGW_MESSAGE_RESPONSE_POSTSCRIPT, )
-				default: break;
-			}
-
-			switch (dataID) 
-			{
-				OPENTHERMGW_SWITCH_MESSAGE_HANDLERS(OPENTHERMGW_MESSAGE_RESPONSE_MESSAGE, OPENTHERMGW_MESSAGE_RESPONSE_ENTITY, , OPENTHERMGW_MESSAGE_RESPONSE_POSTSCRIPT, )
-				default: break;
-			}
+		if(!bHandled && publisher!=0)
+		{
+			s_message_publishers[publisher](this, data);
+			bHandled=true;
 		}
 		
 		if(bHandled)
 		{
-			std::unordered_map<OpenThermMessageID, SAutoUpdateMessage>::iterator it=m_map_auto_update_messages.find(dataID);
-			if(it!=m_map_auto_update_messages.end())
+			if(autoUpdateSlot!=0 && m_auto_update_messages[autoUpdateSlot].msTimeUpdate>0)
 			{
-				(*it).second.msTimeSinceLastUpdate=0;
+				m_auto_update_messages[autoUpdateSlot].backoff=0;
+				scheduleAutoUpdate(autoUpdateSlot, OpenThermPhy::millis()+m_auto_update_messages[autoUpdateSlot].msTimeUpdate);
 			}
 		} else {		
-			ESP_LOGD(TAG, "Unhandled response [MessageType: %s, DataID: %d, Data: %x]", m_otBoiler->messageTypeToString(type), dataID, data);
+			OPENTHERMGW_TRACE_VERBOSE("Unhandled response [MessageType: %s, DataID: %d, Data: %x]", m_otBoiler->messageTypeToString(type), dataID, data);
 		}
 	}
 	
+	// Upper bounds of the latency histogram buckets, the boiler has to respond within 800ms
+	static const uint16_t s_latency_buckets_ms[SLatencyHistogram::BUCKETS]={ 1, 2, 5, 10, 20, 50, 100, 150, 200, 300, 400, 500, 600, 700, 800, 0xFFFF };
+
+	void OpenThermGateway::addLatency(SLatencyHistogram &histogram, unsigned long msLatency)
+	{
+		uint8_t bucket=0;
+		while(bucket<SLatencyHistogram::BUCKETS-1 && msLatency>s_latency_buckets_ms[bucket])
+			bucket++;
+		if(histogram.total==0xFFFF)
+			return;
+		histogram.counts[bucket]++;
+		histogram.total++;
+		histogram.msMax=std::max(histogram.msMax, msLatency);
+	}
+
+	float OpenThermGateway::getLatencyPercentile(const SLatencyHistogram &histogram, uint8_t percent)
+	{
+		if(histogram.total==0)
+			return NAN;
+
+		// Upper bound of the bucket holding the percentile, never more than the largest sample
+		uint32_t rank=((uint32_t)histogram.total*percent+99)/100;
+		uint32_t count=0;
+		for(uint8_t bucket=0; bucket<SLatencyHistogram::BUCKETS; bucket++)
+		{
+			count+=histogram.counts[bucket];
+			if(count>=rank)
+				return std::min((unsigned long)s_latency_buckets_ms[bucket], histogram.msMax);
+		}
+		return histogram.msMax;
+	}
+
+	void OpenThermGateway::publishStatistics(unsigned long msPeriod)
+	{
+		unsigned long thermostatFrames=m_otThermostat->getReceivedFrames();
+		unsigned long boilerFrames=m_otBoiler->getReceivedFrames();
+		unsigned long blockingTime=m_otThermostat->getBlockingTime()+m_otBoiler->getBlockingTime();
+
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_forward_latency_p50
+		if(this->forward_latency_p50_diagnostic_sensor!=NULL)
+			this->forward_latency_p50_diagnostic_sensor->publish_state(getLatencyPercentile(m_forwardLatency, 50));
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_forward_latency_p95
+		if(this->forward_latency_p95_diagnostic_sensor!=NULL)
+			this->forward_latency_p95_diagnostic_sensor->publish_state(getLatencyPercentile(m_forwardLatency, 95));
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_response_time_p50
+		if(this->boiler_response_time_p50_diagnostic_sensor!=NULL)
+			this->boiler_response_time_p50_diagnostic_sensor->publish_state(getLatencyPercentile(m_boilerResponseTime, 50));
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_response_time_p95
+		if(this->boiler_response_time_p95_diagnostic_sensor!=NULL)
+			this->boiler_response_time_p95_diagnostic_sensor->publish_state(getLatencyPercentile(m_boilerResponseTime, 95));
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_response_time_max
+		if(this->boiler_response_time_max_diagnostic_sensor!=NULL)
+			this->boiler_response_time_max_diagnostic_sensor->publish_state(m_boilerResponseTime.total>0 ? m_boilerResponseTime.msMax : NAN);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_thermostat_frame_rate
+		if(this->thermostat_frame_rate_diagnostic_sensor!=NULL)
+			this->thermostat_frame_rate_diagnostic_sensor->publish_state((thermostatFrames-m_statisticsThermostatFrames)*60000.0f/msPeriod);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_frame_rate
+		if(this->boiler_frame_rate_diagnostic_sensor!=NULL)
+			this->boiler_frame_rate_diagnostic_sensor->publish_state((boilerFrames-m_statisticsBoilerFrames)*60000.0f/msPeriod);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_thermostat_invalid_frames
+		if(this->thermostat_invalid_frames_diagnostic_sensor!=NULL)
+			this->thermostat_invalid_frames_diagnostic_sensor->publish_state(m_otThermostat->getInvalidFrames());
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_invalid_frames
+		if(this->boiler_invalid_frames_diagnostic_sensor!=NULL)
+			this->boiler_invalid_frames_diagnostic_sensor->publish_state(m_otBoiler->getInvalidFrames());
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_filtered_glitches
+		if(this->filtered_glitches_diagnostic_sensor!=NULL)
+			this->filtered_glitches_diagnostic_sensor->publish_state(m_otThermostat->getFilteredGlitches()+m_otBoiler->getFilteredGlitches());
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_gateway_frames
+		if(this->gateway_frames_diagnostic_sensor!=NULL)
+			this->gateway_frames_diagnostic_sensor->publish_state(m_gatewayFrames);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_fallback_replies
+		if(this->fallback_replies_diagnostic_sensor!=NULL)
+			this->fallback_replies_diagnostic_sensor->publish_state(m_fallbackReplies);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_dropped_requests
+		if(this->dropped_requests_diagnostic_sensor!=NULL)
+			this->dropped_requests_diagnostic_sensor->publish_state(m_droppedRequests);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_timeouts
+		if(this->boiler_timeouts_diagnostic_sensor!=NULL)
+			this->boiler_timeouts_diagnostic_sensor->publish_state(m_boilerTimeouts);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_invalid_responses
+		if(this->boiler_invalid_responses_diagnostic_sensor!=NULL)
+			this->boiler_invalid_responses_diagnostic_sensor->publish_state(m_boilerInvalidResponses);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_retries
+		if(this->boiler_retries_diagnostic_sensor!=NULL)
+			this->boiler_retries_diagnostic_sensor->publish_state(m_boilerRetries);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_boiler_offline
+		if(this->boiler_offline_diagnostic_sensor!=NULL)
+			this->boiler_offline_diagnostic_sensor->publish_state(m_boilerOfflineCount);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_bus_utilization
+		if(this->bus_utilization_diagnostic_sensor!=NULL)
+			this->bus_utilization_diagnostic_sensor->publish_state(m_usBusBusy/10.0f/msPeriod);
+#endif
+#ifdef OPENTHERMGW_HAS_DIAGNOSTIC_SENSOR_loop_stall_time
+		if(this->loop_stall_time_diagnostic_sensor!=NULL)
+			this->loop_stall_time_diagnostic_sensor->publish_state((blockingTime-m_statisticsBlockingTime)/1000.0f);
+#endif
+
+		ESP_LOGD(TAG, "Statistics: forward latency p95 %.0f ms, boiler response time p95 %.0f ms (max %lu ms), bus utilization %.1f%%", 
+			getLatencyPercentile(m_forwardLatency, 95), getLatencyPercentile(m_boilerResponseTime, 95), m_boilerResponseTime.msMax, m_usBusBusy/10.0f/msPeriod);
+
+		m_forwardLatency=SLatencyHistogram();
+		m_boilerResponseTime=SLatencyHistogram();
+		m_statisticsThermostatFrames=thermostatFrames;
+		m_statisticsBoilerFrames=boilerFrames;
+		m_statisticsBlockingTime=blockingTime;
+		m_usBusBusy=0;
+	}
+
+	void OpenThermGateway::captureFrame(ECaptureDirection direction, unsigned long frame, OpenThermResponseStatus status, unsigned long usTimestamp)
+	{
+		if(m_pCapture==NULL || m_bCaptureExporting)
+			return;
+
+		SCaptureRecord &record=m_pCapture[m_captureHead];
+		record.frame=frame;
+		record.usTimestamp=usTimestamp;
+		record.direction=direction;
+		record.status=(uint8_t)status;
+		if(++m_captureHead==m_captureSize)
+			m_captureHead=0;
+		if(m_captureCount<m_captureSize)
+			m_captureCount++;
+	}
+
+	void OpenThermGateway::on_capture_export()
+	{
+		if(m_bCaptureExporting)
+			return;
+		ESP_LOGI(TAG, "Exporting %u captured frames", m_captureCount);
+		m_bCaptureExporting=true;
+		m_captureExportChunk=0;
+	}
+
+	void OpenThermGateway::on_capture_clear()
+	{
+		m_captureHead=0;
+		m_captureCount=0;
+	}
+
+	void OpenThermGateway::exportCaptureChunk()
+	{
+		// One event per update() so that exporting doesn't stall the loop, oldest records first
+		uint16_t chunks=(m_captureCount+CAPTURE_CHUNK_RECORDS-1)/CAPTURE_CHUNK_RECORDS;
+		if(m_captureExportChunk>=chunks)
+		{
+			m_bCaptureExporting=false;
+			return;
+		}
+
+		SCaptureRecord records[CAPTURE_CHUNK_RECORDS];
+		uint16_t first=m_captureExportChunk*CAPTURE_CHUNK_RECORDS;
+		uint16_t count=std::min<uint16_t>(CAPTURE_CHUNK_RECORDS, m_captureCount-first);
+		uint16_t oldest=(m_captureHead+m_captureSize-m_captureCount)%m_captureSize;
+		for(uint16_t record=0; record<count; record++)
+			records[record]=m_pCapture[(oldest+first+record)%m_captureSize];
+
+		fire_homeassistant_event("esphome.openthermgw_capture", {
+			{"gateway", to_string(m_instance)},
+			{"chunk", to_string(m_captureExportChunk)},
+			{"chunks", to_string(chunks)},
+			{"record_size", to_string(sizeof(SCaptureRecord))},
+			{"records", base64_encode((const uint8_t *)records, count*sizeof(SCaptureRecord))}
+		});
+		m_captureExportChunk++;
+	}
+
 	void OpenThermGateway::publishDate()
 	{
 		if(m_dateMinute==0xFF || m_dateHour==0xFF || m_dateDay==0xFF || m_dateMonth==0xFF || m_dateYear==0xFFFF)
@@ -358,71 +1379,120 @@ namespace esphome {
 
         void OpenThermGateway::loop() 
         {        	
-        	unsigned long loopStart=millis();
+        	unsigned long loopStart=OpenThermPhy::millis();
         	unsigned long loopTime=loopStart-m_msLastLoop;
         	m_msLastLoop=loopStart;
+
+		if(m_otThermostat==NULL || m_otBoiler==NULL)
+			return;
+
+		// Receive callbacks may start or complete transactions, none of these calls wait for the bus
+		bool bDidProcessMessage=m_otThermostat->process();
+		m_otBoiler->process();
+		advanceTransactions();
         	
 	        if(m_bStatusReceived && m_bInitializing)
 	        {	        
-		    	if (m_bInitializing && m_bStatusReceived && m_otBoiler!=NULL && m_otBoiler->isReady())
+		    	if (isBoilerBusFree() && isGatewayRequestAllowed())
 		    	{
-				if (m_current_message_iterator == m_initial_messages.end()) 
+				// Messages restored by the warm start are read later, with the auto-updates, and those
+				// the boiler doesn't support are skipped
+				int id=m_initial_messages.next(m_nextInitialMessage);
+				while(id>=0 && (m_warm_start_refresh.contains(id) || m_warm_start.unsupported.contains(id)))
+					id=m_initial_messages.next(id+1);
+				if(id>=0)
+				{
+					if(startGatewayTransaction((OpenThermMessageID)id))
+						m_nextInitialMessage=id+1;
+				}
+				else if((id=m_discovery_messages.next(0))>=0)
+				{
+					OPENTHERMGW_TRACE_FRAME("Discovery request DataID: %d", id);
+					if(startGatewayTransaction((OpenThermMessageID)id))
+						m_discovery_messages.remove(id);
+				}
+				else
 				{
 				    m_bInitializing = false;
-				} else {
-					unsigned int request = build_request(*m_current_message_iterator);										
-					unsigned int response = m_otBoiler->sendRequest(request);											
-					if (response!=0) 
-					{		
-						OpenThermMessageType responseType=m_otThermostat->getMessageType(response);
-						OpenThermMessageID responseDataID=m_otThermostat->getDataID(response);
-						uint16_t responseData=(uint16_t)response;
-
-						ESP_LOGD(TAG, "Boiler response (%08X) : MessageType: %s, DataID: %d, Data: %x]", response, m_otBoiler->messageTypeToString(responseType), responseDataID, responseData);					
-						parseResponse(responseType, responseDataID, responseData);
-					}
-					m_current_message_iterator++;
+				    m_fBusCredit=0;
 				}
 			}
-		} else if(m_otThermostat!=NULL) {
-			bool bDidProcessMessage=m_otThermostat->process();		
+		} else {
+			// Send auto-update message during thermostat delay to avoid messing communication, within the bus budget
+			bool bAllowed=isAutoUpdateAllowed(loopTime);
+			bool bBoilerAvailable=isGatewayRequestAllowed();
 
-			for(std::unordered_map<OpenThermMessageID, SAutoUpdateMessage>::iterator it=m_map_auto_update_messages.begin(); it!=m_map_auto_update_messages.end(); ++it)
-				(*it).second.msTimeSinceLastUpdate+=loopTime;
-				
-			// Send auto-update message during thermostat delay to avoid messing communication, and mas 1 message every 2 secs
-			m_msTimeSinceLastAutoUpdate+=loopTime;			
-			if(!bDidProcessMessage && m_msTimeSinceLastAutoUpdate>=2000 && m_otThermostat!=NULL && m_otThermostat->status==OpenThermStatus::DELAY && m_otBoiler->status==OpenThermStatus::READY)
+			// Writes of the entities go first, in the next idle window, without waiting for bus credit
+			if(!bDidProcessMessage && bBoilerAvailable && m_otThermostat->status==OpenThermStatus::DELAY && isBoilerBusFree() && sendQueuedWrite())
+				bDidProcessMessage=true;
+
+			if(!bDidProcessMessage && bAllowed && bBoilerAvailable && m_otThermostat->status==OpenThermStatus::DELAY && isBoilerBusFree())
 			{
-				while(m_auto_update_message_iterator!=m_map_auto_update_messages.end())
+				uint8_t slot;
+				int id;
+				// Cached responses in use by the thermostat are refreshed first
+				if(refreshCachedResponse())
 				{
-					if((*m_auto_update_message_iterator).second.msTimeSinceLastUpdate>=(*m_auto_update_message_iterator).second.msTimeUpdate)
+					m_msTimeSinceLastAutoUpdate=0;
+				}
+				else if((id=m_retry_messages.next(0))>=0)
+				{
+					OPENTHERMGW_TRACE_FRAME("Retry request DataID: %d", id);
+					if(startGatewayTransaction((OpenThermMessageID)id))
 					{
-						unsigned int request = build_request((*m_auto_update_message_iterator).first);									
-						unsigned int response = m_otBoiler->sendRequest(request);
 						m_msTimeSinceLastAutoUpdate=0;
-						if (response!=0) 
-						{		
-							OpenThermMessageType responseType=m_otBoiler->getMessageType(response);
-							OpenThermMessageID responseDataID=m_otBoiler->getDataID(response);
-							uint16_t responseData=(uint16_t)response;
-
-							ESP_LOGD(TAG, "Auto-update response (%08X) (%d>=%d) : MessageType: %s, DataID: %d, Data: %x]", response, (*m_auto_update_message_iterator).second.msTimeSinceLastUpdate, (*m_auto_update_message_iterator).second.msTimeUpdate, m_otBoiler->messageTypeToString(responseType), responseDataID, responseData);					
-							parseResponse(responseType, responseDataID, responseData);
-							m_auto_update_message_iterator++;
-						}
-						break;
+						m_retry_messages.remove(id);
+					}
+				}
+				else if((slot=getNextAutoUpdate(loopStart))!=0)
+				{
+					SAutoUpdateMessage &message=m_auto_update_messages[slot];
+					OPENTHERMGW_TRACE_FRAME("Auto-update request DataID: %d (%lu ms late)", message.id, loopStart-message.msDue);
+					if(startGatewayTransaction(message.id))
+					{
+						m_msTimeSinceLastAutoUpdate=0;
+						scheduleAutoUpdate(slot, loopStart+getAutoUpdateTime(message));
+					}
+				}
+				else if((id=m_warm_start_refresh.next(0))>=0)
+				{
+					OPENTHERMGW_TRACE_FRAME("Warm start refresh request DataID: %d", id);
+					if(startGatewayTransaction((OpenThermMessageID)id))
+					{
+						m_msTimeSinceLastAutoUpdate=0;
+						m_warm_start_refresh.remove(id);
 					}
-					m_auto_update_message_iterator++;
 				}
-				if(m_auto_update_message_iterator==m_map_auto_update_messages.end())
-					m_auto_update_message_iterator=m_map_auto_update_messages.begin();
 			}
 		}		
         }
 
 	void OpenThermGateway::update()
 	{
+		if(m_otThermostat==NULL || m_otBoiler==NULL)
+			return;
+
+		// Frames are only lost if loop() was stalled long enough for the ISR queue to fill up
+		unsigned long droppedFrames=m_otThermostat->getDroppedFrames()+m_otBoiler->getDroppedFrames();
+		if(droppedFrames!=m_droppedFrames)
+		{
+			OPENTHERMGW_TRACE_ERROR("%lu frames dropped, frame queue full", droppedFrames-m_droppedFrames);
+			m_droppedFrames=droppedFrames;
+		}
+
+		if(m_bCaptureExporting)
+			exportCaptureChunk();
+
+		// Flash is written at most once a minute, the state is also saved on shutdown
+		if(m_bWarmStart && m_bWarmStartChanged && OpenThermPhy::millis()-m_msWarmStartSaved>=60000)
+			saveWarmStart();
+
+		unsigned long msPeriod=OpenThermPhy::millis()-m_msStatisticsStart;
+		if(msPeriod>=60000)
+		{
+			publishStatistics(msPeriod);
+			m_msStatisticsStart+=msPeriod;
+		}
 	}
 	
 	unsigned int OpenThermGateway::build_request(OpenThermMessageID request_id) 
@@ -436,18 +1506,18 @@ namespace esphome {
 		// never be executed, because we short-circuit it here. 
 		if (request_id == OpenThermMessageID::Status) 
 		{
-			ESP_LOGD(TAG, "Building Status request");
+			OPENTHERMGW_TRACE_VERBOSE("Building Status request");
 			bool ch_enable = 
 				m_bCHEnable
 				&& 
 				#ifdef OPENTHERMGW_READ_ch_enable
-				OPENTHERMGW_READ_ch_enable
+				OPENTHERMGW_READ_ch_enable(true)
 				#else
 				true
 				#endif 
 				&& 
 				#ifdef OPENTHERMGW_READ_t_set
-				OPENTHERMGW_READ_t_set > 0.0
+				OPENTHERMGW_READ_t_set(1.0f) > 0.0
 				#else
 				true
 				#endif
@@ -457,7 +1527,7 @@ namespace esphome {
 				m_bDHWEnable
 				&& 
 				#ifdef OPENTHERMGW_READ_dhw_enable
-				OPENTHERMGW_READ_dhw_enable
+				OPENTHERMGW_READ_dhw_enable(true)
 				#else
 				true
 				#endif
@@ -467,13 +1537,13 @@ namespace esphome {
 				m_bCoolingEnable
 				&& 
 				#ifdef OPENTHERMGW_READ_cooling_enable
-				OPENTHERMGW_READ_cooling_enable
+				OPENTHERMGW_READ_cooling_enable(true)
 				#else
 				true
 				#endif 
 				&& 
 				#ifdef OPENTHERMGW_READ_cooling_control
-				OPENTHERMGW_READ_cooling_control > 0.0
+				OPENTHERMGW_READ_cooling_control(1.0f) > 0.0
 				#else
 				true
 				#endif
@@ -483,7 +1553,7 @@ namespace esphome {
 				m_bOTCActive
 				&& 
 				#ifdef OPENTHERMGW_READ_otc_active
-				OPENTHERMGW_READ_otc_active
+				OPENTHERMGW_READ_otc_active(true)
 				#else
 				true
 				#endif
@@ -493,13 +1563,13 @@ namespace esphome {
 				m_bCH2Active
 				&& 
 				#ifdef OPENTHERMGW_READ_ch2_active
-				OPENTHERMGW_READ_ch2_active
+				OPENTHERMGW_READ_ch2_active(true)
 				#else
 				true
 				#endif 
 				&& 
 				#ifdef OPENTHERMGW_READ_t_set_ch2
-				OPENTHERMGW_READ_t_set_ch2 > 0.0
+				OPENTHERMGW_READ_t_set_ch2(1.0f) > 0.0
 				#else
 				true
 				#endif
@@ -2,12 +2,12 @@
 
 #include "esphome.h"
 #include "OpenTherm.h"
+#include "OpenThermMessageData.h"
 #include "esphome/components/sensor/sensor.h"
 #include "esphome/components/binary_sensor/binary_sensor.h"
 #include "esphome/components/text_sensor/text_sensor.h"
-#include <unordered_set>
-#include <unordered_map>
 #include <algorithm>
+#include <cmath>
 #include "switch.h"
 #include "number.h"
 
@@ -33,35 +33,216 @@
 #ifndef OPENTHERMGW_INPUT_SENSOR_LIST
 #define OPENTHERMGW_INPUT_SENSOR_LIST(F, sep)
 #endif
+#ifndef OPENTHERMGW_DIAGNOSTIC_SENSOR_LIST
+#define OPENTHERMGW_DIAGNOSTIC_SENSOR_LIST(F, sep)
+#endif
+
+// Trace levels of the frame handling logs, set with the trace_level option
+#define OPENTHERMGW_TRACE_LEVEL_NONE 0
+#define OPENTHERMGW_TRACE_LEVEL_ERRORS 1
+#define OPENTHERMGW_TRACE_LEVEL_FRAMES 2
+#define OPENTHERMGW_TRACE_LEVEL_VERBOSE 3
+#ifndef OPENTHERMGW_TRACE_LEVEL
+#define OPENTHERMGW_TRACE_LEVEL OPENTHERMGW_TRACE_LEVEL_VERBOSE
+#endif
 
-#ifndef OPENTHERMGW_SENSOR_MESSAGE_HANDLERS
-#define OPENTHERMGW_SENSOR_MESSAGE_HANDLERS(MESSAGE, ENTITY, entity_sep, postscript, msg_sep)
+// Number of gateways configured, each one has its own interrupt handlers and hardware timers
+#define OPENTHERMGW_MAX_INSTANCES 4
+#ifndef OPENTHERMGW_INSTANCES
+#define OPENTHERMGW_INSTANCES 1
 #endif
-#ifndef OPENTHERMGW_BINARY_SENSOR_MESSAGE_HANDLERS
-#define OPENTHERMGW_BINARY_SENSOR_MESSAGE_HANDLERS(MESSAGE, ENTITY, entity_sep, postscript, msg_sep)
+
+#ifndef OPENTHERMGW_MESSAGE_PUBLISHERS
+#define OPENTHERMGW_MESSAGE_PUBLISHERS(PUBLISHER, ENTITY)
+#endif
+#ifndef OPENTHERMGW_MESSAGE_REWRITERS
+#define OPENTHERMGW_MESSAGE_REWRITERS(REWRITER, RULE)
 #endif
-#ifndef OPENTHERMGW_TEXT_SENSOR_MESSAGE_HANDLERS
-#define OPENTHERMGW_TEXT_SENSOR_MESSAGE_HANDLERS(MESSAGE, ENTITY, entity_sep, postscript, msg_sep)
+#ifndef OPENTHERMGW_MESSAGE_TABLE
+#define OPENTHERMGW_MESSAGE_TABLE
 #endif
-#ifndef OPENTHERMGW_SWITCH_MESSAGE_HANDLERS
-#define OPENTHERMGW_SWITCH_MESSAGE_HANDLERS(MESSAGE, ENTITY, entity_sep, postscript, msg_sep)
+#ifndef OPENTHERMGW_AUTO_UPDATE_SLOTS
+#define OPENTHERMGW_AUTO_UPDATE_SLOTS 0
 #endif
-#ifndef OPENTHERMGW_NUMBER_MESSAGE_HANDLERS
-#define OPENTHERMGW_NUMBER_MESSAGE_HANDLERS(MESSAGE, ENTITY, entity_sep, postscript, msg_sep)
+#ifndef OPENTHERMGW_READ_CACHE_SLOTS
+#define OPENTHERMGW_READ_CACHE_SLOTS 0
 #endif
-#ifndef OPENTHERMGW_OUTPUT_MESSAGE_HANDLERS
-#define OPENTHERMGW_OUTPUT_MESSAGE_HANDLERS(MESSAGE, ENTITY, entity_sep, postscript, msg_sep)
+#ifndef OPENTHERMGW_REWRITE_SLOTS
+#define OPENTHERMGW_REWRITE_SLOTS 0
 #endif
-#ifndef OPENTHERMGW_INPUT_SENSOR_MESSAGE_HANDLERS
-#define OPENTHERMGW_INPUT_SENSOR_MESSAGE_HANDLERS(MESSAGE, ENTITY, entity_sep, postscript, msg_sep)
+#ifndef OPENTHERMGW_WARM_START_SLOTS
+#define OPENTHERMGW_WARM_START_SLOTS 0
 #endif
 
 namespace esphome {
     namespace OpenThermGateway {    
+    	// Priority of the auto-update messages and queued writes, due messages with a higher priority are sent first
+    	enum EMessagePriority : uint8_t
+    	{
+    		PRIORITY_HIGH,
+    		PRIORITY_NORMAL,
+    		PRIORITY_LOW,
+    		PRIORITY_COUNT
+    	};
+
     	struct SAutoUpdateMessage
     	{
+    		OpenThermMessageID id=OpenThermMessageID::Status;
+    		EMessagePriority priority=PRIORITY_NORMAL;
     		unsigned long msTimeUpdate=0;
-    		unsigned long msTimeSinceLastUpdate=0;
+    		unsigned long msDue=0;		// Absolute millis() time of the next update
+    		uint8_t heapIndex=0xFF;		// Position in the deadline heap of its priority, 0xFF when not scheduled
+    		uint8_t backoff=0;		// The update time is doubled for every response without data, up to AUTO_UPDATE_MAX_BACKOFF
+    		uint8_t failures=0;		// Transactions in a row without valid response, the retry delay doubles with each
+    	};
+
+    	// Min-heap of auto-update slots ordered by due time, the next message to send is on top
+    	struct SAutoUpdateHeap
+    	{
+    		uint8_t slots[OPENTHERMGW_AUTO_UPDATE_SLOTS+1];
+    		uint8_t size=0;
+    	};
+
+    	// Set of data IDs, one bit per ID
+    	struct SMessageSet
+    	{
+    		uint32_t bits[8]={ 0 };
+
+    		void add(uint8_t id) { bits[id>>5]|=1ul<<(id&31); }
+    		void remove(uint8_t id) { bits[id>>5]&=~(1ul<<(id&31)); }
+    		bool contains(uint8_t id) const { return (bits[id>>5]>>(id&31))&1; }
+    		// First ID of the set from id on, -1 when there is none
+    		int next(int id) const
+    		{
+    			for(; id<256; id=(id|31)+1)
+    			{
+    				uint32_t word=bits[id>>5]>>(id&31);
+    				if(word!=0)
+    					return id+__builtin_ctz(word);
+    			}
+    			return -1;
+    		}
+    	};
+
+    	// Boiler response kept to answer thermostat reads without forwarding them
+    	struct SCachedResponse
+    	{
+    		OpenThermMessageID id=OpenThermMessageID::Status;
+    		unsigned long msCacheTime=0;
+    		unsigned long msTimestamp=0;
+    		uint16_t data=0;
+    		bool bValid=false;
+    		bool bRefresh=false;		// Served from cache past half its cache time, to be read again from the boiler
+    	};
+
+    	// Write to the boiler queued by a switch or number, by rewriter of the dispatch table.
+    	// Writes of the same message coalesce, the request is built from the entities when it is sent.
+    	struct SQueuedWrite
+    	{
+    		OpenThermMessageID id=OpenThermMessageID::Status;
+    		EMessagePriority priority=PRIORITY_NORMAL;
+    		bool bPending=false;
+    		unsigned long msQueued=0;
+    		unsigned long lastRequest=0;	// Last request of the thermostat for that message, before rewriting
+    	};
+
+    	// Boiler state kept in flash and published at boot, before the boiler is read again.
+    	// Responses of the initial messages by warm start slot of the dispatch table, and the IDs known to be
+    	// supported or not by the boiler. The layout changes with the configuration, ESPHome then drops it.
+    	struct SWarmStartState
+    	{
+    		uint8_t ids[OPENTHERMGW_WARM_START_SLOTS+1]={ 0 };	// ID of the response in data, 0 for none
+    		uint16_t data[OPENTHERMGW_WARM_START_SLOTS+1]={ 0 };
+    		SMessageSet supported;			// Acknowledged by the boiler
+    		SMessageSet unsupported;		// Answered with UNKNOWN_DATA_ID
+    	};
+
+    	// Last published raw value of an entity, to publish only changes
+    	struct SPublishState
+    	{
+    		uint16_t data=0;
+    		bool bPublished=false;
+    		bool bInvalidated=false;	// Published as unknown, the boiler has no value for it
+    		unsigned long msLastPublish=0;
+    	};
+
+    	// Decoding applied to a response before its entities are published
+    	enum EMessageDecoder
+    	{
+    		DECODER_NONE,
+    		DECODER_STATUS,
+    		DECODER_DAYTIME,
+    		DECODER_DATE,
+    		DECODER_YEAR
+    	};
+
+    	// Entry of the generated dispatch table, indexed by data ID. Index 0 means none.
+    	struct SMessageHandler
+    	{
+    		uint8_t publisher;
+    		uint8_t decoder;
+    		uint8_t autoUpdateSlot;
+    		uint8_t cacheSlot;
+    		uint8_t rewriter;
+    		uint8_t warmStartSlot;
+    	};
+
+    	// States of a transaction on the boiler bus, advanced from loop() without blocking
+    	enum ETransactionState
+    	{
+    		TRANSACTION_IDLE,
+    		TRANSACTION_RECEIVED,		// Request received from the thermostat, waiting for the boiler bus
+    		TRANSACTION_FORWARDING,		// Request being sent to the boiler
+    		TRANSACTION_AWAITING_BOILER,	// Request sent, waiting for the boiler response
+    		TRANSACTION_REPLYING,		// Boiler response being sent back to the thermostat
+    		TRANSACTION_CACHED		// Read answered from the cache, the response waits for THERMOSTAT_MIN_RESPONSE_TIME
+    	};
+
+    	struct STransaction
+    	{
+    		ETransactionState state=TRANSACTION_IDLE;
+    		unsigned long request=0;
+    		unsigned long response=0;
+    		OpenThermResponseStatus responseStatus=OpenThermResponseStatus::NONE;
+    		unsigned long usReceived=0;	// End of the thermostat request
+    		unsigned long usStart=0;	// Start of the request on the boiler bus
+    		bool bReplied=false;		// The thermostat got a fallback response at the deadline, the boiler response is late
+    		uint8_t retries=0;		// Times the thermostat request was forwarded again after an invalid or missing response
+    	};
+
+    	// Last acknowledged read of a data ID, the fallback response when the boiler misses the deadline
+    	struct SLastResponse
+    	{
+    		uint8_t id=0;
+    		bool bValid=false;
+    		uint16_t data=0;
+    	};
+
+    	// Direction of a captured frame, as seen from the gateway
+    	enum ECaptureDirection
+    	{
+    		CAPTURE_FROM_THERMOSTAT,
+    		CAPTURE_TO_BOILER,
+    		CAPTURE_FROM_BOILER,
+    		CAPTURE_TO_THERMOSTAT
+    	};
+
+    	// Raw frame capture record, packed to 10 bytes and exported as is (little endian)
+    	struct __attribute__((packed)) SCaptureRecord
+    	{
+    		uint32_t frame;
+    		uint32_t usTimestamp;		// micros(), wraps around every 71 minutes
+    		uint8_t direction;		// ECaptureDirection
+    		uint8_t status;			// OpenThermResponseStatus
+    	};
+
+    	// Latency distribution over a statistics period, bucketed so that percentiles need no sample storage
+    	struct SLatencyHistogram
+    	{
+    		static const uint8_t BUCKETS=16;
+    		uint16_t counts[BUCKETS]={};
+    		uint16_t total=0;
+    		unsigned long msMax=0;
     	};
     	
         class OpenThermGateway: public PollingComponent, public api::CustomAPIDevice {
@@ -79,9 +260,21 @@ namespace esphome {
 			void set_cooling_enable(bool bCoolingEnable) { m_bCoolingEnable = bCoolingEnable; }
 			void set_otc_active(bool bOTCActive) { m_bOTCActive = bOTCActive; }
 			void set_ch2_active(bool bCH2Active) { m_bCH2Active = bCH2Active; }
+			void set_deferred_decoding(bool bDeferredDecoding) { m_bDeferredDecoding = bDeferredDecoding; }
+			void set_adaptive_decoding(bool bAdaptiveDecoding) { m_bAdaptiveDecoding = bAdaptiveDecoding; }
+			void set_hardware_timer(bool bHardwareTimer) { m_bHardwareTimer = bHardwareTimer; }
+			void set_read_cache(bool bReadCache) { m_bReadCache = bReadCache; }
+			void set_warm_start(bool bWarmStart) { m_bWarmStart = bWarmStart; }
+			void set_auto_update_budget(float fAutoUpdateBudget) { m_fAutoUpdateBudget = fAutoUpdateBudget; }
+			void set_reply_deadline(uint32_t msReplyDeadline) { m_msReplyDeadline = msReplyDeadline; }
+			void set_boiler_response_timeout(uint32_t msBoilerResponseTimeout) { m_msBoilerResponseTimeout = msBoilerResponseTimeout; }
+			void set_capture_size(uint16_t captureSize) { m_captureSize = captureSize; }
+			void set_instance(uint8_t instance) { m_instance = instance; }
 			
 			void add_initial_message(OpenThermMessageID message_id);			
-			void add_auto_update_message(OpenThermMessageID message_id, int32_t secUpdateTime);
+			void add_auto_update_message(OpenThermMessageID message_id, int32_t secUpdateTime, EMessagePriority priority=PRIORITY_NORMAL);
+			void add_cached_message(OpenThermMessageID message_id, int32_t secCacheTime);
+			void queue_write(OpenThermMessageID message_id, EMessagePriority priority);
 			
 			#define OPENTHERMGW_SET_SENSOR(entity) void set_ ## entity(sensor::Sensor* sensor) { this->entity = sensor; }
 			OPENTHERMGW_SENSOR_LIST(OPENTHERMGW_SET_SENSOR, )
@@ -103,6 +296,9 @@ namespace esphome {
 
 			#define OPENTHERMGW_SET_INPUT_SENSOR(entity) void set_ ## entity(sensor::Sensor* sensor) { this->entity = sensor; }
 			OPENTHERMGW_INPUT_SENSOR_LIST(OPENTHERMGW_SET_INPUT_SENSOR, )
+
+			#define OPENTHERMGW_SET_DIAGNOSTIC_SENSOR(entity) void set_ ## entity(sensor::Sensor* sensor) { this->entity = sensor; }
+			OPENTHERMGW_DIAGNOSTIC_SENSOR_LIST(OPENTHERMGW_SET_DIAGNOSTIC_SENSOR, )
 			
 			void setup() override;
 			void on_shutdown() override;			
@@ -119,6 +315,12 @@ namespace esphome {
 					((OpenThermGateway *)pCallbackUser)->processRequestThermostat(request, status);
 			}
 
+			static void processResponseBoiler(unsigned long response, OpenThermResponseStatus status, void *pCallbackUser)
+			{
+				if(pCallbackUser!=NULL)
+					((OpenThermGateway *)pCallbackUser)->processResponseBoiler(response, status);
+			}
+
 
 		private:
 			uint8_t m_pinThermostatIn = 0;
@@ -131,6 +333,18 @@ namespace esphome {
 			bool m_bCoolingEnable = false;
 			bool m_bOTCActive = false;
 			bool m_bCH2Active = false;
+			bool m_bDeferredDecoding = false;
+			bool m_bAdaptiveDecoding = false;
+#if defined(ESP8266)
+			bool m_bHardwareTimer = false;		// timer1 is also used by analogWrite, tone and Servo
+#else
+			bool m_bHardwareTimer = true;
+#endif
+			bool m_bReadCache = false;
+			bool m_bWarmStart = true;
+			float m_fAutoUpdateBudget = 0;		// Share of the thermostat idle time used for auto-updates, 0 for one message every 2 secs
+			uint32_t m_msReplyDeadline = 700;	// Time from a thermostat request to its fallback response, 0 to wait for the boiler
+			uint32_t m_msBoilerResponseTimeout = 0;	// Time the boiler has to respond, 0 for BOILER_RESPONSE_TIMEOUT
 
 			uint16_t m_dateYear = 0xFFFF;
 			uint8_t m_dateMonth = 0xFF;
@@ -142,55 +356,219 @@ namespace esphome {
 			
 			unsigned long m_msLastLoop=0;
 			unsigned long m_msTimeSinceLastAutoUpdate=0;
+			unsigned long m_msGatewayTransactionStart=0;
+			float m_fBusCredit=0;			// Bus time (ms) the auto-updates may still use
+			float m_fBudgetScale=1;			// Lowered when auto-updates delay thermostat requests
+			unsigned long m_droppedFrames=0;
+
+			// Instrumentation, published by the diagnostic sensors once per statistics period
+			SLatencyHistogram m_forwardLatency;
+			SLatencyHistogram m_boilerResponseTime;
+			unsigned long m_msStatisticsStart=0;
+			unsigned long m_statisticsThermostatFrames=0;	// Counters of the OpenTherm instances at the period start
+			unsigned long m_statisticsBoilerFrames=0;
+			unsigned long m_statisticsBlockingTime=0;
+			unsigned long m_usBusBusy=0;
+			unsigned long m_gatewayFrames=0;
+			unsigned long m_fallbackReplies=0;
+			unsigned long m_droppedRequests=0;
+			unsigned long m_boilerTimeouts=0;
+			unsigned long m_boilerInvalidResponses=0;
+			unsigned long m_boilerRetries=0;
+			unsigned long m_boilerOfflineCount=0;
+
+			// Raw frame capture ring buffer, exported in chunks as Home Assistant events
+			static const uint8_t CAPTURE_CHUNK_RECORDS=64;
+			SCaptureRecord *m_pCapture=NULL;
+			uint16_t m_captureSize=0;
+			uint16_t m_captureHead=0;		// Next record written
+			uint16_t m_captureCount=0;
+			bool m_bCaptureExporting=false;		// Capture is paused while exporting
+			uint16_t m_captureExportChunk=0;
 			
-			// Use macros to create fields for every entity specified in the ESPHome configuration
-			#define OPENTHERMGW_DECLARE_SENSOR(entity) sensor::Sensor* entity;
+			// Use macros to create fields for every entity specified in the ESPHome configuration,
+			// the entities of the other gateways are NULL
+			#define OPENTHERMGW_DECLARE_SENSOR(entity) sensor::Sensor* entity=NULL; SPublishState entity ## _publish;
 			OPENTHERMGW_SENSOR_LIST(OPENTHERMGW_DECLARE_SENSOR, )
 
-			#define OPENTHERMGW_DECLARE_BINARY_SENSOR(entity) binary_sensor::BinarySensor* entity;
+			#define OPENTHERMGW_DECLARE_BINARY_SENSOR(entity) binary_sensor::BinarySensor* entity=NULL; SPublishState entity ## _publish;
 			OPENTHERMGW_BINARY_SENSOR_LIST(OPENTHERMGW_DECLARE_BINARY_SENSOR, )
 
-			#define OPENTHERMGW_DECLARE_TEXT_SENSOR(entity) text_sensor::TextSensor* entity;
+			#define OPENTHERMGW_DECLARE_TEXT_SENSOR(entity) text_sensor::TextSensor* entity=NULL; SPublishState entity ## _publish;
 			OPENTHERMGW_TEXT_SENSOR_LIST(OPENTHERMGW_DECLARE_TEXT_SENSOR, )
 
-			#define OPENTHERMGW_DECLARE_SWITCH(entity) OpenThermGatewaySwitch* entity;
+			#define OPENTHERMGW_DECLARE_SWITCH(entity) OpenThermGatewaySwitch* entity=NULL; SPublishState entity ## _publish;
 			OPENTHERMGW_SWITCH_LIST(OPENTHERMGW_DECLARE_SWITCH, )
 
-			#define OPENTHERMGW_DECLARE_NUMBER(entity) OpenThermGatewayNumber* entity;
+			#define OPENTHERMGW_DECLARE_NUMBER(entity) OpenThermGatewayNumber* entity=NULL;
 			OPENTHERMGW_NUMBER_LIST(OPENTHERMGW_DECLARE_NUMBER, )
 
-			#define OPENTHERMGW_DECLARE_OUTPUT(entity) OpenthermOutput* entity;
+			#define OPENTHERMGW_DECLARE_OUTPUT(entity) OpenthermOutput* entity=NULL;
 			OPENTHERMGW_OUTPUT_LIST(OPENTHERMGW_DECLARE_OUTPUT, )
 
-			#define OPENTHERMGW_DECLARE_INPUT_SENSOR(entity) sensor::Sensor* entity;
+			#define OPENTHERMGW_DECLARE_INPUT_SENSOR(entity) sensor::Sensor* entity=NULL;
 			OPENTHERMGW_INPUT_SENSOR_LIST(OPENTHERMGW_DECLARE_INPUT_SENSOR, )
+
+			#define OPENTHERMGW_DECLARE_DIAGNOSTIC_SENSOR(entity) sensor::Sensor* entity=NULL;
+			OPENTHERMGW_DIAGNOSTIC_SENSOR_LIST(OPENTHERMGW_DECLARE_DIAGNOSTIC_SENSOR, )
 			    
-			// The set of initial messages to send on starting communication with the boiler
-			std::unordered_set<OpenThermMessageID> m_initial_messages;
+			// Generated dispatch table (in flash) and the publishers it refers to, with for each publisher
+			// the invalidator publishing its entities as unknown
+			typedef void (*MessagePublisher)(OpenThermGateway *gateway, uint16_t data);
+			typedef void (*MessageInvalidator)(OpenThermGateway *gateway);
+			static const SMessageHandler s_message_handlers[256];
+			static const MessagePublisher s_message_publishers[];
+			static const MessageInvalidator s_message_invalidators[];
+			typedef uint16_t (*MessageRewriter)(OpenThermGateway *gateway, OpenThermMessageType type, uint16_t data);
+			static const MessageRewriter s_message_rewriters[];
+
+			static bool is_publish_due(SPublishState &state, uint16_t data, unsigned long msMinPublishInterval);
+			static void set_published(SPublishState &state, uint16_t data);
+			static bool set_invalidated(SPublishState &state);
+
+			#define OPENTHERMGW_DECLARE_PUBLISHER(msg, entities) static void publish_ ## msg(OpenThermGateway *gateway, uint16_t data); static void invalidate_ ## msg(OpenThermGateway *gateway);
+			OPENTHERMGW_MESSAGE_PUBLISHERS(OPENTHERMGW_DECLARE_PUBLISHER, )
+
+			#define OPENTHERMGW_DECLARE_REWRITER(msg, rules) static uint16_t rewrite_ ## msg(OpenThermGateway *gateway, OpenThermMessageType type, uint16_t data);
+			OPENTHERMGW_MESSAGE_REWRITERS(OPENTHERMGW_DECLARE_REWRITER, )
+
+			// The set of initial messages to send on starting communication with the boiler, in ID order
+			SMessageSet m_initial_messages;
+
+			// Auto-update messages never sent to the boiler, read once after the initial messages to learn if it supports them
+			SMessageSet m_discovery_messages;
+			static const uint8_t AUTO_UPDATE_MAX_BACKOFF=6;
+			static const unsigned long AUTO_UPDATE_RETRY_TIME=2000;	// First retry delay of a failed auto-update
+
+			// Other gateway requests without valid response are sent once more in the background
+			SMessageSet m_retry_messages;
+			SMessageSet m_retried_messages;
+
+			// Thermostat requests are forwarded again while a retry still fits before the deadline
+			static const uint8_t THERMOSTAT_MAX_RETRIES=2;
+			static const unsigned long THERMOSTAT_RETRY_TIME=150;	// Two frames and a typical boiler response (ms)
+			// OpenTherm slaves respond no sooner than 20ms after the end of the request, cached responses as well
+			static const unsigned long THERMOSTAT_MIN_RESPONSE_TIME=20;
+			// Without boiler_response_timeout, the boiler has the 800ms of the spec to respond
+			static const unsigned long BOILER_RESPONSE_TIMEOUT=800;
+
+			// Past BOILER_OFFLINE_FAILURES transactions in a row without valid response the boiler is offline: the gateway
+			// stops its own requests and probes the boiler with one of them, the probe time doubling up to BOILER_OFFLINE_MAX_BACKOFF.
+			// Any valid response, to a thermostat request as well, brings it back online.
+			static const uint8_t BOILER_OFFLINE_FAILURES=5;
+			static const unsigned long BOILER_OFFLINE_PROBE_TIME=5000;
+			static const uint8_t BOILER_OFFLINE_MAX_BACKOFF=4;
+			uint8_t m_boilerFailures=0;
+			bool m_bBoilerOffline=false;
+			uint8_t m_boilerOfflineBackoff=0;
+			unsigned long m_msBoilerProbe=0;	// Time of the next gateway request allowed while offline
+
+			// Boiler state restored at boot, the restored initial messages are read again in the background.
+			// The supported data IDs are tracked with or without warm start.
+			SWarmStartState m_warm_start;
+			ESPPreferenceObject m_warmStartPreference;
+			SMessageSet m_warm_start_refresh;
+			bool m_bWarmStartChanged=false;
+			unsigned long m_msWarmStartSaved=0;
 			
-			// Map with periodic messages
-			std::unordered_map<OpenThermMessageID, SAutoUpdateMessage> m_map_auto_update_messages;
+			// Periodic messages, by auto-update slot of the dispatch table (slot 0 is unused)
+			SAutoUpdateMessage m_auto_update_messages[OPENTHERMGW_AUTO_UPDATE_SLOTS+1];
+			SAutoUpdateHeap m_auto_update_heaps[PRIORITY_COUNT];
+
+			// Cached boiler responses, by read cache slot of the dispatch table (slot 0 is unused)
+			SCachedResponse m_cached_responses[OPENTHERMGW_READ_CACHE_SLOTS+1];
+
+			// Writes queued by the entities, by rewriter of the dispatch table (slot 0 is unused)
+			SQueuedWrite m_queued_writes[OPENTHERMGW_REWRITE_SLOTS+1];
 			
 			bool m_bStatusReceived = false;
 			bool m_bInitializing = true;
+
+			// Request proxied from the thermostat, and request originated by the gateway (init/auto-update).
+			// A thermostat request answered at the deadline is moved aside by the next one, until the boiler answers.
+			STransaction m_thermostatTransaction;
+			STransaction m_gatewayTransaction;
+			STransaction m_lateTransaction;
+
+			// Direct-mapped by data ID, a thermostat reading more IDs than slots only loses some fallbacks
+			static const uint8_t LAST_RESPONSE_SLOTS=32;
+			SLastResponse m_last_responses[LAST_RESPONSE_SLOTS];
 			
-			std::unordered_set<OpenThermMessageID>::const_iterator m_current_message_iterator;
-			std::unordered_map<OpenThermMessageID, SAutoUpdateMessage>::const_iterator m_auto_update_message_iterator;
+			int m_nextInitialMessage=0;		// Next ID of m_initial_messages to send from
 
-			static OpenTherm *m_otThermostat;
-			static OpenTherm *m_otBoiler;
+			uint8_t m_instance=0;			// Index of this gateway, selects its interrupt handlers and timers
+			OpenTherm *m_otThermostat=NULL;
+			OpenTherm *m_otBoiler=NULL;
 
-			static void IRAM_ATTR handleInterruptThermostat();
-			static void IRAM_ATTR handleInterruptBoiler();
+			// Pin and timer interrupts take no argument, so every instance has its own handlers
+			// which find the gateway in s_instances
+			struct SInterruptHandlers
+			{
+				void (*thermostat)(void);
+				void (*boiler)(void);
+				void (*timerThermostat)(void);
+				void (*timerBoiler)(void);
+			};
+			static OpenThermGateway *s_instances[OPENTHERMGW_INSTANCES];
+			static const SInterruptHandlers s_interrupt_handlers[OPENTHERMGW_INSTANCES];
+
+			template<uint8_t INSTANCE> static void IRAM_ATTR handleInterruptThermostat();
+			template<uint8_t INSTANCE> static void IRAM_ATTR handleInterruptBoiler();
+			template<uint8_t INSTANCE> static void IRAM_ATTR handleTimerInterruptThermostat();
+			template<uint8_t INSTANCE> static void IRAM_ATTR handleTimerInterruptBoiler();
 
 			unsigned int build_request(OpenThermMessageID request_id);
 			
 			void processRequestThermostat(unsigned long request, OpenThermResponseStatus status);		
+			void processResponseBoiler(unsigned long response, OpenThermResponseStatus status);
+
+			void advanceTransactions();
+			void replyFallback();
+			void setLastResponse(OpenThermMessageID dataID, uint16_t data);
+			bool getLastResponse(OpenThermMessageID dataID, uint16_t &data);
+			bool startGatewayTransaction(OpenThermMessageID request_id);
+			bool sendGatewayRequest(unsigned long request);
+			bool isBoilerBusFree();
+			bool isGatewayRequestAllowed();
+			void updateBoilerHealth(bool bValid, OpenThermResponseStatus status);
+			unsigned long getThermostatDeadline() const;
+			unsigned long getBoilerResponseTimeout() const;
+			bool retryThermostatRequest(STransaction &transaction);
+			void retryGatewayRequest(const STransaction &transaction);
 			
+			bool getCachedResponse(OpenThermMessageID dataID, uint16_t &data);
+			bool refreshCachedResponse();
+
+			unsigned long getAutoUpdateTime(const SAutoUpdateMessage &message);
+
+			void restoreWarmStart();
+			void updateWarmStart(OpenThermMessageID dataID, uint16_t data);
+			void updateSupport(OpenThermMessageType type, OpenThermMessageID dataID);
+			void saveWarmStart();
+
+			void scheduleAutoUpdate(uint8_t slot, unsigned long msDue);
+			bool isDueBefore(uint8_t slotA, uint8_t slotB);
+			void swapAutoUpdateHeap(SAutoUpdateHeap &heap, uint8_t indexA, uint8_t indexB);
+			uint8_t getNextAutoUpdate(unsigned long msNow);
+			bool isAutoUpdateAllowed(unsigned long loopTime);
+
+			uint8_t getNextQueuedWrite();
+			bool sendQueuedWrite();
+
 			void parseRequest(OpenThermMessageType type, OpenThermMessageID dataID, uint16_t data);
+			unsigned long rewriteRequest(uint8_t rewriter, OpenThermMessageType type, OpenThermMessageID dataID, unsigned long request);
 			void parseResponse(OpenThermMessageType type, OpenThermMessageID dataID, uint16_t data);
 			
 			void publishDate();
+
+			void addLatency(SLatencyHistogram &histogram, unsigned long msLatency);
+			float getLatencyPercentile(const SLatencyHistogram &histogram, uint8_t percent);
+			void publishStatistics(unsigned long msPeriod);
+
+			void captureFrame(ECaptureDirection direction, unsigned long frame, OpenThermResponseStatus status, unsigned long usTimestamp);
+			void on_capture_export();
+			void on_capture_clear();
+			void exportCaptureChunk();
         };
 
     } // namespace OpenThermGateway
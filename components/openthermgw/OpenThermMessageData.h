@@ -0,0 +1,50 @@
+#pragma once
+
+#include <string>
+#include "OpenThermCodec.h"
+
+namespace esphome {
+namespace text_sensor {
+	class TextSensor;
+}
+
+// Decoders and encoders of the data value, by message_data kind of schema.py:
+// parse_<kind>(data) and write_<kind>(value, data), the text kinds take the text sensor first.
+namespace message_data {
+	// Every message_data kind: the flags F(kind, bit), which also have a text kind <kind>_str,
+	// and the values F(kind, type). str_date is the only other kind.
+	#define OPENTHERMGW_MESSAGE_DATA_FLAGS(F) \
+		F(flag8_lb_0, 0) F(flag8_lb_1, 1) F(flag8_lb_2, 2) F(flag8_lb_3, 3) \
+		F(flag8_lb_4, 4) F(flag8_lb_5, 5) F(flag8_lb_6, 6) F(flag8_lb_7, 7) \
+		F(flag8_hb_0, 8) F(flag8_hb_1, 9) F(flag8_hb_2, 10) F(flag8_hb_3, 11) \
+		F(flag8_hb_4, 12) F(flag8_hb_5, 13) F(flag8_hb_6, 14) F(flag8_hb_7, 15)
+	#define OPENTHERMGW_MESSAGE_DATA_VALUES(F) \
+		F(u8_lb, uint8_t) F(u8_hb, uint8_t) F(s8_lb, int8_t) F(s8_hb, int8_t) \
+		F(u16, uint16_t) F(s16, int16_t) F(f88, float)
+
+	#define OPENTHERMGW_FLAG_CODEC(kind, bit) \
+		inline bool parse_ ## kind(const unsigned long response) { return OpenThermCodec::getBit(response, bit); } \
+		inline unsigned int write_ ## kind(const bool value, const unsigned int data) { return OpenThermCodec::setBit(data, bit, value); } \
+		inline std::string parse_ ## kind ## _str(text_sensor::TextSensor* /*sensor*/, const unsigned long response) { return parse_ ## kind(response) ? "ON" : "OFF"; }
+	OPENTHERMGW_MESSAGE_DATA_FLAGS(OPENTHERMGW_FLAG_CODEC)
+
+	#define OPENTHERMGW_BYTE_CODEC(kind, type, index) \
+		inline type parse_ ## kind(const unsigned long response) { return (type)OpenThermCodec::getByte(response, index); } \
+		inline unsigned int write_ ## kind(const type value, const unsigned int data) { return OpenThermCodec::setByte(data, index, (uint8_t)value); }
+	OPENTHERMGW_BYTE_CODEC(u8_lb, uint8_t, 0)
+	OPENTHERMGW_BYTE_CODEC(u8_hb, uint8_t, 1)
+	OPENTHERMGW_BYTE_CODEC(s8_lb, int8_t, 0)
+	OPENTHERMGW_BYTE_CODEC(s8_hb, int8_t, 1)
+
+	inline uint16_t parse_u16(const unsigned long response) { return (uint16_t)response; }
+	inline int16_t parse_s16(const unsigned long response) { return (int16_t)response; }
+	inline float parse_f88(const unsigned long response) { return OpenThermCodec::getF88(response); }
+	inline unsigned int write_u16(const uint16_t value, const unsigned int /*data*/) { return value; }
+	inline unsigned int write_s16(const int16_t value, const unsigned int /*data*/) { return (uint16_t)value; }
+	inline unsigned int write_f88(const float value, const unsigned int /*data*/) { return OpenThermCodec::setF88(value); }
+
+	// The date is published from the Date, Year and DayTime responses together, see publishDate()
+	inline std::string parse_str_date(text_sensor::TextSensor* /*sensor*/, const unsigned long /*response*/) { return "00:00 00/00/0000"; }
+	inline unsigned int write_str_date(const std::string /*value*/, const unsigned int /*data*/) { return 0; }
+} // namespace message_data
+} // namespace esphome
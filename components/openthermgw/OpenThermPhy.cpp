@@ -0,0 +1,122 @@
+/*
+OpenThermPhy.cpp - Virtual lines and clock of the host platform
+*/
+
+#include "OpenThermPhy.h"
+
+#ifdef USE_HOST
+
+#include <thread>
+#include <unordered_map>
+
+struct SVirtualLine
+{
+	int level=LOW;
+	int connectedIn=-1;		// Input pin following this output pin, -1 when not connected
+	void(*edgeCallback)(void)=NULL;
+};
+
+static std::unordered_map<int, SVirtualLine> s_lines;
+
+// Virtual time only advances with delays and advance(), so bit timings don't depend on the
+// host scheduler and runs are reproducible
+static unsigned long long s_usVirtual=0;
+
+void OpenThermVirtualBus::connect(int outPin, int inPin)
+{
+	s_lines[outPin].connectedIn=inPin;
+	s_lines[inPin].level=LOW;
+}
+
+void OpenThermVirtualBus::reset()
+{
+	s_lines.clear();
+}
+
+void OpenThermVirtualBus::advance(unsigned long us)
+{
+	s_usVirtual+=us;
+}
+
+void OpenThermPhy::begin()
+{
+	s_lines[inPin];
+	s_lines[outPin];
+}
+
+void OpenThermPhy::attachEdgeInterrupt(void(*edgeCallback)(void))
+{
+	s_lines[inPin].edgeCallback=edgeCallback;
+}
+
+void OpenThermPhy::detachEdgeInterrupt()
+{
+	s_lines[inPin].edgeCallback=NULL;
+}
+
+int OpenThermPhy::read()
+{
+	return s_lines[inPin].level;
+}
+
+static void writeLine(int outPin, int level)
+{
+	SVirtualLine &out=s_lines[outPin];
+	out.level=level;
+	if(out.connectedIn<0)
+		return;
+
+	SVirtualLine &in=s_lines[out.connectedIn];
+	int inLevel=(level==LOW) ? HIGH : LOW;
+	if(in.level==inLevel)
+		return;
+	in.level=inLevel;
+	if(in.edgeCallback!=NULL)
+		in.edgeCallback();
+}
+
+void OpenThermPhy::setActive()
+{
+	writeLine(outPin, LOW);
+}
+
+void OpenThermPhy::setIdle()
+{
+	writeLine(outPin, HIGH);
+}
+
+unsigned long OpenThermPhy::micros()
+{
+	return (unsigned long)s_usVirtual;
+}
+
+unsigned long OpenThermPhy::millis()
+{
+	return (unsigned long)(s_usVirtual/1000);
+}
+
+void OpenThermPhy::delay(unsigned long ms)
+{
+	s_usVirtual+=ms*1000ull;
+}
+
+void OpenThermPhy::delayMicroseconds(unsigned int us)
+{
+	s_usVirtual+=us;
+}
+
+void OpenThermPhy::yield()
+{
+	std::this_thread::yield();
+}
+
+// Edges are delivered synchronously on a single thread, there is nothing to mask
+void OpenThermPhy::disableInterrupts()
+{
+}
+
+void OpenThermPhy::enableInterrupts()
+{
+}
+
+#endif // USE_HOST
@@ -0,0 +1,100 @@
+/*
+OpenThermPhy.h - Physical layer of the OpenTherm interfaces: line I/O, edge interrupts and time
+
+On Arduino the lines are GPIO pins. On the ESPHome host platform (USE_HOST) they are virtual
+lines wired together by OpenThermVirtualBus, and time is virtual: delays advance the clock
+instead of waiting, so frames are sent and decoded at CPU speed. The program driving the bus
+advances the clock between frames with OpenThermVirtualBus::advance().
+*/
+
+#ifndef OpenThermPhy_h
+#define OpenThermPhy_h
+
+#include <stdint.h>
+#include <stddef.h>
+
+#ifdef USE_HOST
+typedef uint8_t byte;
+#define LOW 0
+#define HIGH 1
+#define bitRead(value, bit) (((value) >> (bit)) & 0x01)
+#else
+#include <Arduino.h>
+#endif
+
+#ifndef ICACHE_RAM_ATTR
+#define ICACHE_RAM_ATTR
+#endif
+
+#ifndef IRAM_ATTR
+#define IRAM_ATTR ICACHE_RAM_ATTR
+#endif
+
+class OpenThermPhy
+{
+public:
+	OpenThermPhy(int inPin, int outPin): inPin(inPin), outPin(outPin) {}
+
+	void begin();
+	void attachEdgeInterrupt(void(*edgeCallback)(void));
+	void detachEdgeInterrupt();
+	int read();
+	// The interface inverts the output: the line is high while the output is active (low)
+	void setActive();
+	void setIdle();
+
+	static unsigned long micros();
+	static unsigned long millis();
+	static void delay(unsigned long ms);
+	static void delayMicroseconds(unsigned int us);
+	static void yield();
+	static void disableInterrupts();
+	static void enableInterrupts();
+
+	const int inPin;
+	const int outPin;
+};
+
+#ifdef USE_HOST
+
+// Virtual lines of the host platform, by pin number. Writing an output pin sets the level of the
+// input pin connected to it and calls the edge interrupt of that input synchronously.
+class OpenThermVirtualBus
+{
+public:
+	static void connect(int outPin, int inPin);
+	static void reset();
+	// Skip idle time on the virtual clock
+	static void advance(unsigned long us);
+};
+
+#else
+
+inline void OpenThermPhy::begin() {
+	pinMode(inPin, INPUT);
+	pinMode(outPin, OUTPUT);
+}
+
+inline void OpenThermPhy::attachEdgeInterrupt(void(*edgeCallback)(void)) {
+	attachInterrupt(digitalPinToInterrupt(inPin), edgeCallback, CHANGE);
+}
+
+inline void OpenThermPhy::detachEdgeInterrupt() {
+	detachInterrupt(digitalPinToInterrupt(inPin));
+}
+
+inline int IRAM_ATTR OpenThermPhy::read() { return digitalRead(inPin); }
+inline void IRAM_ATTR OpenThermPhy::setActive() { digitalWrite(outPin, LOW); }
+inline void IRAM_ATTR OpenThermPhy::setIdle() { digitalWrite(outPin, HIGH); }
+
+inline unsigned long IRAM_ATTR OpenThermPhy::micros() { return ::micros(); }
+inline unsigned long OpenThermPhy::millis() { return ::millis(); }
+inline void OpenThermPhy::delay(unsigned long ms) { ::delay(ms); }
+inline void IRAM_ATTR OpenThermPhy::delayMicroseconds(unsigned int us) { ::delayMicroseconds(us); }
+inline void OpenThermPhy::yield() { ::yield(); }
+inline void OpenThermPhy::disableInterrupts() { noInterrupts(); }
+inline void OpenThermPhy::enableInterrupts() { interrupts(); }
+
+#endif // USE_HOST
+
+#endif // OpenThermPhy_h
@@ -16,7 +16,9 @@ opentherm_ns = cg.esphome_ns.namespace("OpenThermGateway")
 OpenThermGW = opentherm_ns.class_("OpenThermGateway", cg.Component)
 
 AUTO_LOAD = ['sensor', 'binary_sensor', 'text_sensor', 'switch', 'number']
-MULTI_CONF = True
+MULTI_CONF = generate.MAX_INSTANCES
+
+CONF_TRACE_LEVEL = "trace_level"
 
 CONFIG_SCHEMA = cv.Schema(
     {
@@ -30,6 +32,16 @@ CONFIG_SCHEMA = cv.Schema(
         cv.Optional("cooling_enable", False): cv.boolean,
         cv.Optional("otc_active", False): cv.boolean,
         cv.Optional("ch2_active", False): cv.boolean,
+        cv.Optional("deferred_decoding", False): cv.boolean,
+        cv.Optional("adaptive_decoding", False): cv.boolean,
+        cv.Optional("hardware_timer"): cv.boolean,
+        cv.Optional("read_cache", False): cv.boolean,
+        cv.Optional("warm_start", True): cv.boolean,
+        cv.Optional("auto_update_budget"): cv.percentage,
+        cv.Optional("reply_deadline", "700ms"): cv.All(cv.positive_time_period_milliseconds, cv.Range(max=cv.TimePeriod(milliseconds=800))),
+        cv.Optional("boiler_response_timeout", "800ms"): cv.All(cv.positive_time_period_milliseconds, cv.Range(min=cv.TimePeriod(milliseconds=100), max=cv.TimePeriod(milliseconds=1000))),
+        cv.Optional("capture_size", 0): cv.int_range(min=0, max=65535),
+        cv.Optional(CONF_TRACE_LEVEL, "verbose"): cv.one_of(*generate.TRACE_LEVELS, lower=True),
     }
 ).extend(cv.COMPONENT_SCHEMA)
 
@@ -41,8 +53,13 @@ async def to_code(config):
     await cg.register_component(var, config)
 
     for key, value in config.items():
-        if key != CONF_ID:
+        if key != CONF_ID and key != CONF_TRACE_LEVEL:
             cg.add(getattr(var, f"set_{key}")(value))
+
+    # The instance selects the interrupt handlers and hardware timers of the gateway. The message
+    # table and the trace level are generated for all gateways, after every platform registered its entities
+    instance = generate.add_hub(var, config[CONF_ID].id, config[CONF_TRACE_LEVEL])
+    cg.add(var.set_instance(instance))
             
 
 def opentherm_component_schema():
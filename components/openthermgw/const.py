@@ -9,3 +9,9 @@ SWITCH = "switch"
 NUMBER = "number"
 OUTPUT = "output"
 INPUT_SENSOR = "input_sensor"
+DIAGNOSTIC_SENSOR = "diagnostic_sensor"
+
+CONF_DEADBAND = "deadband"
+CONF_MIN_PUBLISH_INTERVAL = "min_publish_interval"
+CONF_OVERRIDE = "override"
+CONF_CACHE_TIME = "cache_time"
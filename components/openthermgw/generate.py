@@ -2,6 +2,7 @@ from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple, TypeVar
 
 import esphome.codegen as cg
 from esphome.const import CONF_ID
+from esphome.core import CORE, coroutine_with_priority
 
 from . import const, schema
 
@@ -18,61 +19,227 @@ def define_has_component(component_type: str, keys: List[str]) -> None:
 
 TSchema = TypeVar("TSchema", bound=schema.EntitySchema)
 
-def define_message_handler(component_type: str, keys: List[str], schema_: schema.Schema[TSchema]) -> None:
-    
-    # The macros defined here should be able to generate things like this:
-    # // Parsing a message and publishing to sensors
-    # case OpenthermMessageID::Message:
-    #     // Can have multiple sensors here, for example for a Status message with multiple flags
-    #     this->thing_binary_sensor->publish_state(parse_flag8_lb_0(response));
-    #     this->other_binary_sensor->publish_state(parse_flag8_lb_1(response));
-    #     break;
-    # // Building a message for a write request
-    # case OpenthermMessageID::Message: {
-    #     unsigned int data = 0;
-    #     data = write_flag8_lb_0(some_input_switch->state, data); // Where input_sensor can also be a number/output/switch
-    #     data = write_u8_hb(some_number->state, data);
-    #     return ot->buildRequest(OpenthermMessageType::WriteData, OpenthermMessageID::Message, data);
-    # }
-
-    # There doesn't seem to be a way to combine the handlers for different components, so we'll
-    # have to call them seperately in C++.
-
-    messages: Dict[str, List[Tuple[str, str]]] = {}
+# Messages with a dedicated decoder in OpenThermGateway::parseResponse, they are always in the table
+MESSAGE_DECODERS: Dict[str, str] = {
+    "Status": "DECODER_STATUS",
+    "DayTime": "DECODER_DAYTIME",
+    "Date": "DECODER_DATE",
+    "Year": "DECODER_YEAR",
+}
+
+# Priorities of the auto-update messages, highest first
+MESSAGE_PRIORITIES = [ schema.PRIORITY_HIGH, schema.PRIORITY_NORMAL, schema.PRIORITY_LOW ]
+
+# Component types whose entities are published from boiler responses
+PUBLISHED_COMPONENT_TYPES = [ const.SENSOR, const.BINARY_SENSOR, const.TEXT_SENSOR, const.SWITCH ]
+
+# Component types whose entities rewrite the thermostat requests, and are written to the boiler when they change
+REWRITING_COMPONENT_TYPES = [ const.NUMBER ]
+
+# Component types whose entities rewrite instead of being published with `override: true`
+OVERRIDABLE_COMPONENT_TYPES = [ const.SWITCH ]
+
+# Frame handling logs compiled in, the global define is the most verbose level of all gateways
+TRACE_LEVELS = {
+    "none": "OPENTHERMGW_TRACE_LEVEL_NONE",
+    "errors": "OPENTHERMGW_TRACE_LEVEL_ERRORS",
+    "frames": "OPENTHERMGW_TRACE_LEVEL_FRAMES",
+    "verbose": "OPENTHERMGW_TRACE_LEVEL_VERBOSE",
+}
+
+# Gateways per device, OPENTHERMGW_MAX_INSTANCES in OpenThermGateway.h
+MAX_INSTANCES = 4
+
+Hub = Tuple[cg.MockObj, str, str]
+
+def get_hubs() -> List[Hub]:
+    """The (variable, id, trace level) of every gateway, the index in this list is the gateway instance."""
+    return CORE.data.setdefault(const.OPENTHERMGW, {}).setdefault("hubs", [])
+
+def add_hub(hub: cg.MockObj, hub_id: str, trace_level: str) -> int:
+    """Register a gateway and return its instance index. The message table job is added with the first one."""
+    hubs = get_hubs()
+    if not hubs:
+        CORE.add_job(define_message_table)
+    hubs.append((hub, hub_id, trace_level))
+    return len(hubs) - 1
+
+def get_entities(hub_id: str) -> List[Tuple[str, str, schema.EntitySchema, Dict[str, Any]]]:
+    """The (component type, key, schema, config) of every entity configured for a hub, across all platforms."""
+    return CORE.data.setdefault(const.OPENTHERMGW, {}).setdefault("entities", {}).setdefault(hub_id, [])
+
+def register_entities(hub_id: str, component_type: str, keys: List[str], schema_: schema.Schema[TSchema], config: Dict[str, Any]) -> None:
+    entities = get_entities(hub_id)
     for key in keys:
-        msg = schema_[key]["message"]
-        if msg not in messages:
-            messages[msg] = []
-        messages[msg].append((key, schema_[key]["message_data"]))
+        entities.append((component_type, key, schema_[key], config[key]))
+
+def get_publish_filter(conf: Dict[str, Any]) -> Tuple[str, str]:
+    """The deadband and minimum publish interval (ms) of an entity, as arguments of the ENTITY macro."""
+    deadband = float(conf[const.CONF_DEADBAND]) if const.CONF_DEADBAND in conf else 0.0
+    interval = conf[const.CONF_MIN_PUBLISH_INTERVAL].total_milliseconds if const.CONF_MIN_PUBLISH_INTERVAL in conf else 0
+    return f"{deadband!r}f", f"{interval}"
+
+def per_instance(values: Dict[int, str]) -> str:
+    """An expression of the publishers giving the value of the gateway, a constant when all gateways agree."""
+    distinct = list(dict.fromkeys(values.values()))
+    if len(distinct) == 1:
+        return distinct[0]
+    expression = values[max(values)]
+    for instance in sorted(values, reverse=True)[1:]:
+        expression = f"(gateway->m_instance=={instance} ? {values[instance]} : {expression})"
+    return expression
+
+def get_cache_times() -> Dict[str, int]:
+    """The read cache time of every message, whether or not its entities are configured."""
+    cache_times: Dict[str, int] = {}
+    for schema_ in (schema.SENSORS, schema.BINARY_SENSORS, schema.TEXT_SENSORS, schema.SWITCHES):
+        for entity in schema_.values():
+            if entity.get("cache_time", 0) > 0:
+                msg = entity["message"]
+                cache_times[msg] = min(cache_times.get(msg, entity["cache_time"]), entity["cache_time"])
+    return cache_times
+
+@coroutine_with_priority(-100.0)
+async def define_message_table() -> None:
+    """Generate the response dispatch table, once all platforms have registered their entities.
+
+    The table and the entity lists are compiled once for all gateways, from the entities of every
+    gateway: an entity configured for another gateway is NULL. Messages are then registered per gateway.
+
+    The macros defined here generate things like this:
+    // One publisher per message, publishing the response to all entities of every type
+    // whose value changed since their last publish
+    void OpenThermGateway::publish_Status(OpenThermGateway *gateway, uint16_t data) {
+        if(gateway->flame_on_binary_sensor!=NULL && is_publish_due(gateway->flame_on_binary_sensor_publish, data, 0)) { ... publish_state(...); }
+        if(gateway->fault_indication_binary_sensor!=NULL && is_publish_due(gateway->fault_indication_binary_sensor_publish, data, 0)) { ... publish_state(...); }
+    }
+    // One rewriter per message, patching the data of a thermostat request with the inputs of the message
+    uint16_t OpenThermGateway::rewrite_TrSet(OpenThermGateway *gateway, OpenThermMessageType type, uint16_t data) {
+        if(type==OpenThermMessageType::WRITE_DATA && gateway->t_roomset_override_number!=NULL && ...) data=message_data::write_f88(...);
+        return data;
+    }
+    // A table indexed by data ID with { publisher index, decoder, auto-update slot, read cache slot, rewriter index, warm start slot }
+    { 1, DECODER_STATUS, 0, 0, 0, 0 }, { 2, DECODER_NONE, 1, 0, 0, 0 }, { 3, DECODER_NONE, 0, 1, 0, 1 }, {}, ...
+    """
+    hubs = get_hubs()
+    cg.add_define("OPENTHERMGW_INSTANCES", len(hubs))
+    levels = list(TRACE_LEVELS)
+    cg.add_define("OPENTHERMGW_TRACE_LEVEL", cg.RawExpression(TRACE_LEVELS[max((trace_level for _, _, trace_level in hubs), key=levels.index)]))
+
+    keys: Dict[str, List[str]] = {}
+    publishers: Dict[str, List[Tuple[str, str, str]]] = {}
+    rewriters: Dict[str, List[str]] = {}
+    filters: Dict[Tuple[str, str], Dict[int, Tuple[str, str]]] = {}
+    update_times: Dict[str, int] = {}
+    init_messages: Set[str] = set()
+    for instance, (_, hub_id, _) in enumerate(hubs):
+        for component_type, key, entity, conf in get_entities(hub_id):
+            if key not in keys.setdefault(component_type, []):
+                keys[component_type].append(key)
+            if "message" not in entity:
+                continue
+            msg = entity["message"]
+            # The gateway checks the override flag of an entity, the table covers the entities of all gateways
+            overrides = component_type in OVERRIDABLE_COMPONENT_TYPES and conf.get(const.CONF_OVERRIDE, False)
+            if component_type in PUBLISHED_COMPONENT_TYPES and not overrides:
+                entity_macro = (component_type, key, entity["message_data"])
+                if entity_macro not in publishers.setdefault(msg, []):
+                    publishers[msg].append(entity_macro)
+                filters.setdefault((component_type, key), {})[instance] = get_publish_filter(conf)
+            if component_type in REWRITING_COMPONENT_TYPES or overrides:
+                rule = f"RULE({component_type.upper()}, {key}_{component_type.lower()}, {entity['message_data']})"
+                if rule not in rewriters.setdefault(msg, []):
+                    rewriters[msg].append(rule)
+            if entity["update_time"] > 0:
+                update_times[msg] = min(update_times.get(msg, entity["update_time"]), entity["update_time"])
+            if entity["init"]:
+                init_messages.add(msg)
+
+    for component_type, component_keys in keys.items():
+        define_has_component(component_type, component_keys)
+
+    def entity_macro(component_type: str, key: str, msg_data: str) -> str:
+        instance_filters = filters[(component_type, key)]
+        deadband = per_instance({ instance: deadband for instance, (deadband, _) in instance_filters.items() })
+        interval = per_instance({ instance: interval for instance, (_, interval) in instance_filters.items() })
+        return f"ENTITY({component_type.upper()}, {key}_{component_type.lower()}, {msg_data}, {deadband}, {interval})"
 
     cg.add_define(
-        f"OPENTHERMGW_{component_type.upper()}_MESSAGE_HANDLERS(MESSAGE, ENTITY, entity_sep, postscript, msg_sep)",
-        cg.RawExpression(
-            " msg_sep ".join([ 
-                f"MESSAGE({msg}) "
-                + " entity_sep ".join([ f"ENTITY({key}_{component_type.lower()}, {msg_data})" for key, msg_data in keys ])
-                + " postscript"
-                for msg, keys in messages.items()
-            ])
-        )
+        "OPENTHERMGW_MESSAGE_PUBLISHERS(PUBLISHER, ENTITY)",
+        cg.RawExpression(" ".join([ f"PUBLISHER({msg}, {' '.join(entity_macro(*ent) for ent in ents)})" for msg, ents in publishers.items() ]))
     )
 
-def define_readers(component_type: str, keys: List[str]) -> None:
-    for key in keys:
-        cg.add_define(f"OPENTHERMGW_READ_{key}", cg.RawExpression(f"this->{key}_{component_type.lower()}->state"))
+    cg.add_define(
+        "OPENTHERMGW_MESSAGE_REWRITERS(REWRITER, RULE)",
+        cg.RawExpression(" ".join([ f"REWRITER({msg}, {' '.join(rules)})" for msg, rules in rewriters.items() ]))
+    )
 
-def add_messages(hub: cg.MockObj, keys: List[str], schema_: schema.Schema[TSchema]):
-    messages: Set[Tuple[str, bool, int]] = set()
+    # Index 0 means no publisher / no auto-update slot / no rewriter
+    publisher_indexes = { msg: index + 1 for index, msg in enumerate(publishers) }
+    rewriter_indexes = { msg: index + 1 for index, msg in enumerate(rewriters) }
+    auto_update_slots = { msg: index + 1 for index, msg in enumerate(sorted(update_times, key=lambda msg: schema.MESSAGE_IDS[msg])) }
+    cache_times = get_cache_times()
+    cache_slots = { msg: index + 1 for index, msg in enumerate(sorted(cache_times, key=lambda msg: schema.MESSAGE_IDS[msg])) }
+    # The responses of the initial messages are kept for the warm start, when they are published as is
+    warm_start_messages = [ msg for msg in init_messages if msg in publisher_indexes and msg not in MESSAGE_DECODERS ]
+    warm_start_slots = { msg: index + 1 for index, msg in enumerate(sorted(warm_start_messages, key=lambda msg: schema.MESSAGE_IDS[msg])) }
+    messages_by_id = { data_id: msg for msg, data_id in schema.MESSAGE_IDS.items() }
+
+    rows: List[str] = []
+    for data_id in range(256):
+        msg = messages_by_id.get(data_id)
+        if msg in publisher_indexes or msg in MESSAGE_DECODERS or msg in auto_update_slots or msg in cache_slots or msg in rewriter_indexes:
+            rows.append(f"{{ {publisher_indexes.get(msg, 0)}, {MESSAGE_DECODERS.get(msg, 'DECODER_NONE')}, {auto_update_slots.get(msg, 0)}, {cache_slots.get(msg, 0)}, {rewriter_indexes.get(msg, 0)}, {warm_start_slots.get(msg, 0)} }}")
+        else:
+            rows.append("{}")
+    while rows and rows[-1] == "{}":
+        rows.pop()
+    cg.add_define("OPENTHERMGW_MESSAGE_TABLE", cg.RawExpression(", ".join(rows)))
+    cg.add_define("OPENTHERMGW_AUTO_UPDATE_SLOTS", len(auto_update_slots))
+    cg.add_define("OPENTHERMGW_READ_CACHE_SLOTS", len(cache_slots))
+    cg.add_define("OPENTHERMGW_REWRITE_SLOTS", len(rewriter_indexes))
+    cg.add_define("OPENTHERMGW_WARM_START_SLOTS", len(warm_start_slots))
+
+    for hub, hub_id, _ in hubs:
+        add_hub_messages(hub, hub_id, cache_times)
+
+def add_hub_messages(hub: cg.MockObj, hub_id: str, cache_times: Dict[str, int]) -> None:
+    """Register the initial, auto-update and cached messages of a gateway, from its own entities.
+
+    The cache time of a message is the shortest of its configured entities, their cache_time option
+    overriding the one of schema.py, and 0 disabling the cache of the message."""
+    init_messages: Set[str] = set()
+    update_times: Dict[str, int] = {}
+    priorities: Dict[str, str] = {}
+    hub_cache_times: Dict[str, int] = {}
+    for _, _, entity, conf in get_entities(hub_id):
+        if "message" not in entity:
+            continue
+        msg = entity["message"]
+        if "cache_time" in entity:
+            cache_time = int(conf[const.CONF_CACHE_TIME].total_seconds) if const.CONF_CACHE_TIME in conf else entity["cache_time"]
+            hub_cache_times[msg] = min(hub_cache_times.get(msg, cache_time), cache_time)
+        if entity["init"]:
+            init_messages.add(msg)
+        if entity["update_time"] > 0:
+            update_times[msg] = min(update_times.get(msg, entity["update_time"]), entity["update_time"])
+            priority = entity.get("priority", schema.PRIORITY_NORMAL)
+            priorities[msg] = min(priorities.get(msg, priority), priority, key=MESSAGE_PRIORITIES.index)
+
+    for msg in sorted(init_messages, key=lambda msg: schema.MESSAGE_IDS[msg]):
+        cg.add(hub.add_initial_message(cg.RawExpression(f"OpenThermMessageID::{msg}")))
+    for msg, update_time in update_times.items():
+        cg.add(hub.add_auto_update_message(cg.RawExpression(f"OpenThermMessageID::{msg}"), update_time, getattr(openthermgw_ns, priorities[msg])))
+    for msg, cache_time in cache_times.items():
+        cache_time = hub_cache_times.get(msg, cache_time)
+        if cache_time > 0:
+            cg.add(hub.add_cached_message(cg.RawExpression(f"OpenThermMessageID::{msg}"), cache_time))
+
+def define_readers(component_type: str, keys: List[str]) -> None:
+    """OPENTHERMGW_READ_<key>(fallback), the state of the entity or the fallback when the gateway doesn't have it."""
     for key in keys:
-        messages.add((schema_[key]["message"], schema_[key]["init"], schema_[key]["update_time"]))
-    for msg, init, update_time in messages:
-        msg_expr = cg.RawExpression(f"OpenThermMessageID::{msg}")
-        if init:
-            cg.add(hub.add_initial_message(msg_expr))
-            
-        if update_time>0:
-            cg.add(hub.add_auto_update_message(msg_expr, update_time))
-            
+        entity = f"this->{key}_{component_type.lower()}"
+        cg.add_define(f"OPENTHERMGW_READ_{key}(fallback)", cg.RawExpression(f"({entity}!=NULL ? {entity}->state : (fallback))"))
 
 def add_property_set(var: cg.MockObj, config_key: str, config: Dict[str, Any]) -> None:
     if config_key in config:
@@ -102,7 +269,7 @@ async def component_to_code(component_type: str, schema_: schema.Schema[TSchema]
 
     keys: List[str] = []
     for key, conf in config.items():
-        if not isinstance(conf, dict):
+        if not isinstance(conf, dict) or key not in schema_:
             continue
         id = conf[CONF_ID]
         if id and id.type == type:
@@ -110,8 +277,6 @@ async def component_to_code(component_type: str, schema_: schema.Schema[TSchema]
             cg.add(getattr(hub, f"set_{key}_{component_type.lower()}")(entity))
             keys.append(key)
 
-    define_has_component(component_type, keys)
-    define_message_handler(component_type, keys, schema_)
-    add_messages(hub, keys, schema_)
+    register_entities(config[const.CONF_OPENTHERMGW_ID].id, component_type, keys, schema_, config)
 
     return keys
@@ -1,10 +1,15 @@
 #pragma once
 
+#include "OpenTherm.h"
+
 namespace esphome {
 namespace OpenThermGateway {
 
 #define OPENTHERMGW_MESSAGEID(message) OpenThermMessageID # message
 
+class OpenThermGateway;
+enum EMessagePriority : uint8_t;
+
 class OpenThermGatewayInput {
 public:
     bool auto_min_value, auto_max_value;
@@ -17,5 +22,22 @@ public:
     virtual void set_auto_max_value(bool auto_max_value) { this->auto_max_value = auto_max_value; }
 };
 
+// Entity whose changes are written to the boiler by its gateway, through the write queue
+class OpenThermGatewayWriter {
+public:
+    void set_gateway(OpenThermGateway *gateway, OpenThermMessageID message_id, EMessagePriority priority) {
+        this->gateway = gateway;
+        this->message_id = message_id;
+        this->priority = priority;
+    }
+
+protected:
+    void queue_write();
+
+    OpenThermGateway *gateway = nullptr;
+    OpenThermMessageID message_id;
+    EMessagePriority priority;
+};
+
 } // namespace OpenThermGateway
 } // namespace esphome
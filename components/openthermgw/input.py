@@ -13,6 +13,7 @@ CONF_auto_min_value = "auto_min_value"
 CONF_auto_max_value = "auto_max_value"
 
 OpenThermGatewayInput = generate.openthermgw_ns.class_("OpenThermGatewayInput")
+OpenThermGatewayWriter = generate.openthermgw_ns.class_("OpenThermGatewayWriter")
 
 def validate_min_value_less_than_max_value(conf):
     if CONF_min_value in conf and CONF_max_value in conf and conf[CONF_min_value] > conf[CONF_max_value]:
@@ -38,4 +39,8 @@ def generate_setters(entity: cg.MockObj, conf: Dict[str, Any]) -> None:
     generate.add_property_set(entity, CONF_step, conf)
     generate.add_property_set(entity, CONF_auto_min_value, conf)
     generate.add_property_set(entity, CONF_auto_max_value, conf)
-    
+
+def generate_writer(entity: cg.MockObj, hub: cg.MockObj, schema_entity: schema.EntitySchema) -> None:
+    """Link the entity to its gateway, which writes its changes to the boiler with the priority of the message."""
+    priority = schema_entity.get("priority", schema.PRIORITY_NORMAL)
+    cg.add(entity.set_gateway(hub, cg.RawExpression(f"OpenThermMessageID::{schema_entity['message']}"), getattr(generate.openthermgw_ns, priority)))
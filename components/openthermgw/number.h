@@ -6,12 +6,13 @@
 namespace esphome {
 namespace OpenThermGateway {
 
-class OpenThermGatewayNumber : public number::Number, public Component, public OpenThermGatewayInput {
+class OpenThermGatewayNumber : public number::Number, public Component, public OpenThermGatewayInput, public OpenThermGatewayWriter {
 protected:
     void setup() override;
     
     void control(float value) override {
         this->publish_state(value);
+        this->queue_write();
     }
 
 public:
@@ -10,13 +10,14 @@ from . import const, schema, validate, input, generate
 DEPENDENCIES = [ const.OPENTHERMGW ]
 COMPONENT_TYPE = const.NUMBER
 
-OpenThermGatewayNumber = generate.openthermgw_ns.class_("OpenThermGatewayNumber", number.Number, cg.Component, input.OpenThermGatewayInput)
+OpenThermGatewayNumber = generate.openthermgw_ns.class_("OpenThermGatewayNumber", number.Number, cg.Component, input.OpenThermGatewayInput, input.OpenThermGatewayWriter)
 
-async def new_openthermgwnumber(config: Dict[str, Any]) -> cg.Pvariable:
+async def new_openthermgwnumber(config: Dict[str, Any], key: str, hub: cg.MockObj) -> cg.Pvariable:
     var = cg.new_Pvariable(config[CONF_ID])
     await cg.register_component(var, config)
     await number.register_number(var, config, min_value = config[input.CONF_min_value], max_value = config[input.CONF_max_value], step = config[input.CONF_step])
     input.generate_setters(var, config)
+    input.generate_writer(var, hub, schema.INPUTS[key])
     return var
 
 def get_entity_validation_schema(entity: schema.InputSchema) -> cv.Schema:
@@ -35,7 +36,7 @@ async def to_code(config: Dict[str, Any]) -> None:
         COMPONENT_TYPE,
         schema.INPUTS,
         OpenThermGatewayNumber, 
-        generate.create_only_conf(new_openthermgwnumber), 
+        new_openthermgwnumber,
         config
     )
     generate.define_readers(COMPONENT_TYPE, keys)
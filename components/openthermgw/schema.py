@@ -6,6 +6,7 @@ from typing import Dict, Generic, Tuple, TypeVar, TypedDict, NotRequired
 from esphome.const import (
     UNIT_CELSIUS,
     UNIT_PERCENT,
+    UNIT_MILLISECOND,
     DEVICE_CLASS_COLD,
     DEVICE_CLASS_HEAT,
     DEVICE_CLASS_PRESSURE,
@@ -21,6 +22,84 @@ from esphome.const import (
     ENTITY_CATEGORY_DIAGNOSTIC,
 )
 
+MESSAGE_IDS: Dict[str, int] = {
+    "Status": 0,
+    "TSet": 1,
+    "MConfigMMemberIDcode": 2,
+    "SConfigSMemberIDcode": 3,
+    "Command": 4,
+    "ASFflags": 5,
+    "RBPflags": 6,
+    "CoolingControl": 7,
+    "TsetCH2": 8,
+    "TrOverride": 9,
+    "TSP": 10,
+    "TSPindexTSPvalue": 11,
+    "FHBsize": 12,
+    "FHBindexFHBvalue": 13,
+    "MaxRelModLevelSetting": 14,
+    "MaxCapacityMinModLevel": 15,
+    "TrSet": 16,
+    "RelModLevel": 17,
+    "CHPressure": 18,
+    "DHWFlowRate": 19,
+    "DayTime": 20,
+    "Date": 21,
+    "Year": 22,
+    "TrSetCH2": 23,
+    "Tr": 24,
+    "Tboiler": 25,
+    "Tdhw": 26,
+    "Toutside": 27,
+    "Tret": 28,
+    "Tstorage": 29,
+    "Tcollector": 30,
+    "TflowCH2": 31,
+    "Tdhw2": 32,
+    "Texhaust": 33,
+    "TdhwSetUBTdhwSetLB": 48,
+    "MaxTSetUBMaxTSetLB": 49,
+    "HcratioUBHcratioLB": 50,
+    "TdhwSet": 56,
+    "MaxTSet": 57,
+    "Hcratio": 58,
+    "Unknown99": 99,
+    "RemoteOverrideFunction": 100,
+    "OEMDiagnosticCode": 115,
+    "BurnerStarts": 116,
+    "CHPumpStarts": 117,
+    "DHWPumpValveStarts": 118,
+    "DHWBurnerStarts": 119,
+    "BurnerOperationHours": 120,
+    "CHPumpOperationHours": 121,
+    "DHWPumpValveOperationHours": 122,
+    "DHWBurnerOperationHours": 123,
+    "OpenThermVersionMaster": 124,
+    "OpenThermVersionSlave": 125,
+    "MasterVersion": 126,
+    "SlaveVersion": 127,
+    "Unknown140": 140,
+    "Unknown141": 141,
+    "Unknown142": 142,
+    "Unknown143": 143,
+    "Unknown144": 144,
+    "Unknown145": 145,
+    "Unknown146": 146,
+    "Unknown147": 147,
+    "Unknown148": 148,
+    "Unknown149": 149,
+    "Unknown150": 150,
+    "Unknown151": 151,
+    "Unknown152": 152,
+    "Unknown161": 161,
+    "Unknown180": 180,
+}
+"""Data ID of every OpenThermMessageID, keep in sync with the enum in OpenTherm.h"""
+
+PRIORITY_HIGH = "PRIORITY_HIGH"
+PRIORITY_NORMAL = "PRIORITY_NORMAL"
+PRIORITY_LOW = "PRIORITY_LOW"
+
 T = TypeVar("T")
 class Schema(Generic[T], Dict[str, T]):
     pass
@@ -57,6 +136,18 @@ class EntitySchema(TypedDict):
       When -1, read requests are sent by the thermostat at it's own rate
     """
 
+    priority: NotRequired[str]
+    """Priority of the periodic updates and of the writes of switches and numbers
+      (PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW), due messages with a higher 
+      priority are sent first. Default is PRIORITY_NORMAL
+    """
+
+    cache_time: NotRequired[int]
+    """Time in seconds a boiler response to this message can be used to answer thermostat 
+      reads directly (only for values which almost never change)
+      When missing, thermostat reads are always forwarded to the boiler
+    """
+
 class SensorSchema(EntitySchema):
     unit_of_measurement: NotRequired[str]
     accuracy_decimals: int
@@ -76,6 +167,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u8_lb",
         "init": True,
         "update_time": 60,
+        "priority": PRIORITY_HIGH,
     }),    
     "t_set": SensorSchema({
         "description": "Temperature setpoint for the boiler's supply water",
@@ -134,6 +226,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u16",
         "init": True,
         "update_time": 300,
+        "priority": PRIORITY_HIGH,
     }),    
     "master_ot_version": SensorSchema({
         "description": "OpenTherm version Master",
@@ -158,6 +251,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "f88",
         "init": True,
         "update_time": -1,        
+        "cache_time": 3600,
     }),
     "t_roomset": SensorSchema({
         "description": "Current room temperature setpoint",
@@ -279,6 +373,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "s8_hb",
         "init": True,
         "update_time": -1,        
+        "cache_time": 600,
     }),
     "t_dhw_set_lb": SensorSchema({
         "description": "Lower bound for adjustment of DHW setpoint",
@@ -290,6 +385,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "s8_lb",
         "init": True,
         "update_time": -1,        
+        "cache_time": 600,
     }),
     "max_t_set_ub": SensorSchema({
         "description": "Upper bound for adjustment of max CH setpoint",
@@ -301,6 +397,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "s8_hb",
         "init": True,
         "update_time": -1,        
+        "cache_time": 600,
     }),
     "max_t_set_lb": SensorSchema({
         "description": "Lower bound for adjustment of max CH setpoint",
@@ -312,6 +409,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "s8_lb",
         "init": True,
         "update_time": -1,        
+        "cache_time": 600,
     }),
     "max_t_set": SensorSchema({
         "description": "Maximum allowable CH water setpoint (°C)",
@@ -335,6 +433,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u16",
         "init": True,
         "update_time": -1,
+        "priority": PRIORITY_LOW,
     }),   
     "nb_startchpump": SensorSchema({
         "description": "Number of starts CH pump",
@@ -347,6 +446,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u16",
         "init": True,
         "update_time": -1,
+        "priority": PRIORITY_LOW,
     }),   
     "nb_startdhwpump": SensorSchema({
         "description": "Number of starts DHW pump/valve",
@@ -359,6 +459,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u16",
         "init": True,
         "update_time": -1,
+        "priority": PRIORITY_LOW,
     }),   
     "nb_burnerhours": SensorSchema({
         "description": "Number of hours that burner is in operation (i.e. flame on)",
@@ -371,6 +472,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u16",
         "init": True,
         "update_time": -1,
+        "priority": PRIORITY_LOW,
     }),   
     "nb_chpumphours": SensorSchema({
         "description": "Number of hours that CH pump has been running",
@@ -383,6 +485,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u16",
         "init": True,
         "update_time": -1,
+        "priority": PRIORITY_LOW,
     }),   
     "nb_dhwpumphours": SensorSchema({
         "description": "Number of hours that DHW pump has been running or DHW valve has been opened",
@@ -395,6 +498,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u16",
         "init": True,
         "update_time": -1,
+        "priority": PRIORITY_LOW,
     }),   
     "nb_dhwburnerhours": SensorSchema({
         "description": "Number of hours that burner is in operation during DHW mode",
@@ -407,6 +511,7 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u16",
         "init": True,
         "update_time": -1,
+        "priority": PRIORITY_LOW,
     }),       
     "master_memberid": SensorSchema({
         "description": "MemberID code of the master",
@@ -431,6 +536,8 @@ SENSORS: Schema[SensorSchema] = Schema({
         "message_data": "u8_lb",
         "init": True,
         "update_time": -1,        
+        "priority": PRIORITY_LOW,
+        "cache_time": 3600,
     }),   
     
     "Unknown99": SensorSchema({
@@ -635,41 +742,47 @@ class SwitchSchema(EntitySchema):
     icon: NotRequired[str]
     entity_category: NotRequired[str]
 
+# Master status flags: while a switch is off, its flag is cleared in the Status requests of the thermostat
 SWITCHES: Schema[SwitchSchema] = Schema({
     "ch_enable": SwitchSchema({
         "description": "Central Heating enabled",
         "message": "Status",
         "message_data": "flag8_hb_0",
         "init": False,
-        "update_time": -1,        
+        "update_time": -1,
+        "priority": PRIORITY_HIGH,
     }),
     "dhw_enable": SwitchSchema({
         "description": "Domestic Hot Water enabled",
         "message": "Status",
         "message_data": "flag8_hb_1",
         "init": False,
-        "update_time": -1,        
+        "update_time": -1,
+        "priority": PRIORITY_HIGH,
     }),
     "cooling_enable": SwitchSchema({
         "description": "Cooling enabled",
         "message": "Status",
         "message_data": "flag8_hb_2",
         "init": False,
-        "update_time": -1,        
+        "update_time": -1,
+        "priority": PRIORITY_HIGH,
     }),
     "otc_active": SwitchSchema({
         "description": "Outside temperature compensation active",
         "message": "Status",
         "message_data": "flag8_hb_3",        
         "init": False,
-        "update_time": -1,        
+        "update_time": -1,
+        "priority": PRIORITY_HIGH,
     }),
     "ch2_active": SwitchSchema({
         "description": "Central Heating 2 active",
         "message": "Status",
         "message_data": "flag8_hb_4",
         "init": False,
-        "update_time": -1,        
+        "update_time": -1,
+        "priority": PRIORITY_HIGH,
     }),
 })
 
@@ -786,6 +899,7 @@ BINARY_SENSORS: Schema[BinarySensorSchema] = Schema({
         "message_data": "flag8_hb_0",
         "init": True,
         "update_time": 60,
+        "priority": PRIORITY_HIGH,
     }),
     "fault_lockout": BinarySensorSchema({
         "description": "Fault: Lockout reset enabled",
@@ -796,6 +910,7 @@ BINARY_SENSORS: Schema[BinarySensorSchema] = Schema({
         "message_data": "flag8_hb_1",
         "init": True,
         "update_time": 60,
+        "priority": PRIORITY_HIGH,
     }),
     "fault_waterpress": BinarySensorSchema({
         "description": "Fault: Water pressure fault",
@@ -806,6 +921,7 @@ BINARY_SENSORS: Schema[BinarySensorSchema] = Schema({
         "message_data": "flag8_hb_2",
         "init": True,
         "update_time": 60,
+        "priority": PRIORITY_HIGH,
     }),
     "fault_gasflame": BinarySensorSchema({
         "description": "Fault: Gas/flame fault",
@@ -816,6 +932,7 @@ BINARY_SENSORS: Schema[BinarySensorSchema] = Schema({
         "message_data": "flag8_hb_3",
         "init": True,
         "update_time": 60,
+        "priority": PRIORITY_HIGH,
     }),
     "fault_airpress": BinarySensorSchema({
         "description": "Fault: Air pressure fault",
@@ -825,6 +942,7 @@ BINARY_SENSORS: Schema[BinarySensorSchema] = Schema({
         "message_data": "flag8_hb_4",
         "init": True,
         "update_time": 60,
+        "priority": PRIORITY_HIGH,
     }),
     "fault_watertemp": BinarySensorSchema({
         "description": "Fault: Water over-temp fault",
@@ -835,6 +953,7 @@ BINARY_SENSORS: Schema[BinarySensorSchema] = Schema({
         "message_data": "flag8_hb_5",
         "init": True,
         "update_time": 60,
+        "priority": PRIORITY_HIGH,
     }),    
     "fault_watertemp": BinarySensorSchema({
         "description": "Fault: Water over-temp fault",
@@ -845,6 +964,7 @@ BINARY_SENSORS: Schema[BinarySensorSchema] = Schema({
         "message_data": "flag8_hb_5",
         "init": True,
         "update_time": 60,
+        "priority": PRIORITY_HIGH,
     }),    
     "func_manualoverridepriority": BinarySensorSchema({
         "description": "Remote override manual change priority",
@@ -891,6 +1011,8 @@ TEXT_SENSORS: Schema[TextSensorSchema] = Schema({
         "message_data": "flag8_hb_0_str",
         "init": True,
         "update_time": 300,
+        "priority": PRIORITY_LOW,
+        "cache_time": 3600,
     }),    
     "control_type": SensorSchema({
         "description": "Config: Control type",
@@ -900,6 +1022,8 @@ TEXT_SENSORS: Schema[TextSensorSchema] = Schema({
         "message_data": "flag8_hb_1_str",
         "init": True,
         "update_time": 300,
+        "priority": PRIORITY_LOW,
+        "cache_time": 3600,
     }),
     "cooling_supported": SensorSchema({
         "description": "Config: Cooling supported",
@@ -910,6 +1034,8 @@ TEXT_SENSORS: Schema[TextSensorSchema] = Schema({
         "message_data": "flag8_hb_2_str",
         "init": True,
         "update_time": 300,
+        "priority": PRIORITY_LOW,
+        "cache_time": 3600,
     }),
     "dhw_config": SensorSchema({
         "description": "Config: Domestic Hot Water instantaneous/not specified or storage tank",
@@ -920,6 +1046,8 @@ TEXT_SENSORS: Schema[TextSensorSchema] = Schema({
         "message_data": "flag8_hb_3_str",
         "init": True,
         "update_time": 300,
+        "priority": PRIORITY_LOW,
+        "cache_time": 3600,
     }),
     "lowoff_pumpcontrol_allowed": SensorSchema({
         "description": "Config: Master low-off&pump control function",
@@ -929,6 +1057,8 @@ TEXT_SENSORS: Schema[TextSensorSchema] = Schema({
         "message_data": "flag8_hb_4_str",
         "init": True,
         "update_time": 300,
+        "priority": PRIORITY_LOW,
+        "cache_time": 3600,
     }),
     "ch2_present": SensorSchema({
         "description": "Config: CH2 present",
@@ -939,6 +1069,8 @@ TEXT_SENSORS: Schema[TextSensorSchema] = Schema({
         "message_data": "flag8_hb_5_str",
         "init": True,
         "update_time": 300,
+        "priority": PRIORITY_LOW,
+        "cache_time": 3600,
     }),        
     "ch2_present": SensorSchema({
         "description": "Config: CH2 present",
@@ -949,6 +1081,8 @@ TEXT_SENSORS: Schema[TextSensorSchema] = Schema({
         "message_data": "flag8_hb_5_str",
         "init": True,
         "update_time": 300,
+        "priority": PRIORITY_LOW,
+        "cache_time": 3600,
     }),        
 })    
 
@@ -962,86 +1096,223 @@ class InputSchema(EntitySchema):
     auto_max_value: NotRequired[AutoConfigure]
     auto_min_value: NotRequired[AutoConfigure]
 
+# Overrides of the values written by the thermostat: the data of its WRITE_DATA requests for the
+# message is replaced with the value of the number before they are forwarded, unless it is 0.
 INPUTS: Schema[InputSchema] = Schema({
-    "t_set": InputSchema({
-        "description": "Control setpoint: temperature setpoint for the boiler's supply water",
+    "t_roomset_override": InputSchema({
+        "description": "Current room temperature setpoint override",
         "unit_of_measurement": UNIT_CELSIUS,
-        "message": "TSet",
+        "message": "TrSet",
         "message_data": "f88",
-        "range": (0, 100),
-        "auto_max_value": { "message": "MaxTSet", "message_data": "f88" },
+        "range": (0, 30),
+        "init": False,
+        "update_time": -1,
     }),
-    "t_set_ch2": InputSchema({
-        "description": "Control setpoint 2: temperature setpoint for the boiler's supply water on the second heating circuit",
+    "t_roomset_ch2_override": InputSchema({
+        "description": "Current room temperature setpoint on CH2 override",
         "unit_of_measurement": UNIT_CELSIUS,
-        "message": "TsetCH2",
+        "message": "TrSetCH2",
+        "message_data": "f88",
+        "range": (0, 30),
+        "init": False,
+        "update_time": -1,
+    }),
+    "t_room_override": InputSchema({
+        "description": "Current sensed room temperature override",
+        "unit_of_measurement": UNIT_CELSIUS,
+        "message": "Tr",
+        "message_data": "f88",
+        "range": (-40, 127),
+        "init": False,
+        "update_time": -1,
+    }),
+    "t_set_override": InputSchema({
+        "description": "Control setpoint override: temperature setpoint for the boiler's supply water",
+        "unit_of_measurement": UNIT_CELSIUS,
+        "message": "TSet",
         "message_data": "f88",
         "range": (0, 100),
-        "auto_max_value": { "message": "MaxTSet", "message_data": "f88" },
+        "init": False,
+        "update_time": -1,
     }),
-    "cooling_control": InputSchema({
-        "description": "Cooling control signal",
-        "unit_of_measurement": UNIT_PERCENT,
-        "message": "CoolingControl",
+    "t_set_ch2_override": InputSchema({
+        "description": "Control setpoint 2 override: temperature setpoint for the boiler's supply water on the second heating circuit",
+        "unit_of_measurement": UNIT_CELSIUS,
+        "message": "TsetCH2",
         "message_data": "f88",
         "range": (0, 100),
+        "init": False,
+        "update_time": -1,
     }),
-    "t_dhw_set": InputSchema({
-        "description": "Domestic hot water temperature setpoint",
+    "t_dhw_set_override": InputSchema({
+        "description": "Domestic hot water temperature setpoint override",
         "unit_of_measurement": UNIT_CELSIUS,
         "message": "TdhwSet",
         "message_data": "f88",
         "range": (0, 127),
-        "auto_min_value": { "message": "TdhwSetUBTdhwSetLB", "message_data": "s8_lb" },
-        "auto_max_value": { "message": "TdhwSetUBTdhwSetLB", "message_data": "s8_hb" },
+        "init": False,
+        "update_time": -1,
     }),
-    "max_t_set": InputSchema({
-        "description": "Maximum allowable CH water setpoint",
+    "max_t_set_override": InputSchema({
+        "description": "Maximum allowable CH water setpoint override",
         "unit_of_measurement": UNIT_CELSIUS,
         "message": "MaxTSet",
         "message_data": "f88",
         "range": (0, 127),
-        "auto_min_value": { "message": "MaxTSetUBMaxTSetLB", "message_data": "s8_lb" },
-        "auto_max_value": { "message": "MaxTSetUBMaxTSetLB", "message_data": "s8_hb" },
-    }),
-    "t_room_set": InputSchema({
-        "description": "Current room temperature setpoint (informational)",
-        "unit_of_measurement": UNIT_CELSIUS,
-        "message": "TrSet",
-        "message_data": "f88",
-        "range": (-40, 127),
+        "init": False,
+        "update_time": -1,
     }),
-    "t_room_set_ch2": InputSchema({
-        "description": "Current room temperature setpoint on CH2 (informational)",
-        "unit_of_measurement": UNIT_CELSIUS,
-        "message": "TrSetCH2",
+    "max_rel_mod_override": InputSchema({
+        "description": "Maximum relative modulation level override",
+        "unit_of_measurement": UNIT_PERCENT,
+        "message": "MaxRelModLevelSetting",
         "message_data": "f88",
-        "range": (-40, 127),
+        "range": (0, 100),
+        "init": False,
+        "update_time": -1,
     }),
-    "t_room": InputSchema({
-        "description": "Current sensed room temperature (informational)",
-        "unit_of_measurement": UNIT_CELSIUS,
-        "message": "Tr",
+    "cooling_control_override": InputSchema({
+        "description": "Cooling control signal override",
+        "unit_of_measurement": UNIT_PERCENT,
+        "message": "CoolingControl",
         "message_data": "f88",
-        "range": (-40, 127),
+        "range": (0, 100),
+        "init": False,
+        "update_time": -1,
     }),
 })
 
-class InputSchema(EntitySchema):
-    unit_of_measurement: str
-    range: Tuple[int, int]
-    auto_max_value: NotRequired[AutoConfigure]
-    auto_min_value: NotRequired[AutoConfigure]
+class DiagnosticSensorSchema(TypedDict):
+    description: str
+    """Description of the measurement"""
 
-INPUTS: Schema[InputSchema] = Schema({
-    "t_roomset_override": InputSchema({
-        "description": "Current room temperature setpoint override",
-        "unit_of_measurement": UNIT_CELSIUS,
-        "message": "TSet",
-        "keep_updated": True,
-        "message_data": "f88",
-        "range": (0, 30),
-        "init": False,
-        "update_time": -1,
+    unit_of_measurement: NotRequired[str]
+    accuracy_decimals: int
+    icon: NotRequired[str]
+    state_class: str
+
+DIAGNOSTIC_SENSORS: Schema[DiagnosticSensorSchema] = Schema({
+    "forward_latency_p50": DiagnosticSensorSchema({
+        "description": "Median time between the end of a thermostat request and its forwarding to the boiler, over the last minute",
+        "unit_of_measurement": UNIT_MILLISECOND,
+        "accuracy_decimals": 0,
+        "icon": "mdi:timer-outline",
+        "state_class": STATE_CLASS_MEASUREMENT,
+    }),
+    "forward_latency_p95": DiagnosticSensorSchema({
+        "description": "95th percentile of the time between the end of a thermostat request and its forwarding to the boiler, over the last minute",
+        "unit_of_measurement": UNIT_MILLISECOND,
+        "accuracy_decimals": 0,
+        "icon": "mdi:timer-outline",
+        "state_class": STATE_CLASS_MEASUREMENT,
+    }),
+    "boiler_response_time_p50": DiagnosticSensorSchema({
+        "description": "Median time between the end of a request and the start of the boiler response, over the last minute",
+        "unit_of_measurement": UNIT_MILLISECOND,
+        "accuracy_decimals": 0,
+        "icon": "mdi:timer-outline",
+        "state_class": STATE_CLASS_MEASUREMENT,
+    }),
+    "boiler_response_time_p95": DiagnosticSensorSchema({
+        "description": "95th percentile of the time between the end of a request and the start of the boiler response, over the last minute",
+        "unit_of_measurement": UNIT_MILLISECOND,
+        "accuracy_decimals": 0,
+        "icon": "mdi:timer-outline",
+        "state_class": STATE_CLASS_MEASUREMENT,
+    }),
+    "boiler_response_time_max": DiagnosticSensorSchema({
+        "description": "Longest time between the end of a request and the start of the boiler response, over the last minute (OpenTherm allows 800ms)",
+        "unit_of_measurement": UNIT_MILLISECOND,
+        "accuracy_decimals": 0,
+        "icon": "mdi:timer-alert-outline",
+        "state_class": STATE_CLASS_MEASUREMENT,
+    }),
+    "thermostat_frame_rate": DiagnosticSensorSchema({
+        "description": "Frames received from the thermostat per minute",
+        "unit_of_measurement": "frames/min",
+        "accuracy_decimals": 0,
+        "icon": "mdi:swap-horizontal",
+        "state_class": STATE_CLASS_MEASUREMENT,
+    }),
+    "boiler_frame_rate": DiagnosticSensorSchema({
+        "description": "Frames received from the boiler per minute",
+        "unit_of_measurement": "frames/min",
+        "accuracy_decimals": 0,
+        "icon": "mdi:swap-horizontal",
+        "state_class": STATE_CLASS_MEASUREMENT,
+    }),
+    "thermostat_invalid_frames": DiagnosticSensorSchema({
+        "description": "Frames from the thermostat dropped as invalid (bad timing or parity)",
+        "accuracy_decimals": 0,
+        "icon": "mdi:counter",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "boiler_invalid_frames": DiagnosticSensorSchema({
+        "description": "Frames from the boiler dropped as invalid (bad timing or parity)",
+        "accuracy_decimals": 0,
+        "icon": "mdi:counter",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "filtered_glitches": DiagnosticSensorSchema({
+        "description": "Noise pulses filtered out of the frames by the adaptive decoder, both lines",
+        "accuracy_decimals": 0,
+        "icon": "mdi:sine-wave",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "gateway_frames": DiagnosticSensorSchema({
+        "description": "Requests sent to the boiler by the gateway itself (initialization, auto-update, cache refresh)",
+        "accuracy_decimals": 0,
+        "icon": "mdi:counter",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "fallback_replies": DiagnosticSensorSchema({
+        "description": "Thermostat requests answered by the gateway at the reply deadline, the boiler being late",
+        "accuracy_decimals": 0,
+        "icon": "mdi:timer-alert-outline",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "dropped_requests": DiagnosticSensorSchema({
+        "description": "Thermostat requests dropped, the boiler response of the previous one still pending",
+        "accuracy_decimals": 0,
+        "icon": "mdi:counter",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "boiler_timeouts": DiagnosticSensorSchema({
+        "description": "Boiler transactions without response",
+        "accuracy_decimals": 0,
+        "icon": "mdi:counter",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "boiler_invalid_responses": DiagnosticSensorSchema({
+        "description": "Boiler responses dropped as invalid frames (bad parity, bad message)",
+        "accuracy_decimals": 0,
+        "icon": "mdi:counter",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "boiler_retries": DiagnosticSensorSchema({
+        "description": "Thermostat requests forwarded again to the boiler after an invalid or missing response",
+        "accuracy_decimals": 0,
+        "icon": "mdi:counter",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "boiler_offline": DiagnosticSensorSchema({
+        "description": "Times the boiler went offline, too many transactions in a row without valid response",
+        "accuracy_decimals": 0,
+        "icon": "mdi:lan-disconnect",
+        "state_class": STATE_CLASS_TOTAL_INCREASING,
+    }),
+    "bus_utilization": DiagnosticSensorSchema({
+        "description": "Share of the time the boiler bus was busy with a transaction, over the last minute",
+        "unit_of_measurement": UNIT_PERCENT,
+        "accuracy_decimals": 1,
+        "icon": "mdi:gauge",
+        "state_class": STATE_CLASS_MEASUREMENT,
+    }),
+    "loop_stall_time": DiagnosticSensorSchema({
+        "description": "Time the main loop was blocked sending frames without a hardware timer, over the last minute",
+        "unit_of_measurement": UNIT_MILLISECOND,
+        "accuracy_decimals": 0,
+        "icon": "mdi:timer-sand",
+        "state_class": STATE_CLASS_MEASUREMENT,
     }),
 })
@@ -2,6 +2,7 @@ from typing import Any, Dict
 
 import esphome.config_validation as cv
 from esphome.components import sensor
+from esphome.const import ENTITY_CATEGORY_DIAGNOSTIC
 
 from . import const, schema, validate, generate
 
@@ -16,9 +17,19 @@ def get_entity_validation_schema(entity: schema.SensorSchema) -> cv.Schema:
         icon = entity["icon"] if "icon" in entity else sensor._UNDEF,
         state_class = entity["state_class"],
         entity_category = entity["entity_category"] if "entity_category" in entity else sensor._UNDEF        
+    ).extend(validate.SENSOR_PUBLISH_FILTER_SCHEMA)
+
+def get_diagnostic_validation_schema(entity: schema.DiagnosticSensorSchema) -> cv.Schema:
+    return sensor.sensor_schema(
+        unit_of_measurement = entity["unit_of_measurement"] if "unit_of_measurement" in entity else sensor._UNDEF,
+        accuracy_decimals = entity["accuracy_decimals"],
+        icon = entity["icon"] if "icon" in entity else sensor._UNDEF,
+        state_class = entity["state_class"],
+        entity_category = ENTITY_CATEGORY_DIAGNOSTIC
     )
 
-CONFIG_SCHEMA = validate.create_component_schema(schema.SENSORS, get_entity_validation_schema)
+CONFIG_SCHEMA = validate.create_component_schema(schema.SENSORS, get_entity_validation_schema) \
+    .extend(validate.create_entities_schema(schema.DIAGNOSTIC_SENSORS, get_diagnostic_validation_schema))
 
 async def to_code(config: Dict[str, Any]) -> None:
     await generate.component_to_code(
@@ -28,3 +39,10 @@ async def to_code(config: Dict[str, Any]) -> None:
         generate.create_only_conf(sensor.new_sensor), 
         config
     )
+    await generate.component_to_code(
+        const.DIAGNOSTIC_SENSOR,
+        schema.DIAGNOSTIC_SENSORS,
+        sensor.Sensor,
+        generate.create_only_conf(sensor.new_sensor),
+        config
+    )
@@ -4,10 +4,18 @@
 namespace esphome {
 namespace OpenThermGateway {
 void OpenThermGatewaySwitch::write_state(bool state) {
+    if(!this->override_enabled)
+        return;
+    this->publish_state(state);
+    this->queue_write();
 }
 
 void OpenThermGatewaySwitch::setup() {
-    bool initial_state = false;
+    if(!this->override_enabled)
+        return;
+
+    // On by default, the thermostat is then in control of the flag
+    bool initial_state = this->get_initial_state_with_restore_mode().value_or(true);
 /*    switch (this->mode) {
         case OPENTHERM_SWITCH_RESTORE_DEFAULT_ON:
             initial_state = this->get_initial_state().value_or(true);
@@ -23,7 +31,7 @@ void OpenThermGatewaySwitch::setup() {
             break;
     }*/
 
-    this->write_state(initial_state);
+    this->publish_state(initial_state);
 }
 
 } // namespace opentherm
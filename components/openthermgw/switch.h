@@ -2,6 +2,7 @@
 
 #include "esphome/core/component.h"
 #include "esphome/components/switch/switch.h"
+#include "input.h"
 
 namespace esphome {
 namespace OpenThermGateway {
@@ -13,14 +14,18 @@ namespace OpenThermGateway {
     OPENTHERM_SWITCH_START_OFF
 };*/
 
-class OpenThermGatewaySwitch : public switch_::Switch, public Component {
+class OpenThermGatewaySwitch : public switch_::Switch, public Component, public OpenThermGatewayWriter {
 protected:
 //    OpenthermSwitchMode mode;
 
     void write_state(bool state) override;
 
 public:
+    // Off clears the flag in the requests of the thermostat, otherwise the switch mirrors the boiler
+    bool override_enabled = false;
+
 //    void set_mode(OpenthermSwitchMode mode) { this->mode = mode; }
+    void set_override(bool override_enabled) { this->override_enabled = override_enabled; }
 
     void setup() override;
 };
@@ -3,27 +3,41 @@ from typing import Any, Dict
 import esphome.codegen as cg
 import esphome.config_validation as cv
 from esphome.components import switch
-from esphome.const import CONF_ID
+from esphome.const import CONF_ID, CONF_RESTORE_MODE
 
-from . import const, schema, validate, generate
+from . import const, schema, validate, input, generate
 
 DEPENDENCIES = [ const.OPENTHERMGW ]
 COMPONENT_TYPE = const.SWITCH
 
-OpenThermGatewaySwitch = generate.openthermgw_ns.class_("OpenThermGatewaySwitch", switch.Switch, cg.Component)
+OpenThermGatewaySwitch = generate.openthermgw_ns.class_("OpenThermGatewaySwitch", switch.Switch, cg.Component, input.OpenThermGatewayWriter)
 
 #CONF_MODE = "mode"
 
-async def new_openthermgwswitch(config: Dict[str, Any]) -> cg.Pvariable:
+RESTORE_MODE = cv.enum(switch.RESTORE_MODES, upper=True, space="_")
+
+async def new_openthermgwswitch(config: Dict[str, Any], key: str, hub: cg.MockObj) -> cg.Pvariable:
     var = cg.new_Pvariable(config[CONF_ID])
     await cg.register_component(var, config)
     await switch.register_switch(var, config)
 #    cg.add(getattr(var, "set_mode")(config[CONF_MODE]))
+    if config[const.CONF_OVERRIDE]:
+        cg.add(var.set_override(True))
+        input.generate_writer(var, hub, schema.SWITCHES[key])
     return var
 
+def validate_restore_mode(conf: Dict[str, Any]) -> Dict[str, Any]:
+    # An override switch is on by default, the thermostat is then in control of the flag
+    if CONF_RESTORE_MODE not in conf:
+        conf[CONF_RESTORE_MODE] = RESTORE_MODE("RESTORE_DEFAULT_ON" if conf[const.CONF_OVERRIDE] else "ALWAYS_OFF")
+    return conf
+
 def get_entity_validation_schema(entity: schema.SwitchSchema) -> cv.Schema:
     return switch.SWITCH_SCHEMA.extend({
         cv.GenerateID(): cv.declare_id(OpenThermGatewaySwitch),
+        # With override, off clears the flag in the requests of the thermostat and on leaves it in control, otherwise the switch mirrors the boiler
+        cv.Optional(const.CONF_OVERRIDE, default=False): cv.boolean,
+        cv.Optional(CONF_RESTORE_MODE): RESTORE_MODE,
 #        cv.Optional(CONF_MODE, entity["default_mode"]): 
 #            cv.enum({
 #                "restore_default_on": cg.RawExpression("openthermgw::OpenthermSwitchGWMode::OPENTHERM_SWITCH_RESTORE_DEFAULT_ON"), 
@@ -31,7 +45,7 @@ def get_entity_validation_schema(entity: schema.SwitchSchema) -> cv.Schema:
 #                "start_on": cg.RawExpression("openthermgw::OpenthermSwitchGWMode::OPENTHERM_SWITCH_START_ON"),
 #                "start_off": cg.RawExpression("openthermgw::OpenthermSwitchGWMode::OPENTHERM_SWITCH_START_OFF")
 #            })
-    }).extend(cv.COMPONENT_SCHEMA)
+    }).extend(cv.COMPONENT_SCHEMA).add_extra(validate_restore_mode)
 
 CONFIG_SCHEMA = validate.create_component_schema(schema.SWITCHES, get_entity_validation_schema)
 
@@ -40,7 +54,7 @@ async def to_code(config: Dict[str, Any]) -> None:
         COMPONENT_TYPE, 
         schema.SWITCHES,
         OpenThermGatewaySwitch, 
-        generate.create_only_conf(new_openthermgwswitch), 
+        new_openthermgwswitch,
         config
     )
     generate.define_readers(COMPONENT_TYPE, keys)
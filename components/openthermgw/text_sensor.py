@@ -13,7 +13,7 @@ def get_entity_validation_schema(entity: schema.TextSensorSchema) -> cv.Schema:
 #        device_class = entity["device_class"] if "device_class" in entity else text_sensor._UNDEF,
         icon = entity["icon"] if "icon" in entity else text_sensor._UNDEF,
         entity_category = entity["entity_category"] if "entity_category" in entity else text_sensor._UNDEF
-    )
+    ).extend(validate.PUBLISH_FILTER_SCHEMA)
 
 CONFIG_SCHEMA = validate.create_component_schema(schema.TEXT_SENSORS, get_entity_validation_schema)
 
@@ -4,10 +4,27 @@ import esphome.config_validation as cv
 
 from . import const, schema, generate
 
+# Optional publish filters of the entities published from boiler responses
+PUBLISH_FILTER_SCHEMA = cv.Schema({
+    cv.Optional(const.CONF_MIN_PUBLISH_INTERVAL): cv.positive_time_period_milliseconds,
+})
+
+SENSOR_PUBLISH_FILTER_SCHEMA = PUBLISH_FILTER_SCHEMA.extend({
+    cv.Optional(const.CONF_DEADBAND): cv.positive_float,
+})
+
+# Read cache time of the message of an entity that has one in schema.py, 0s to forward its reads to the boiler
+READ_CACHE_SCHEMA = cv.Schema({
+    cv.Optional(const.CONF_CACHE_TIME): cv.positive_time_period_seconds,
+})
+
 def create_entities_schema(entities: schema.Schema[schema.T], get_entity_validation_schema: Callable[[schema.T], cv.Schema]) -> cv.Schema:
     schema = {}
     for key, entity in entities.items():
-        schema[cv.Optional(key)] = get_entity_validation_schema(entity)
+        entity_schema = get_entity_validation_schema(entity)
+        if "cache_time" in entity:
+            entity_schema = entity_schema.extend(READ_CACHE_SCHEMA)
+        schema[cv.Optional(key)] = entity_schema
     return cv.Schema(schema)
 
 def create_component_schema(entities: schema.Schema[schema.T], get_entity_validation_schema: Callable[[schema.T], cv.Schema]) -> cv.Schema:
@@ -0,0 +1,180 @@
+#pragma once
+
+// Frames per second benchmark of the gateway on the ESPHome host platform, see otgw-bench.yaml
+//
+// A virtual thermostat (master) and boiler (slave) are wired to the gateway pins with
+// OpenThermVirtualBus. The thermostat sends its request cycle as soon as the protocol allows and
+// the boiler answers right away. Every loop advances the virtual clock by one loop period, so
+// the 100ms between transactions cost a few loops instead of real time and the gateway processes
+// frames as fast as the CPU allows. Results are logged every 10000 frames, the process exits
+// after the requested number of frames. The CPU time per frame includes the simulated devices,
+// which do the same work with every build of the gateway: the decoding of the gateway runs in
+// the interrupts of the lines they drive.
+
+#include "esphome.h"
+#include "otgw_host.h"
+#include <stdlib.h>
+
+namespace otgw_bench {
+	static const char *TAG="otgw_bench";
+
+	// Virtual pins of the simulated devices, the gateway pins are set in otgw-bench.yaml
+	static const int PIN_THERMOSTAT_IN=101;
+	static const int PIN_THERMOSTAT_OUT=102;
+	static const int PIN_BOILER_IN=103;
+	static const int PIN_BOILER_OUT=104;
+
+	static const unsigned long REPORT_FRAMES=10000;
+
+	// Requests sent after Status and TSet, one per cycle. 200 is unknown to the boiler.
+	struct SCycleRequest
+	{
+		OpenThermMessageType type;
+		uint8_t id;
+		uint16_t data;
+	};
+	static const SCycleRequest s_rotation[]={
+		{ WRITE_DATA, OpenThermMessageID::TrSet, 0x1480 },
+		{ WRITE_DATA, OpenThermMessageID::Tr, 0x1380 },
+		{ READ_DATA, OpenThermMessageID::Tboiler, 0 },
+		{ READ_DATA, OpenThermMessageID::RelModLevel, 0 },
+		{ READ_DATA, OpenThermMessageID::ASFflags, 0 },
+		{ READ_DATA, OpenThermMessageID::Tret, 0 },
+		{ READ_DATA, OpenThermMessageID::Toutside, 0 },
+		{ READ_DATA, OpenThermMessageID::Tdhw, 0 },
+		{ READ_DATA, OpenThermMessageID::CHPressure, 0 },
+		{ READ_DATA, OpenThermMessageID::SConfigSMemberIDcode, 0 },
+		{ READ_DATA, 200, 0 },
+	};
+
+	static OpenTherm *s_thermostat=NULL;
+	static OpenTherm *s_boiler=NULL;
+	static unsigned long s_usLoopPeriod=16000;
+	static unsigned long s_totalFrames=0;
+
+	static unsigned long s_step=0;
+	static unsigned long s_cycle=0;
+	static bool s_bBoilerPending=false;
+	static unsigned long s_boilerResponse=0;
+
+	// Frames sent to the gateway, and thermostat requests left unanswered
+	static unsigned long s_frames=0;
+	static unsigned long s_timeouts=0;
+	static unsigned long s_loops=0;
+	static unsigned long s_nextReport=REPORT_FRAMES;
+
+	static unsigned long long s_nsWallStart=0;
+	static unsigned long long s_nsCpuStart=0;
+	static unsigned long s_usVirtualStart=0;
+
+	static void IRAM_ATTR handleInterruptThermostat() { s_thermostat->handleInterrupt(); }
+	static void IRAM_ATTR handleInterruptBoiler() { s_boiler->handleInterrupt(); }
+
+	static void processResponseThermostat(unsigned long response, OpenThermResponseStatus status, void *pCallbackUser)
+	{
+		if(status==OpenThermResponseStatus::TIMEOUT)
+			s_timeouts++;
+	}
+
+	// The boiler knows the data IDs of the OpenTherm spec, the values change on every read
+	static void processRequestBoiler(unsigned long request, OpenThermResponseStatus status, void *pCallbackUser)
+	{
+		if(status!=OpenThermResponseStatus::SUCCESS)
+			return;
+		OpenThermMessageID id=s_boiler->getDataID(request);
+		uint16_t data=request&0xFFFF;
+		OpenThermMessageType type;
+		if(id>=OpenThermMessageID::Unknown180)
+			type=UNKNOWN_DATA_ID;
+		else if(s_boiler->getMessageType(request)==WRITE_DATA)
+			type=WRITE_ACK;
+		else
+		{
+			type=READ_ACK;
+			data=(id==OpenThermMessageID::Status) ? (data&0xFF00) | 0x0A : 0x1400+(s_frames&0x3FF);
+		}
+		s_boilerResponse=s_boiler->buildResponse(type, id, data);
+		s_bBoilerPending=true;
+	}
+
+	static unsigned long nextRequest()
+	{
+		unsigned long step=s_step++%3;
+		if(step==0)
+			return s_thermostat->buildSetBoilerStatusRequest(true, true);
+		if(step==1)
+			return s_thermostat->buildSetBoilerTemperatureRequest(45.0f+(s_cycle%20));
+
+		const SCycleRequest &request=s_rotation[s_cycle++%(sizeof(s_rotation)/sizeof(s_rotation[0]))];
+		return s_thermostat->buildRequest(request.type, (OpenThermMessageID)request.id, request.data);
+	}
+
+	static void report()
+	{
+		double sWall=(otgw_host::now_ns(CLOCK_MONOTONIC)-s_nsWallStart)/1e9;
+		double usCpu=(otgw_host::now_ns(CLOCK_PROCESS_CPUTIME_ID)-s_nsCpuStart)/1e3;
+		double sVirtual=(OpenThermPhy::micros()-s_usVirtualStart)/1e6;
+		ESP_LOGI(TAG, "%lu frames in %.1fs (%.0fs on the bus): %.0f frames/s, %.1fus CPU per frame, %lu loops, %lu timeouts",
+			s_frames, sWall, sVirtual, s_frames/sWall, usCpu/s_frames, s_loops, s_timeouts);
+	}
+
+	// Wires the simulated devices to the gateway pins, usLoopPeriod is the virtual time of a loop
+	void begin(int pinThermostatIn, int pinThermostatOut, int pinBoilerIn, int pinBoilerOut, unsigned long totalFrames, unsigned long usLoopPeriod=16000)
+	{
+		s_totalFrames=totalFrames;
+		s_usLoopPeriod=usLoopPeriod;
+
+		OpenThermVirtualBus::connect(PIN_THERMOSTAT_OUT, pinThermostatIn);
+		OpenThermVirtualBus::connect(pinThermostatOut, PIN_THERMOSTAT_IN);
+		OpenThermVirtualBus::connect(pinBoilerOut, PIN_BOILER_IN);
+		OpenThermVirtualBus::connect(PIN_BOILER_OUT, pinBoilerIn);
+
+		s_thermostat=new OpenTherm(PIN_THERMOSTAT_IN, PIN_THERMOSTAT_OUT);
+		s_thermostat->begin(handleInterruptThermostat, processResponseThermostat, NULL);
+		s_boiler=new OpenTherm(PIN_BOILER_IN, PIN_BOILER_OUT, true);
+		s_boiler->begin(handleInterruptBoiler, processRequestBoiler, NULL);
+
+		// Run the main loop without sleeping between iterations
+		App.set_loop_interval(0);
+
+		s_nsWallStart=otgw_host::now_ns(CLOCK_MONOTONIC);
+		s_nsCpuStart=otgw_host::now_ns(CLOCK_PROCESS_CPUTIME_ID);
+		s_usVirtualStart=OpenThermPhy::micros();
+		ESP_LOGI(TAG, "Benchmark started, %lu frames", s_totalFrames);
+	}
+
+	void loop()
+	{
+		if(s_thermostat==NULL)
+			return;
+
+		s_loops++;
+		s_thermostat->process();
+		s_boiler->process();
+		if(s_bBoilerPending)
+		{
+			s_bBoilerPending=false;
+			s_boiler->sendResponse(s_boilerResponse);
+			// A boiler accepts the next request right away, the master keeps the 100ms between transactions
+			s_boiler->status=OpenThermStatus::READY;
+			s_frames++;
+		}
+		if(s_thermostat->isReady())
+		{
+			s_thermostat->sendRequestAsync(nextRequest());
+			s_frames++;
+		}
+		OpenThermVirtualBus::advance(s_usLoopPeriod);
+
+		if(s_frames>=s_nextReport)
+		{
+			report();
+			s_nextReport+=REPORT_FRAMES;
+		}
+		if(s_frames>=s_totalFrames)
+		{
+			report();
+			exit(0);
+		}
+	}
+} // namespace otgw_bench
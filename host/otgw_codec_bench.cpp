@@ -0,0 +1,134 @@
+// Self-check and microbenchmark of the frame codec (OpenThermCodec.h, OpenThermMessageData.h)
+//
+//   g++ -O2 -std=gnu++17 -I components/openthermgw -o otgw_codec_bench host/otgw_codec_bench.cpp
+//   ./otgw_codec_bench
+//
+// Every message_data kind is checked on all 65536 data values: writing the parsed value back
+// must give the same data. The f8.8 encoder is checked on rounding, negative values and
+// saturation, the parity against a bit by bit count. Then the time per call is measured.
+// The exit code is 1 when a check fails.
+
+#include "OpenThermMessageData.h"
+#include <math.h>
+#include <stdio.h>
+#include <time.h>
+
+using namespace esphome;
+
+static unsigned long s_failures=0;
+static volatile uint32_t s_sink=0;
+
+static void fail(const char *kind, unsigned int data, unsigned int result)
+{
+	if(s_failures<20)
+		printf("FAIL %s: data %04X gives %04X\n", kind, data, result);
+	s_failures++;
+}
+
+// Reference parity: the bit loop the codec replaces
+static bool parityLoop(uint32_t frame)
+{
+	uint8_t p=0;
+	while(frame>0)
+	{
+		if(frame&1) p++;
+		frame>>=1;
+	}
+	return p&1;
+}
+
+static uint32_t nextRandom(uint32_t &state)
+{
+	state=state*1664525u+1013904223u;
+	return state;
+}
+
+static void checkRoundTrips()
+{
+	for(unsigned int data=0; data<0x10000; data++)
+	{
+		#define OPENTHERMGW_CHECK_FLAG(kind, bit) \
+			if(message_data::write_ ## kind(message_data::parse_ ## kind(data), data)!=data) \
+				fail(#kind, data, message_data::write_ ## kind(message_data::parse_ ## kind(data), data)); \
+			if(message_data::parse_ ## kind ## _str(NULL, data)!=(((data>>bit)&1) ? "ON" : "OFF")) \
+				fail(#kind "_str", data, 0);
+		OPENTHERMGW_MESSAGE_DATA_FLAGS(OPENTHERMGW_CHECK_FLAG)
+
+		#define OPENTHERMGW_CHECK_VALUE(kind, type) \
+			if(message_data::write_ ## kind(message_data::parse_ ## kind(data), data)!=data) \
+				fail(#kind, data, message_data::write_ ## kind(message_data::parse_ ## kind(data), data));
+		OPENTHERMGW_MESSAGE_DATA_VALUES(OPENTHERMGW_CHECK_VALUE)
+	}
+	if(message_data::parse_str_date(NULL, 0)!="00:00 00/00/0000")
+		fail("str_date", 0, 0);
+}
+
+static void checkValues()
+{
+	struct { float value; uint16_t data; } f88[]={
+		{ 0.0f, 0x0000 }, { 1.0f, 0x0100 }, { -1.0f, 0xFF00 }, { -0.5f, 0xFF80 }, { 21.5f, 0x1580 },
+		{ -40.25f, 0xD7C0 }, { 1/256.0f, 0x0001 }, { 0.002f, 0x0001 }, { 0.001f, 0x0000 }, { -0.002f, 0xFFFF },
+		{ 127.99f, 0x7FFD }, { 200.0f, 0x7FFF }, { -128.0f, 0x8000 }, { -200.0f, 0x8000 }, { NAN, 0x0000 }
+	};
+	for(const auto &check: f88)
+		if(message_data::write_f88(check.value, 0)!=check.data)
+			fail("f88 value", check.data, message_data::write_f88(check.value, 0));
+
+	if(message_data::write_s8_lb(-1, 0x1200)!=0x12FF)
+		fail("s8_lb value", 0x1200, message_data::write_s8_lb(-1, 0x1200));
+	if(message_data::write_s8_hb(-2, 0x0034)!=0xFE34)
+		fail("s8_hb value", 0x0034, message_data::write_s8_hb(-2, 0x0034));
+	if(message_data::write_flag8_hb_5(true, 0x00FF)!=0x20FF || message_data::write_flag8_lb_0(false, 0xFFFF)!=0xFFFE)
+		fail("flag8 value", 0, 0);
+
+	uint32_t state=1;
+	for(int i=0; i<1000000; i++)
+	{
+		uint32_t frame=nextRandom(state);
+		if(OpenThermCodec::parity(frame)!=parityLoop(frame))
+			fail("parity", frame>>16, frame&0xFFFF);
+	}
+}
+
+static double now_ns()
+{
+	struct timespec ts;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec*1e9+ts.tv_nsec;
+}
+
+#define OPENTHERMGW_BENCH(name, expression) \
+	{ \
+		const int count=10000000; \
+		uint32_t state=1, sum=0; \
+		double nsStart=now_ns(); \
+		for(int i=0; i<count; i++) \
+		{ \
+			uint32_t frame=nextRandom(state); \
+			sum+=(expression); \
+		} \
+		s_sink=sum; \
+		printf("%-28s %6.2f ns\n", name, (now_ns()-nsStart)/count); \
+	}
+
+int main()
+{
+	checkRoundTrips();
+	checkValues();
+	if(s_failures>0)
+	{
+		printf("%lu checks failed\n", s_failures);
+		return 1;
+	}
+	printf("All message_data kinds round-trip\n\n");
+
+	OPENTHERMGW_BENCH("parity (bit loop)", parityLoop(frame));
+	OPENTHERMGW_BENCH("parity (table)", OpenThermCodec::parity(frame));
+	OPENTHERMGW_BENCH("parse_flag8_hb_3", message_data::parse_flag8_hb_3(frame));
+	OPENTHERMGW_BENCH("write_flag8_hb_3", message_data::write_flag8_hb_3(frame&1, frame>>16));
+	OPENTHERMGW_BENCH("parse_s8_hb", (uint8_t)message_data::parse_s8_hb(frame));
+	OPENTHERMGW_BENCH("write_s8_hb", message_data::write_s8_hb((int8_t)frame, frame>>16));
+	OPENTHERMGW_BENCH("parse_f88", (uint32_t)message_data::parse_f88(frame));
+	OPENTHERMGW_BENCH("write_f88", message_data::write_f88((int16_t)frame/256.0f, 0));
+	return 0;
+}
@@ -0,0 +1,15 @@
+#pragma once
+
+// Helpers shared by the host platform harnesses (otgw_bench.h, otgw_replay.h)
+
+#include "esphome.h"
+#include <time.h>
+
+namespace otgw_host {
+	static unsigned long long now_ns(clockid_t clock)
+	{
+		struct timespec ts;
+		clock_gettime(clock, &ts);
+		return ts.tv_sec*1000000000ull+ts.tv_nsec;
+	}
+} // namespace otgw_host
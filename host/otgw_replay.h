@@ -0,0 +1,438 @@
+#pragma once
+
+// Trace replay through the gateway on the ESPHome host platform, see otgw-replay.yaml
+//
+// The thermostat requests of a recorded trace are sent to the gateway by a virtual thermostat,
+// at their recorded times scaled by timeScale (0: as fast as the protocol allows). A virtual
+// boiler answers the forwarded requests with the recorded responses, and the requests of the
+// gateway itself with the last value recorded for their data ID.
+//
+// What the gateway does is recorded as one line per event, prefixed by the number of thermostat
+// requests sent so far:
+//   request <frame>            thermostat request of the trace
+//   forward <frame>            request received by the boiler unchanged
+//   override <frame>           request received by the boiler with a different value
+//   retry <frame>              request forwarded again, answered only when the trace has its response
+//   inject <frame>             request sent by the gateway itself (initialization, auto-update)
+//   reply <frame>              response received by the thermostat, or timeout / invalid
+//   publish <object id> <state>
+// set_filter() keeps only some kinds of lines, e.g. "request forward retry reply" for a golden output
+// that doesn't depend on the entities. The lines are written to outputPath and compared with goldenPath,
+// when set. The process exits
+// with 0 when they match, 1 when they differ and 2 when a file can't be read or written. The CPU
+// time per frame is the time of the main loop iteration following each frame, simulated devices
+// included.
+//
+// The trace is a CSV file of timestamp (microseconds, empty when unknown), direction
+// (from_thermostat, to_boiler, from_boiler, to_thermostat or 0-3) and frame (hex), as written by
+// tools/otgw_sim and tools/otgw_trace.py --csv. Only the frames from the thermostat and from the
+// boiler are replayed.
+
+#include "esphome.h"
+#include "otgw_host.h"
+#include <stdarg.h>
+#include <stdlib.h>
+#include <string.h>
+#include <algorithm>
+#include <fstream>
+#include <map>
+#include <string>
+#include <vector>
+
+namespace otgw_replay {
+	static const char *TAG="otgw_replay";
+
+	// Virtual pins of the simulated devices, the gateway pins are set in otgw-replay.yaml
+	static const int PIN_THERMOSTAT_IN=111;
+	static const int PIN_THERMOSTAT_OUT=112;
+	static const int PIN_BOILER_IN=113;
+	static const int PIN_BOILER_OUT=114;
+
+	// Time left to the gateway to publish the last responses
+	static const unsigned long SETTLE_TIME_US=2000000;
+
+	static const char *const s_directions[]={ "from_thermostat", "to_boiler", "from_boiler", "to_thermostat" };
+
+	struct SReplayFrame
+	{
+		long long usTimestamp;		// -1 when unknown
+		uint8_t direction;		// ECaptureDirection
+		unsigned long frame;
+	};
+
+	struct SReplayRequest
+	{
+		long long usTimestamp;
+		unsigned long request;
+		unsigned long response=0;
+		bool bResponse=false;		// false when the boiler didn't answer
+		size_t frameIndex;		// Index in s_frames
+	};
+
+	static OpenTherm *s_thermostat=NULL;
+	static OpenTherm *s_boiler=NULL;
+	static float s_timeScale=1.0f;
+	static unsigned long s_usResponseTime=20000;
+	static unsigned long s_usLoopPeriod=16000;
+	static std::string s_outputPath;
+	static std::string s_goldenPath;
+
+	static std::vector<SReplayFrame> s_frames;
+	static std::vector<SReplayRequest> s_requests;
+	static std::vector<std::string> s_output;
+	static std::vector<std::string> s_filter;	// Kinds of lines recorded, all when empty
+
+	// Replay state
+	static size_t s_nextRequest=0;			// Next request of s_requests to send
+	static size_t s_nextValueFrame=0;		// Next frame of s_frames to apply to s_boilerValues
+	static bool s_bCurrentAnswered=true;		// The boiler answered the last request sent
+	static unsigned long s_currentForward=0;	// The last request sent as received by the boiler, 0 once replied
+	static std::map<uint8_t, unsigned long> s_boilerValues;	// Last READ_ACK of the trace by data ID
+	static bool s_bBoilerPending=false;
+	static unsigned long s_boilerResponse=0;
+	static unsigned long s_usBoilerDue=0;
+	static unsigned long s_usStart=0;
+	static unsigned long s_usIdleSince=0;
+	static bool s_bIdle=false;
+
+	// Per-frame processing time
+	static unsigned long s_frameCount=0;
+	static unsigned long s_loopFrames=0;		// Frames sent to the gateway in the previous loop
+	static unsigned long long s_nsLoopStart=0;
+	static unsigned long long s_nsCpuStart=0;
+	static unsigned long long s_nsWallStart=0;
+	static std::vector<float> s_usFrameTimes;
+
+	static void record(const char *format, ...)
+	{
+		char line[128];
+		int length=snprintf(line, sizeof(line), "%u ", (unsigned int)s_nextRequest);
+		va_list args;
+		va_start(args, format);
+		vsnprintf(line+length, sizeof(line)-length, format, args);
+		va_end(args);
+		std::string kind(line+length, strcspn(line+length, " "));
+		if(s_filter.empty() || std::find(s_filter.begin(), s_filter.end(), kind)!=s_filter.end())
+			s_output.push_back(line);
+	}
+
+	static bool parseFrame(const std::string &line, SReplayFrame &frame)
+	{
+		size_t comma1=line.find(',');
+		size_t comma2=(comma1==std::string::npos) ? std::string::npos : line.find(',', comma1+1);
+		if(comma2==std::string::npos)
+			return false;
+
+		std::string timestamp=line.substr(0, comma1);
+		std::string direction=line.substr(comma1+1, comma2-comma1-1);
+		char *end=NULL;
+		frame.usTimestamp=timestamp.empty() ? -1 : strtoll(timestamp.c_str(), &end, 10);
+		if(end!=NULL && *end!='\0')
+			return false;
+
+		frame.direction=0xFF;
+		for(uint8_t i=0; i<4; i++)
+			if(direction==s_directions[i] || direction==std::to_string(i))
+				frame.direction=i;
+		frame.frame=strtoul(line.c_str()+comma2+1, &end, 16);
+		return frame.direction!=0xFF && end!=line.c_str()+comma2+1;
+	}
+
+	static bool loadTrace(const char *tracePath)
+	{
+		std::ifstream file(tracePath);
+		if(!file)
+			return false;
+
+		std::string line;
+		while(std::getline(file, line))
+		{
+			if(!line.empty() && line.back()=='\r')
+				line.pop_back();
+			SReplayFrame frame;
+			// Skips the header and malformed lines
+			if(parseFrame(line, frame))
+				s_frames.push_back(frame);
+		}
+
+		// Pairs each thermostat request with the next boiler response with the same data ID
+		for(size_t i=0; i<s_frames.size(); i++)
+		{
+			const SReplayFrame &frame=s_frames[i];
+			if(frame.direction==esphome::OpenThermGateway::CAPTURE_FROM_THERMOSTAT)
+			{
+				SReplayRequest request;
+				request.usTimestamp=frame.usTimestamp;
+				request.request=frame.frame;
+				request.frameIndex=i;
+				s_requests.push_back(request);
+			}
+			else if(frame.direction==esphome::OpenThermGateway::CAPTURE_FROM_BOILER && !s_requests.empty())
+			{
+				SReplayRequest &request=s_requests.back();
+				if(!request.bResponse && s_boiler->getDataID(frame.frame)==s_boiler->getDataID(request.request))
+				{
+					request.response=frame.frame;
+					request.bResponse=true;
+				}
+			}
+		}
+		return true;
+	}
+
+	static void applyBoilerValues(size_t untilFrame)
+	{
+		for(; s_nextValueFrame<untilFrame && s_nextValueFrame<s_frames.size(); s_nextValueFrame++)
+		{
+			const SReplayFrame &frame=s_frames[s_nextValueFrame];
+			if(frame.direction==esphome::OpenThermGateway::CAPTURE_FROM_BOILER && s_boiler->getMessageType(frame.frame)==READ_ACK)
+				s_boilerValues[s_boiler->getDataID(frame.frame)]=frame.frame;
+		}
+	}
+
+	static void IRAM_ATTR handleInterruptThermostat() { s_thermostat->handleInterrupt(); }
+	static void IRAM_ATTR handleInterruptBoiler() { s_boiler->handleInterrupt(); }
+
+	static void processResponseThermostat(unsigned long response, OpenThermResponseStatus status, void *pCallbackUser)
+	{
+		s_currentForward=0;
+		if(status==OpenThermResponseStatus::SUCCESS)
+			record("reply %08lX", response);
+		else if(status==OpenThermResponseStatus::TIMEOUT)
+			record("timeout");
+		else
+			record("invalid");
+	}
+
+	// Forwarded requests get the recorded response, requests of the gateway the last recorded value
+	static void processRequestBoiler(unsigned long request, OpenThermResponseStatus status, void *pCallbackUser)
+	{
+		if(status!=OpenThermResponseStatus::SUCCESS)
+			return;
+
+		OpenThermMessageID id=s_boiler->getDataID(request);
+		if(!s_bCurrentAnswered && id==s_boiler->getDataID(s_requests[s_nextRequest-1].request))
+		{
+			const SReplayRequest &current=s_requests[s_nextRequest-1];
+			s_bCurrentAnswered=true;
+			s_currentForward=request;
+			record("%s %08lX", request==current.request ? "forward" : "override", request);
+			if(!current.bResponse)
+				return;
+			s_boilerResponse=current.response;
+		}
+		else if(s_currentForward!=0 && request==s_currentForward)
+		{
+			// Retried by the gateway before the thermostat got its response, the boiler stays silent if it was
+			const SReplayRequest &current=s_requests[s_nextRequest-1];
+			record("retry %08lX", request);
+			if(!current.bResponse)
+				return;
+			s_boilerResponse=current.response;
+		}
+		else
+		{
+			record("inject %08lX", request);
+			if(s_boiler->getMessageType(request)==WRITE_DATA)
+				s_boilerResponse=s_boiler->buildResponse(WRITE_ACK, id, request&0xFFFF);
+			else if(s_boilerValues.count(id)>0)
+				s_boilerResponse=s_boilerValues[id];
+			else
+				s_boilerResponse=s_boiler->buildResponse(UNKNOWN_DATA_ID, id, 0);
+		}
+		s_bBoilerPending=true;
+		s_usBoilerDue=OpenThermPhy::micros()+s_usResponseTime;
+	}
+
+	static void registerEntities()
+	{
+#ifdef USE_SENSOR
+		for(auto *sensor: App.get_sensors())
+			sensor->add_on_state_callback([sensor](float state) { record("publish %s %.3f", sensor->get_object_id().c_str(), state); });
+#endif
+#ifdef USE_BINARY_SENSOR
+		for(auto *sensor: App.get_binary_sensors())
+			sensor->add_on_state_callback([sensor](bool state) { record("publish %s %s", sensor->get_object_id().c_str(), state ? "ON" : "OFF"); });
+#endif
+#ifdef USE_TEXT_SENSOR
+		for(auto *sensor: App.get_text_sensors())
+			sensor->add_on_state_callback([sensor](std::string state) { record("publish %s %s", sensor->get_object_id().c_str(), state.c_str()); });
+#endif
+	}
+
+	static unsigned long compareGolden()
+	{
+		std::ifstream file(s_goldenPath);
+		if(!file)
+		{
+			ESP_LOGE(TAG, "Can't read the golden output %s", s_goldenPath.c_str());
+			exit(2);
+		}
+
+		std::vector<std::string> golden;
+		std::string line;
+		while(std::getline(file, line))
+			golden.push_back(line);
+
+		unsigned long differences=0;
+		for(size_t i=0; i<std::max(golden.size(), s_output.size()); i++)
+		{
+			const char *expected=(i<golden.size()) ? golden[i].c_str() : "<none>";
+			const char *actual=(i<s_output.size()) ? s_output[i].c_str() : "<none>";
+			if(strcmp(expected, actual)==0)
+				continue;
+			if(differences<10)
+				ESP_LOGE(TAG, "Line %u: expected '%s', got '%s'", (unsigned int)(i+1), expected, actual);
+			differences++;
+		}
+		return differences;
+	}
+
+	static void finish()
+	{
+		double sWall=(otgw_host::now_ns(CLOCK_MONOTONIC)-s_nsWallStart)/1e9;
+		double usCpu=(otgw_host::now_ns(CLOCK_PROCESS_CPUTIME_ID)-s_nsCpuStart)/1e3;
+		float usP95=0, usMax=0;
+		if(!s_usFrameTimes.empty())
+		{
+			std::sort(s_usFrameTimes.begin(), s_usFrameTimes.end());
+			usP95=s_usFrameTimes[s_usFrameTimes.size()*95/100];
+			usMax=s_usFrameTimes.back();
+		}
+		ESP_LOGI(TAG, "%u requests, %lu frames in %.1fs (%.0fs on the bus): %.1fus CPU per frame, loop after a frame p95 %.1fus, max %.1fus",
+			(unsigned int)s_requests.size(), s_frameCount, sWall, (OpenThermPhy::micros()-s_usStart)/1e6,
+			s_frameCount>0 ? usCpu/s_frameCount : 0, usP95, usMax);
+
+		if(!s_outputPath.empty())
+		{
+			std::ofstream file(s_outputPath);
+			for(const std::string &line: s_output)
+				file << line << "\n";
+			if(!file)
+			{
+				ESP_LOGE(TAG, "Can't write the output %s", s_outputPath.c_str());
+				exit(2);
+			}
+		}
+
+		if(s_goldenPath.empty())
+			exit(0);
+		unsigned long differences=compareGolden();
+		if(differences>0)
+		{
+			ESP_LOGE(TAG, "%lu lines differ from %s", differences, s_goldenPath.c_str());
+			exit(1);
+		}
+		ESP_LOGI(TAG, "%u lines match %s", (unsigned int)s_output.size(), s_goldenPath.c_str());
+		exit(0);
+	}
+
+	// Kinds of lines recorded, separated by spaces, all when empty. Called before begin().
+	void set_filter(const char *filter)
+	{
+		s_filter.clear();
+		std::string kinds(filter);
+		for(size_t start=0, end; start<kinds.size(); start=end+1)
+		{
+			end=kinds.find(' ', start);
+			if(end==std::string::npos)
+				end=kinds.size();
+			if(end>start)
+				s_filter.push_back(kinds.substr(start, end-start));
+		}
+	}
+
+	// Wires the simulated devices to the gateway pins and loads the trace. timeScale multiplies the
+	// recorded time between requests, usResponseTime is the response time of the boiler.
+	void begin(int pinThermostatIn, int pinThermostatOut, int pinBoilerIn, int pinBoilerOut, const char *tracePath, const char *outputPath,
+		const char *goldenPath, float timeScale=1.0f, unsigned long usResponseTime=20000, unsigned long usLoopPeriod=16000)
+	{
+		s_outputPath=outputPath;
+		s_goldenPath=goldenPath;
+		s_timeScale=timeScale;
+		s_usResponseTime=usResponseTime;
+		s_usLoopPeriod=usLoopPeriod;
+		OpenThermVirtualBus::connect(PIN_THERMOSTAT_OUT, pinThermostatIn);
+		OpenThermVirtualBus::connect(pinThermostatOut, PIN_THERMOSTAT_IN);
+		OpenThermVirtualBus::connect(pinBoilerOut, PIN_BOILER_IN);
+		OpenThermVirtualBus::connect(PIN_BOILER_OUT, pinBoilerIn);
+
+		s_thermostat=new OpenTherm(PIN_THERMOSTAT_IN, PIN_THERMOSTAT_OUT);
+		s_thermostat->begin(handleInterruptThermostat, processResponseThermostat, NULL);
+		s_boiler=new OpenTherm(PIN_BOILER_IN, PIN_BOILER_OUT, true);
+		s_boiler->begin(handleInterruptBoiler, processRequestBoiler, NULL);
+		if(!loadTrace(tracePath))
+		{
+			ESP_LOGE(TAG, "Can't read the trace %s", tracePath);
+			exit(2);
+		}
+		registerEntities();
+
+		// Run the main loop without sleeping between iterations
+		App.set_loop_interval(0);
+
+		s_usStart=OpenThermPhy::micros();
+		s_nsWallStart=otgw_host::now_ns(CLOCK_MONOTONIC);
+		s_nsCpuStart=otgw_host::now_ns(CLOCK_PROCESS_CPUTIME_ID);
+		s_nsLoopStart=s_nsCpuStart;
+		ESP_LOGI(TAG, "Replaying %u requests of %s", (unsigned int)s_requests.size(), tracePath);
+	}
+
+	static bool isRequestDue()
+	{
+		const SReplayRequest &request=s_requests[s_nextRequest];
+		const SReplayRequest &first=s_requests[0];
+		if(s_timeScale<=0 || request.usTimestamp<0 || first.usTimestamp<0)
+			return true;
+		unsigned long usDue=s_usStart+(unsigned long)((request.usTimestamp-first.usTimestamp)*s_timeScale);
+		return (long)(OpenThermPhy::micros()-usDue)>=0;
+	}
+
+	void loop()
+	{
+		if(s_thermostat==NULL)
+			return;
+
+		// The CPU time since the previous loop is the gateway handling the frames sent then
+		unsigned long long nsNow=otgw_host::now_ns(CLOCK_PROCESS_CPUTIME_ID);
+		if(s_loopFrames>0)
+			s_usFrameTimes.push_back((nsNow-s_nsLoopStart)/1e3f/s_loopFrames);
+		s_nsLoopStart=nsNow;
+		s_loopFrames=0;
+
+		s_thermostat->process();
+		s_boiler->process();
+		if(s_bBoilerPending && (long)(OpenThermPhy::micros()-s_usBoilerDue)>=0)
+		{
+			s_bBoilerPending=false;
+			s_boiler->sendResponse(s_boilerResponse);
+			// A boiler accepts the next request right away, the master keeps the 100ms between transactions
+			s_boiler->status=OpenThermStatus::READY;
+			if(s_boiler->getMessageType(s_boilerResponse)==READ_ACK)
+				s_boilerValues[s_boiler->getDataID(s_boilerResponse)]=s_boilerResponse;
+			s_frameCount++;
+			s_loopFrames++;
+		}
+		if(s_nextRequest<s_requests.size() && s_thermostat->isReady() && isRequestDue())
+		{
+			const SReplayRequest &request=s_requests[s_nextRequest];
+			applyBoilerValues(request.frameIndex);
+			s_nextRequest++;
+			s_bCurrentAnswered=false;
+			s_currentForward=0;
+			record("request %08lX", request.request);
+			s_thermostat->sendRequestAsync(request.request);
+			s_frameCount++;
+			s_loopFrames++;
+		}
+
+		bool bIdle=s_nextRequest>=s_requests.size() && s_thermostat->isReady() && !s_bBoilerPending;
+		if(bIdle && !s_bIdle)
+			s_usIdleSince=OpenThermPhy::micros();
+		s_bIdle=bIdle;
+		if(bIdle && OpenThermPhy::micros()-s_usIdleSince>=SETTLE_TIME_US)
+			finish();
+
+		OpenThermVirtualBus::advance(s_usLoopPeriod);
+	}
+} // namespace otgw_replay
@@ -0,0 +1,136 @@
+# OpenTherm frame layout and message_data decoding, shared by otgw_trace.py and
+# otgw_sim.
+#
+# Frames are built like OpenTherm::buildRequest / buildResponse of OpenTherm.cpp:
+# parity in bit 31 (the number of set bits is even), message type in bits 28-30,
+# data ID in bits 16-23 and data in bits 0-15. Values are decoded with the
+# message_data of the entities in components/openthermgw/schema.py, like the
+# firmware does.
+
+import importlib.util
+import os
+from typing import Any, Dict, List, Tuple
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "components", "openthermgw", "schema.py")
+
+# OpenThermMessageType
+READ_DATA = 0
+WRITE_DATA = 1
+INVALID_DATA = 2
+RESERVED = 3
+READ_ACK = 4
+WRITE_ACK = 5
+DATA_INVALID = 6
+UNKNOWN_DATA_ID = 7
+
+MESSAGE_TYPES = [ "READ_DATA", "WRITE_DATA", "INVALID_DATA", "RESERVED", "READ_ACK", "WRITE_ACK", "DATA_INVALID", "UNKNOWN_DATA_ID" ]
+
+# OpenThermResponseStatus
+STATUS_NONE = 0
+STATUS_SUCCESS = 1
+STATUS_INVALID = 2
+STATUS_INVALID_PARITY = 3
+STATUS_INVALID_MESSAGE = 4
+STATUS_TIMEOUT = 5
+
+# ECaptureDirection
+FROM_THERMOSTAT = 0
+TO_BOILER = 1
+FROM_BOILER = 2
+TO_THERMOSTAT = 3
+
+DIRECTIONS = [ "from_thermostat", "to_boiler", "from_boiler", "to_thermostat" ]
+
+def load_schema() -> Any:
+    """Load schema.py of the component, it only needs esphome.const."""
+    spec = importlib.util.spec_from_file_location("openthermgw_schema", SCHEMA_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def parity(frame: int) -> int:
+    """1 when the number of set bits of the frame is odd."""
+    return bin(frame & 0xFFFFFFFF).count("1") & 1
+
+def build_request(message_type: int, data_id: int, data: int) -> int:
+    """Same as OpenTherm::buildRequest, only WRITE_DATA sets a message type bit."""
+    frame = data & 0xFFFF
+    if message_type == WRITE_DATA:
+        frame |= 1 << 28
+    frame |= (data_id & 0xFF) << 16
+    if parity(frame):
+        frame |= 1 << 31
+    return frame
+
+def build_response(message_type: int, data_id: int, data: int) -> int:
+    """Same as OpenTherm::buildResponse."""
+    frame = data & 0xFFFF
+    frame |= (message_type & 0x7) << 28
+    frame |= (data_id & 0xFF) << 16
+    if parity(frame):
+        frame |= 1 << 31
+    return frame
+
+def is_valid_parity(frame: int) -> bool:
+    return parity(frame) == 0
+
+def get_message_type(frame: int) -> int:
+    return (frame >> 28) & 0x7
+
+def get_data_id(frame: int) -> int:
+    return (frame >> 16) & 0xFF
+
+def get_data(frame: int) -> int:
+    return frame & 0xFFFF
+
+def parse_value(message_data: str, data: Any) -> Any:
+    """Equivalent of the message_data::parse_* functions of OpenThermGateway.cpp.
+
+    data is an int, or a NumPy array of signed integers wider than 16 bits to
+    decode a whole trace at once. Returns None for the message_data decoded from
+    several messages (str_date)."""
+    parts = message_data.split("_")
+    if parts[0] == "flag8":
+        return (data >> ((8 if parts[1] == "hb" else 0) + int(parts[2]))) & 1
+    if parts[0] in ("u8", "s8"):
+        value = (data >> 8) & 0xFF if parts[1] == "hb" else data & 0xFF
+        return ((value ^ 0x80) - 0x80) if parts[0] == "s8" else value
+    if message_data == "u16":
+        return data & 0xFFFF
+    if message_data in ("s16", "f88"):
+        value = ((data & 0xFFFF) ^ 0x8000) - 0x8000
+        return value / 256.0 if message_data == "f88" else value
+    return None
+
+def write_value(message_data: str, value: float, data: int = 0) -> int:
+    """Equivalent of the message_data::write_* functions of OpenThermGateway.cpp, returns the updated data."""
+    parts = message_data.split("_")
+    if parts[0] == "flag8":
+        mask = 1 << ((8 if parts[1] == "hb" else 0) + int(parts[2]))
+        return data | mask if value else data & ~mask & 0xFFFF
+    if parts[0] in ("u8", "s8"):
+        byte = int(value) & 0xFF
+        return (data & 0x00FF) | (byte << 8) if parts[1] == "hb" else (data & 0xFF00) | byte
+    if message_data in ("u16", "s16"):
+        return int(value) & 0xFFFF
+    if message_data == "f88":
+        return int(round(value * 256.0)) & 0xFFFF
+    return data
+
+def get_message_data(schema: Any) -> Dict[str, Dict[str, str]]:
+    """The message_data of every entity of the schema, by message and key."""
+    result: Dict[str, Dict[str, str]] = {}
+    for schema_ in (schema.SENSORS, schema.BINARY_SENSORS, schema.TEXT_SENSORS, schema.SWITCHES, schema.INPUTS):
+        for key, entity in schema_.items():
+            result.setdefault(entity["message"], {})[key] = entity["message_data"]
+    return result
+
+def get_entities(schema: Any) -> Dict[int, List[Tuple[str, str]]]:
+    """The (key, message_data) of every entity of the schema, by data ID."""
+    entities: Dict[int, List[Tuple[str, str]]] = {}
+    for schema_ in (schema.SENSORS, schema.BINARY_SENSORS, schema.TEXT_SENSORS, schema.SWITCHES, schema.INPUTS):
+        for key, entity in schema_.items():
+            data_id = schema.MESSAGE_IDS.get(entity["message"])
+            if data_id is not None and (key, entity["message_data"]) not in entities.get(data_id, []):
+                entities.setdefault(data_id, []).append((key, entity["message_data"]))
+    return entities
@@ -0,0 +1,11 @@
+# Host-side simulation of an OpenTherm thermostat and boiler.
+#
+# The devices exchange frames with the layout of OpenTherm::buildRequest /
+# buildResponse and answer every data ID of components/openthermgw/schema.py.
+# Used as a load generator to exercise the gateway and its polling settings
+# without hardware, see __main__.py for the command line.
+
+from .boiler import Boiler
+from .protocol import build_request, build_response, load_schema
+from .simulation import CaptureWriter, CsvWriter, Simulation
+from .thermostat import Thermostat
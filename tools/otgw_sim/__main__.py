@@ -0,0 +1,95 @@
+# Command line of the simulator.
+#
+# Usage: python -m otgw_sim [--profile steady|bursty|slow-boiler|stress] [--duration SECONDS]
+#                           [--capture FILE] [--csv FILE|-] [--realtime] [--json] ...
+# (from the tools directory, or with it in PYTHONPATH)
+
+import argparse
+import json
+import random
+import sys
+from typing import Any, Dict, List, Optional
+
+from . import protocol
+from .boiler import Boiler
+from .simulation import CaptureWriter, CsvWriter, Simulation
+from .thermostat import Thermostat
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "steady": { "interval": 1.0, "burst": 1, "response_time": (50, 150) },
+    "bursty": { "interval": 1.0, "burst": 8, "response_time": (50, 150) },
+    "slow-boiler": { "interval": 1.0, "burst": 1, "response_time": (500, 900) },
+    "stress": { "interval": 0.0, "burst": 1, "response_time": (20, 40) },
+}
+"""Traffic profiles: thermostat request interval (s) and burst length, boiler response time range (ms)"""
+
+def parse_ids(value: str) -> List[int]:
+    return [ int(data_id, 0) for data_id in value.split(",") if data_id ]
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="otgw_sim", description="Simulated OpenTherm thermostat and boiler")
+    parser.add_argument("--profile", choices=PROFILES.keys(), default="steady", help="traffic profile (default: steady, one request per second)")
+    parser.add_argument("--duration", type=float, default=3600.0, help="simulated time in seconds (default: 3600)")
+    parser.add_argument("--interval", type=float, help="average time between thermostat requests in seconds")
+    parser.add_argument("--burst", type=int, help="number of thermostat requests sent back-to-back")
+    parser.add_argument("--response-time", type=float, nargs=2, metavar=("MIN", "MAX"), help="boiler response time range in ms")
+    parser.add_argument("--unknown-ids", type=parse_ids, default=[], help="data IDs answered with UNKNOWN_DATA_ID, e.g. 99,140")
+    parser.add_argument("--invalid-ids", type=parse_ids, default=[], help="data IDs answered with DATA_INVALID")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of the requests randomly answered with DATA_INVALID")
+    parser.add_argument("--silent-rate", type=float, default=0.0, help="share of the requests not answered by the boiler")
+    parser.add_argument("--extra-ids", type=parse_ids, default=[], help="data IDs also read by the thermostat")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="boiler value of an entity of schema.py, e.g. t_outside=-5")
+    parser.add_argument("--seed", type=int, help="seed of the random response times")
+    parser.add_argument("--capture", help="write the frames as capture records to this file")
+    parser.add_argument("--csv", help="write the frames as CSV to this file, - for stdout")
+    parser.add_argument("--realtime", action="store_true", help="write the frames at the pace of the simulated clock")
+    parser.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    args = parser.parse_args(argv)
+
+    profile = PROFILES[args.profile]
+    response_time = args.response_time or profile["response_time"]
+    schema = protocol.load_schema()
+    rng = random.Random(args.seed)
+
+    thermostat = Thermostat(schema, interval=profile["interval"] if args.interval is None else args.interval,
+                            burst=args.burst or profile["burst"], extra_ids=args.extra_ids)
+    boiler = Boiler(schema, response_time=(response_time[0] / 1000.0, response_time[1] / 1000.0), unknown_ids=args.unknown_ids,
+                    invalid_ids=args.invalid_ids, invalid_rate=args.invalid_rate, silent_rate=args.silent_rate, rng=rng)
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        try:
+            boiler.set_value(key, float(value))
+        except (KeyError, ValueError):
+            parser.error(f"invalid boiler value {setting}")
+
+    writers: List[Any] = []
+    files = []
+    if args.capture:
+        files.append(open(args.capture, "wb"))
+        writers.append(CaptureWriter(files[-1]))
+    if args.csv:
+        if args.csv == "-":
+            writers.append(CsvWriter(sys.stdout))
+        else:
+            files.append(open(args.csv, "w"))
+            writers.append(CsvWriter(files[-1]))
+
+    try:
+        result = Simulation(thermostat, boiler, writers, args.realtime).run(args.duration)
+    except KeyboardInterrupt:
+        return 1
+    finally:
+        for file in files:
+            file.close()
+
+    out = sys.stderr if args.csv == "-" else sys.stdout
+    if args.json:
+        json.dump(result, out, indent=2)
+        print(file=out)
+    else:
+        for key, value in result.items():
+            print(f"{key:<16} {value:.2f}" if isinstance(value, float) else f"{key:<16} {value}", file=out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
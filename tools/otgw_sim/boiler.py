@@ -0,0 +1,169 @@
+# Simulated OpenTherm boiler (slave).
+#
+# Answers every data ID of schema.MESSAGE_IDS from a table of 16-bit values, the
+# IDs it doesn't support with UNKNOWN_DATA_ID, and the IDs configured as invalid
+# (or a random share of the requests) with DATA_INVALID. A small thermal model
+# updates the status flags, temperatures, modulation and counters from the
+# setpoint written by the thermostat.
+
+import random
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from . import protocol
+
+DEFAULT_VALUES: Dict[str, int] = {
+    "SConfigSMemberIDcode": 0x0100,         # DHW present, member ID 0
+    "RBPflags": 0x0303,                     # DHW setpoint and max CH setpoint transfer enabled, read/write
+    "MaxCapacityMinModLevel": 0x190A,       # 25kW, 10%
+    "CHPressure": 0x0180,                   # 1.5bar
+    "Tdhw": 0x3000,                         # 48°C
+    "Toutside": 0x0800,                     # 8°C
+    "Texhaust": 0x003C,                     # 60°C
+    "TdhwSetUBTdhwSetLB": 0x4128,           # 65°C / 40°C
+    "MaxTSetUBMaxTSetLB": 0x5514,           # 85°C / 20°C
+    "TdhwSet": 0x3200,                      # 50°C
+    "MaxTSet": 0x4B00,                      # 75°C
+    "OpenThermVersionSlave": 0x0233,        # 2.2
+    "SlaveVersion": 0x0105,                 # type 1, version 5
+    "DayTime": 0x2800,                      # Monday 08:00
+    "Date": 0x0101,                         # January 1st
+    "Year": 0x07EA,                         # 2026
+}
+"""Initial data of the messages answered by the boiler, other messages start at 0"""
+
+READ_ONLY_MESSAGES = [
+    "SConfigSMemberIDcode", "ASFflags", "MaxCapacityMinModLevel", "RelModLevel", "CHPressure", "DHWFlowRate",
+    "Tboiler", "Tdhw", "Tret", "Texhaust", "TdhwSetUBTdhwSetLB", "MaxTSetUBMaxTSetLB", "OEMDiagnosticCode",
+    "OpenThermVersionSlave", "SlaveVersion",
+]
+"""Messages the boiler answers with DATA_INVALID when the thermostat writes them"""
+
+# Thermal model, per second
+BOILER_HEATING_RATE = 0.5
+"""Supply water temperature increase at full modulation (°C/s)"""
+BOILER_COOLING_RATE = 0.02
+"""Supply water temperature decrease towards the return temperature with the flame off (ratio/s)"""
+BOILER_HYSTERESIS = 5.0
+"""The flame is lit again when the supply water is this far below the setpoint (°C)"""
+RETURN_DELTA = 15.0
+"""Difference between supply and return water temperatures while heating (°C)"""
+
+class Boiler:
+    """A boiler answering the requests of the simulated thermostat or of a gateway.
+
+    - response_time: (min, max) time in seconds between the end of a request and the start of the response,
+      above 0.8s the response is too late for the thermostat
+    - unknown_ids: data IDs answered with UNKNOWN_DATA_ID in addition to the IDs missing in schema.MESSAGE_IDS
+    - invalid_ids: data IDs always answered with DATA_INVALID
+    - invalid_rate: share of the other requests randomly answered with DATA_INVALID
+    - silent_rate: share of the requests not answered at all
+    """
+
+    def __init__(self, schema: Any, response_time: Tuple[float, float] = (0.05, 0.15), unknown_ids: Iterable[int] = (),
+                 invalid_ids: Iterable[int] = (), invalid_rate: float = 0.0, silent_rate: float = 0.0,
+                 rng: Optional[random.Random] = None):
+        self.response_time = response_time
+        self.unknown_ids = set(unknown_ids)
+        self.invalid_ids = set(invalid_ids)
+        self.invalid_rate = invalid_rate
+        self.silent_rate = silent_rate
+        self.rng = rng or random.Random()
+
+        self.message_ids: Dict[str, int] = dict(schema.MESSAGE_IDS)
+        self.message_data = protocol.get_message_data(schema)
+        self.values: Dict[int, int] = { data_id: DEFAULT_VALUES.get(msg, 0) for msg, data_id in self.message_ids.items() }
+        self.read_only = { self.message_ids[msg] for msg in READ_ONLY_MESSAGES if msg in self.message_ids }
+
+        self.t_boiler = 20.0
+        self.flame = False
+        self.burner_seconds = 0.0
+        self.requests = 0
+        self.answered: Dict[int, int] = {}
+        """Number of responses by message type"""
+
+    def supports(self, data_id: int) -> bool:
+        return data_id in self.values and data_id not in self.unknown_ids
+
+    def get(self, msg: str) -> int:
+        return self.values[self.message_ids[msg]]
+
+    def set(self, msg: str, data: int) -> None:
+        self.values[self.message_ids[msg]] = data & 0xFFFF
+
+    def set_value(self, key: str, value: float) -> None:
+        """Set the value of an entity of the schema, e.g. set_value("t_outside", -5)."""
+        for msg, entities in self.message_data.items():
+            if key in entities and msg in self.message_ids:
+                self.set(msg, protocol.write_value(entities[key], value, self.get(msg)))
+                return
+        raise KeyError(f"Unknown entity {key}")
+
+    def step(self, dt: float) -> None:
+        """Advance the thermal model by dt seconds."""
+        master_status = self.get("Status") >> 8
+        ch_enabled = bool(master_status & 0x01)
+        t_set = protocol.parse_value("f88", self.get("TSet"))
+        t_set = min(t_set, protocol.parse_value("f88", self.get("MaxTSet")))
+
+        flame = ch_enabled and t_set > 0 and (self.t_boiler < t_set - BOILER_HYSTERESIS or (self.flame and self.t_boiler < t_set))
+        if flame and not self.flame:
+            self.set("BurnerStarts", self.get("BurnerStarts") + 1)
+        if ch_enabled and not self.get("Status") & 0x02:
+            self.set("CHPumpStarts", self.get("CHPumpStarts") + 1)
+        self.flame = flame
+
+        if flame:
+            modulation = max(0.1, min(1.0, (t_set - self.t_boiler) / 20.0))
+            self.t_boiler += BOILER_HEATING_RATE * modulation * dt
+            self.burner_seconds += dt
+            self.set("BurnerOperationHours", int(self.burner_seconds // 3600))
+        else:
+            modulation = 0.0
+            t_ret = protocol.parse_value("f88", self.get("Tret")) or 20.0
+            self.t_boiler -= (self.t_boiler - min(t_ret, self.t_boiler)) * min(1.0, BOILER_COOLING_RATE * dt)
+
+        slave_status = (0x02 if ch_enabled else 0) | (0x08 if flame else 0)
+        if self.get("ASFflags") & 0xFF00:
+            slave_status |= 0x01
+        self.set("Status", (master_status << 8) | slave_status)
+        self.set("Tboiler", protocol.write_value("f88", self.t_boiler))
+        self.set("Tret", protocol.write_value("f88", max(20.0, self.t_boiler - RETURN_DELTA * modulation - 2.0)))
+        self.set("RelModLevel", protocol.write_value("f88", modulation * 100.0))
+
+    def handle(self, request: int) -> Tuple[Optional[int], float]:
+        """The response to a request and the time before sending it in seconds, None when the boiler doesn't answer."""
+        self.requests += 1
+        delay = self.rng.uniform(*self.response_time)
+        if self.silent_rate and self.rng.random() < self.silent_rate:
+            return None, delay
+        if not protocol.is_valid_parity(request):
+            # A slave ignores frames with a parity error
+            return None, delay
+
+        message_type = protocol.get_message_type(request)
+        data_id = protocol.get_data_id(request)
+        data = protocol.get_data(request)
+        if message_type not in (protocol.READ_DATA, protocol.WRITE_DATA):
+            return None, delay
+
+        if not self.supports(data_id):
+            response_type = protocol.UNKNOWN_DATA_ID
+        elif data_id in self.invalid_ids or (self.invalid_rate and self.rng.random() < self.invalid_rate):
+            response_type = protocol.DATA_INVALID
+        elif message_type == protocol.WRITE_DATA:
+            if data_id in self.read_only:
+                response_type = protocol.DATA_INVALID
+            else:
+                response_type = protocol.WRITE_ACK
+                self.values[data_id] = data
+        elif data_id == self.message_ids.get("Status"):
+            # The master status is sent in the high byte of the read request
+            response_type = protocol.READ_ACK
+            self.values[data_id] = (data & 0xFF00) | (self.values[data_id] & 0x00FF)
+            data = self.values[data_id]
+        else:
+            response_type = protocol.READ_ACK
+            data = self.values[data_id]
+
+        self.answered[response_type] = self.answered.get(response_type, 0) + 1
+        return protocol.build_response(response_type, data_id, data), delay
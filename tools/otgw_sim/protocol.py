@@ -0,0 +1,20 @@
+# OpenTherm frame layout and bus timings, shared by the simulated devices.
+#
+# The frame layout, message types, directions and message_data codecs are the
+# ones of tools/otgw_protocol.py, also used by otgw_trace.py.
+
+from otgw_protocol import (
+    DATA_INVALID, DIRECTIONS, FROM_BOILER, FROM_THERMOSTAT, INVALID_DATA, MESSAGE_TYPES, READ_ACK, READ_DATA, RESERVED,
+    STATUS_INVALID, STATUS_INVALID_MESSAGE, STATUS_INVALID_PARITY, STATUS_NONE, STATUS_SUCCESS, STATUS_TIMEOUT,
+    TO_BOILER, TO_THERMOSTAT, UNKNOWN_DATA_ID, WRITE_ACK, WRITE_DATA,
+    build_request, build_response, get_data, get_data_id, get_message_data, get_message_type, is_valid_parity,
+    load_schema, parse_value, parity, write_value,
+)
+
+# Bus timings of the OpenTherm spec, in microseconds
+FRAME_TIME_US = 34000
+"""Start bit, 32 data bits and stop bit at 1ms per bit"""
+RESPONSE_TIMEOUT_US = 800000
+"""Maximum time between the end of a request and the start of the response"""
+REQUEST_GAP_US = 100000
+"""Minimum time between the end of a response and the next request"""
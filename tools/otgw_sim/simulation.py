@@ -0,0 +1,135 @@
+# Transactions between the simulated thermostat and boiler, on a simulated clock.
+#
+# The devices are connected by a transparent link: every request and response is
+# recorded twice, like the gateway captures them when forwarding (from thermostat
+# / to boiler, from boiler / to thermostat), so the traces can be analyzed with
+# otgw_trace.py or replayed through the gateway.
+
+import struct
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, TextIO
+
+from . import protocol
+from .boiler import Boiler
+from .thermostat import Thermostat
+
+MODEL_STEP_US = 1000000
+"""Maximum time step of the thermal models"""
+
+class CaptureWriter:
+    """Writes 10-byte capture records, the layout of SCaptureRecord in OpenThermGateway.h."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+
+    def write(self, timestamp_us: int, direction: int, frame: int, status: int) -> None:
+        self.stream.write(struct.pack("<IIBB", frame, timestamp_us & 0xFFFFFFFF, direction, status))
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+class CsvWriter:
+    """Writes timestamp (microseconds), direction and frame (hex) lines."""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.stream.write("timestamp,direction,frame\n")
+
+    def write(self, timestamp_us: int, direction: int, frame: int, status: int) -> None:
+        self.stream.write(f"{timestamp_us},{protocol.DIRECTIONS[direction]},{frame:08X}\n")
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+class Simulation:
+    """Runs the request cycle of the thermostat against the boiler.
+
+    With realtime, the frames are written when their simulated time is reached on the wall clock,
+    e.g. to feed a gateway or a live analysis, otherwise the simulation runs as fast as possible.
+    """
+
+    def __init__(self, thermostat: Thermostat, boiler: Boiler, writers: Optional[List[Any]] = None, realtime: bool = False):
+        self.thermostat = thermostat
+        self.boiler = boiler
+        self.writers = writers or []
+        self.realtime = realtime
+        self.now_us = 0
+        self.bus_free_us = 0
+        self.next_start_us = thermostat.next_request_time(0)
+        self.bus_busy_us = 0
+        self.frames = 0
+        self.late_responses = 0
+        self.wall_start = time.monotonic()
+
+    def advance(self, timestamp_us: int) -> None:
+        """Advance the thermal models to timestamp_us."""
+        while self.now_us < timestamp_us:
+            step_us = min(MODEL_STEP_US, timestamp_us - self.now_us)
+            self.now_us += step_us
+            self.boiler.step(step_us / 1e6)
+            self.thermostat.update(self.now_us, step_us / 1e6)
+
+    def record(self, timestamp_us: int, direction: int, frame: int, status: int = protocol.STATUS_SUCCESS) -> None:
+        if self.realtime:
+            delay = self.wall_start + timestamp_us / 1e6 - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.frames += 1
+        for writer in self.writers:
+            writer.write(timestamp_us, direction, frame, status)
+            if self.realtime:
+                writer.flush()
+
+    def transaction(self) -> None:
+        """One request of the thermostat and the response of the boiler, if any."""
+        start_us = self.next_start_us
+        self.advance(start_us)
+        request = self.thermostat.next_request()
+        request_end_us = start_us + protocol.FRAME_TIME_US
+        self.record(request_end_us, protocol.FROM_THERMOSTAT, request)
+        self.record(request_end_us, protocol.TO_BOILER, request)
+
+        response, delay = self.boiler.handle(request)
+        response_start_us = request_end_us + int(delay * 1e6)
+        if response is None:
+            self.thermostat.handle_response(request, None)
+            end_us = request_end_us + protocol.RESPONSE_TIMEOUT_US
+        else:
+            end_us = response_start_us + protocol.FRAME_TIME_US
+            self.record(end_us, protocol.FROM_BOILER, response)
+            if response_start_us - request_end_us > protocol.RESPONSE_TIMEOUT_US:
+                # Too late, the thermostat already gave up
+                self.late_responses += 1
+                self.record(end_us, protocol.TO_THERMOSTAT, response, protocol.STATUS_TIMEOUT)
+                self.thermostat.handle_response(request, None)
+            else:
+                self.record(end_us, protocol.TO_THERMOSTAT, response)
+                self.thermostat.handle_response(request, response)
+        self.bus_busy_us += end_us - start_us
+        self.bus_free_us = end_us + protocol.REQUEST_GAP_US
+        self.next_start_us = self.thermostat.next_request_time(self.bus_free_us)
+
+    def run(self, duration: float) -> Dict[str, Any]:
+        """Simulate duration seconds of traffic, returns statistics."""
+        end_us = self.now_us + int(duration * 1e6)
+        while self.next_start_us < end_us:
+            self.transaction()
+        self.advance(end_us)
+        for writer in self.writers:
+            writer.flush()
+        return self.statistics()
+
+    def statistics(self) -> Dict[str, Any]:
+        seconds = self.now_us / 1e6
+        return {
+            "duration": seconds,
+            "requests": self.thermostat.requests,
+            "request_rate": self.thermostat.requests / seconds if seconds else 0.0,
+            "timeouts": self.thermostat.timeouts,
+            "late_responses": self.late_responses,
+            "responses": { protocol.MESSAGE_TYPES[t]: n for t, n in sorted(self.boiler.answered.items()) },
+            "bus_utilization": 100.0 * self.bus_busy_us / self.now_us if self.now_us else 0.0,
+            "t_room": round(self.thermostat.t_room, 2),
+            "t_boiler": round(self.boiler.t_boiler, 2),
+            "burner_starts": self.boiler.get("BurnerStarts"),
+        }
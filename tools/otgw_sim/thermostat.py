@@ -0,0 +1,139 @@
+# Simulated OpenTherm thermostat (master).
+#
+# Sends the Status and TSet requests required by the spec in every cycle, each
+# followed by one request of a rotation: the room setpoint (TrSet) and room
+# temperature (Tr) writes and reads of the boiler values. The control setpoint
+# follows the room temperature of a small room model heated by the boiler.
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import protocol
+
+DEFAULT_ROTATION: List[Tuple[int, str]] = [
+    (protocol.WRITE_DATA, "TrSet"),
+    (protocol.WRITE_DATA, "Tr"),
+    (protocol.READ_DATA, "Tboiler"),
+    (protocol.READ_DATA, "RelModLevel"),
+    (protocol.READ_DATA, "ASFflags"),
+    (protocol.READ_DATA, "Tret"),
+    (protocol.WRITE_DATA, "TrSet"),
+    (protocol.WRITE_DATA, "Tr"),
+    (protocol.READ_DATA, "Toutside"),
+    (protocol.READ_DATA, "Tdhw"),
+    (protocol.READ_DATA, "CHPressure"),
+    (protocol.READ_DATA, "SConfigSMemberIDcode"),
+    (protocol.READ_DATA, "TdhwSetUBTdhwSetLB"),
+    (protocol.READ_DATA, "MaxTSetUBMaxTSetLB"),
+]
+"""Requests sent after Status and TSet, one per cycle"""
+
+# Room model, per second
+ROOM_HEATING_RATE = 2e-4
+"""Room temperature increase per °C between supply water and room"""
+ROOM_LOSS_RATE = 5e-5
+"""Room temperature decrease per °C between room and outside"""
+HEATING_CURVE = 1.2
+"""Supply water temperature increase per °C between room setpoint and outside"""
+ROOM_GAIN = 10.0
+"""Supply water temperature increase per °C below the room setpoint"""
+
+class Thermostat:
+    """A thermostat sending a request cycle at a fixed rate.
+
+    - interval: average time between two requests in seconds
+    - burst: number of requests sent back-to-back, only waiting the 100ms required between a response
+      and the next request, before waiting burst * interval since the start of the burst
+    - setpoints: (comfort, reduced) room setpoints, switched every setpoint_period seconds
+    - extra_ids: data IDs read in the rotation in addition to DEFAULT_ROTATION, e.g. IDs unknown to the boiler
+    """
+
+    def __init__(self, schema: Any, interval: float = 1.0, burst: int = 1, setpoints: Tuple[float, float] = (20.5, 17.0),
+                 setpoint_period: float = 4 * 3600, extra_ids: Iterable[int] = ()):
+        self.interval = interval
+        self.burst = max(1, burst)
+        self.setpoints = setpoints
+        self.setpoint_period = setpoint_period
+
+        self.message_ids: Dict[str, int] = dict(schema.MESSAGE_IDS)
+        self.rotation = [ (message_type, self.message_ids[msg]) for message_type, msg in DEFAULT_ROTATION ]
+        self.rotation += [ (protocol.READ_DATA, data_id) for data_id in extra_ids ]
+
+        self.ch_enable = True
+        self.dhw_enable = True
+        self.t_room = 19.0
+        self.t_room_set = setpoints[0]
+        self.t_boiler = 20.0
+        self.t_outside = 8.0
+        self.max_t_set = 75.0
+        self.t_set = 0.0
+
+        self.cycle = 0
+        self.step_index = 0
+        self.burst_index = 0
+        self.burst_start_us = 0
+        self.requests = 0
+        self.timeouts = 0
+        self.responses: Dict[int, int] = {}
+        """Number of valid responses by message type"""
+
+    def update(self, now_us: int, dt: float) -> None:
+        """Advance the room model by dt seconds and compute the setpoints."""
+        self.t_room_set = self.setpoints[int(now_us / 1e6 / self.setpoint_period) % 2] if self.setpoint_period > 0 else self.setpoints[0]
+        self.t_room += (ROOM_HEATING_RATE * (self.t_boiler - self.t_room) - ROOM_LOSS_RATE * (self.t_room - self.t_outside)) * dt
+        if self.t_room > self.t_room_set + 0.3:
+            self.t_set = 10.0
+        else:
+            t_set = self.t_room_set + HEATING_CURVE * (self.t_room_set - self.t_outside) + ROOM_GAIN * (self.t_room_set - self.t_room)
+            self.t_set = max(10.0, min(self.max_t_set, t_set))
+
+    def next_request_time(self, bus_free_us: int) -> int:
+        """Start time of the next request, bus_free_us is the end of the last transaction plus the mandatory gap."""
+        if self.requests == 0:
+            self.burst_start_us = bus_free_us
+            return bus_free_us
+        self.burst_index += 1
+        if self.burst_index < self.burst:
+            return bus_free_us
+        self.burst_index = 0
+        self.burst_start_us = max(bus_free_us, self.burst_start_us + int(self.burst * self.interval * 1e6))
+        return self.burst_start_us
+
+    def next_request(self) -> int:
+        """The next frame of the request cycle: Status, TSet and one request of the rotation."""
+        self.requests += 1
+        step = self.step_index
+        self.step_index = (self.step_index + 1) % 3
+        if step == 0:
+            master_status = (0x01 if self.ch_enable else 0) | (0x02 if self.dhw_enable else 0)
+            return protocol.build_request(protocol.READ_DATA, self.message_ids["Status"], master_status << 8)
+        if step == 1:
+            return protocol.build_request(protocol.WRITE_DATA, self.message_ids["TSet"], protocol.write_value("f88", self.t_set))
+
+        message_type, data_id = self.rotation[self.cycle % len(self.rotation)]
+        self.cycle += 1
+        data = 0
+        if data_id == self.message_ids["TrSet"]:
+            data = protocol.write_value("f88", self.t_room_set)
+        elif data_id == self.message_ids["Tr"]:
+            data = protocol.write_value("f88", self.t_room)
+        return protocol.build_request(message_type, data_id, data)
+
+    def handle_response(self, request: int, response: Optional[int]) -> None:
+        """Take the values of interest from a response, None when it timed out."""
+        if response is None:
+            self.timeouts += 1
+            return
+        if not protocol.is_valid_parity(response) or protocol.get_data_id(response) != protocol.get_data_id(request):
+            return
+        message_type = protocol.get_message_type(response)
+        self.responses[message_type] = self.responses.get(message_type, 0) + 1
+        if message_type != protocol.READ_ACK:
+            return
+        data_id = protocol.get_data_id(response)
+        value = protocol.parse_value("f88", protocol.get_data(response))
+        if data_id == self.message_ids["Tboiler"]:
+            self.t_boiler = value
+        elif data_id == self.message_ids["Toutside"]:
+            self.t_outside = value
+        elif data_id == self.message_ids["MaxTSet"]:
+            self.max_t_set = value
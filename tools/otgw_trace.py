@@ -0,0 +1,227 @@
+# Analysis of OpenTherm traffic recorded by the OpenThermGW component.
+#
+# Reads frame captures exported by the capture_export service (raw 10-byte
+# records, or the esphome.openthermgw_capture events as JSON) or ESPHome logs
+# with the "Thermostat request (%08X)" / "Boiler response (%08X)" lines, decodes
+# every frame at once with NumPy and prints per data ID rate, latency and value
+# statistics. Values are decoded with the message_data of the entities in
+# components/openthermgw/schema.py, like the firmware does (see otgw_protocol.py).
+#
+# Usage: python tools/otgw_trace.py [--format auto|capture|events|log] [--json] [--csv FILE|-] FILE...
+
+import argparse
+import base64
+import json
+import re
+import sys
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from otgw_protocol import (
+    DIRECTIONS, FROM_BOILER, FROM_THERMOSTAT, MESSAGE_TYPES, READ_ACK, STATUS_SUCCESS, TO_BOILER,
+    WRITE_ACK, get_entities, load_schema, parse_value,
+)
+
+# Layout of a capture record, see SCaptureRecord in OpenThermGateway.h
+CAPTURE_DTYPE = np.dtype([("frame", "<u4"), ("timestamp", "<u4"), ("direction", "u1"), ("status", "u1")])
+
+# Timestamps are unknown for log lines without a time prefix
+NO_TIMESTAMP = -1
+
+LOG_PATTERN = re.compile(
+    rb"^(?:\[(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?\])?[^\n]*?(Thermostat request|Boiler response) \(([0-9A-Fa-f]{8})\)",
+    re.MULTILINE
+)
+EVENT_PATTERN = re.compile(rb'"records"\s*:\s*"([A-Za-z0-9+/=]*)"')
+
+class Trace:
+    """Frames of a capture, as parallel arrays.
+
+    - frame: the raw 32-bit frames
+    - timestamp: microseconds, unwrapped to 64 bits (NO_TIMESTAMP when unknown)
+    - direction: ECaptureDirection
+    - status: OpenThermResponseStatus (STATUS_NONE when unknown)
+    """
+    def __init__(self, frame: np.ndarray, timestamp: np.ndarray, direction: np.ndarray, status: np.ndarray):
+        self.frame = frame.astype(np.uint32)
+        self.timestamp = timestamp.astype(np.int64)
+        self.direction = direction.astype(np.uint8)
+        self.status = status.astype(np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    @staticmethod
+    def concatenate(traces: List["Trace"]) -> "Trace":
+        return Trace(
+            np.concatenate([ trace.frame for trace in traces ]),
+            np.concatenate([ trace.timestamp for trace in traces ]),
+            np.concatenate([ trace.direction for trace in traces ]),
+            np.concatenate([ trace.status for trace in traces ])
+        )
+
+def unwrap_timestamps(timestamp: np.ndarray, period: int) -> np.ndarray:
+    """Unwrap a counter wrapping around every period, steps are taken as signed."""
+    if len(timestamp) == 0:
+        return timestamp.astype(np.int64)
+    steps = np.diff(timestamp.astype(np.int64))
+    steps = (steps + period // 2) % period - period // 2
+    return np.concatenate(([ int(timestamp[0]) ], int(timestamp[0]) + np.cumsum(steps)))
+
+def parse_records(data: bytes) -> Trace:
+    records = np.frombuffer(data[:len(data) - len(data) % CAPTURE_DTYPE.itemsize], dtype=CAPTURE_DTYPE)
+    return Trace(records["frame"], unwrap_timestamps(records["timestamp"], 1 << 32), records["direction"], records["status"])
+
+def parse_events(text: bytes) -> Trace:
+    return parse_records(b"".join(base64.b64decode(records) for records in EVENT_PATTERN.findall(text)))
+
+def parse_log(text: bytes) -> Trace:
+    matches = LOG_PATTERN.findall(text)
+    frame = np.fromiter((int(match[5], 16) for match in matches), dtype=np.uint32, count=len(matches))
+    direction = np.fromiter((FROM_THERMOSTAT if match[4] == b"Thermostat request" else FROM_BOILER for match in matches), dtype=np.uint8, count=len(matches))
+    timestamp = np.fromiter(
+        ((int(match[0]) * 3600 + int(match[1]) * 60 + int(match[2])) * 1000000 + int((match[3] or b"0").ljust(6, b"0")) if match[0] else NO_TIMESTAMP for match in matches),
+        dtype=np.int64, count=len(matches)
+    )
+    if len(timestamp) > 0 and timestamp[0] != NO_TIMESTAMP:
+        timestamp = unwrap_timestamps(timestamp, 24 * 3600 * 1000000)
+    # Only successfully decoded frames are logged with their value
+    return Trace(frame, timestamp, direction, np.full(len(frame), STATUS_SUCCESS, dtype=np.uint8))
+
+def read_trace(path: str, format: str) -> Trace:
+    with open(path, "rb") as file:
+        data = file.read()
+    if format == "auto":
+        if EVENT_PATTERN.search(data):
+            format = "events"
+        elif LOG_PATTERN.search(data):
+            format = "log"
+        else:
+            format = "capture"
+    return { "capture": parse_records, "events": parse_events, "log": parse_log }[format](data)
+
+def write_csv(trace: Trace, stream: Any) -> None:
+    """Write the frames as timestamp, direction, frame lines, the trace format of host/otgw-replay.yaml."""
+    stream.write("timestamp,direction,frame\n")
+    for frame, timestamp, direction in zip(trace.frame, trace.timestamp, trace.direction):
+        stream.write(f"{timestamp if timestamp != NO_TIMESTAMP else ''},{DIRECTIONS[direction]},{frame:08X}\n")
+
+def decode_frames(frame: np.ndarray) -> Dict[str, np.ndarray]:
+    """Split frames into their fields, and check the parity (the number of set bits must be even)."""
+    bits = np.unpackbits(frame.astype(">u4").view(np.uint8).reshape(-1, 4), axis=1)
+    return {
+        "parity_ok": bits.sum(axis=1) % 2 == 0,
+        "message_type": ((frame >> 28) & 0x7).astype(np.uint8),
+        "data_id": ((frame >> 16) & 0xFF).astype(np.uint8),
+        "data": (frame & 0xFFFF).astype(np.uint16),
+    }
+
+def percentiles(values: np.ndarray) -> Dict[str, float]:
+    if len(values) == 0:
+        return {}
+    p50, p95 = np.percentile(values, [ 50, 95 ])
+    return { "p50": float(p50), "p95": float(p95), "max": float(values.max()) }
+
+def boiler_response_times(trace: Trace, fields: Dict[str, np.ndarray]) -> np.ndarray:
+    """For every frame, the time (ms) since the last request sent to the boiler if it is a response to it, NaN otherwise."""
+    index = np.arange(len(trace))
+    last_request = np.maximum.accumulate(np.where(trace.direction == TO_BOILER, index, -1))
+    request = np.maximum(last_request, 0)
+    answered = (trace.direction == FROM_BOILER) & (last_request >= 0) & (trace.timestamp != NO_TIMESTAMP) \
+        & (fields["data_id"] == fields["data_id"][request])
+    return np.where(answered, (trace.timestamp - trace.timestamp[request]) / 1000.0, np.nan)
+
+def forward_latencies(trace: Trace) -> np.ndarray:
+    """For every request sent to the boiler right after a thermostat request, the time (ms) it took to forward it, NaN otherwise."""
+    latency = np.full(len(trace), np.nan)
+    if len(trace) < 2:
+        return latency
+    forwarded = np.flatnonzero((trace.direction[1:] == TO_BOILER) & (trace.direction[:-1] == FROM_THERMOSTAT)) + 1
+    latency[forwarded] = (trace.timestamp[forwarded] - trace.timestamp[forwarded - 1]) / 1000.0
+    return latency
+
+def analyze(trace: Trace, schema: Any) -> Dict[str, Any]:
+    fields = decode_frames(trace.frame)
+    response_time = boiler_response_times(trace, fields)
+    forward_latency = forward_latencies(trace)
+    timed = trace.timestamp[trace.timestamp != NO_TIMESTAMP]
+    minutes = (timed.max() - timed.min()) / 60e6 if len(timed) > 1 else 0.0
+    messages_by_id = { data_id: msg for msg, data_id in schema.MESSAGE_IDS.items() }
+    entities = get_entities(schema)
+
+    # Values are taken from the acknowledged responses of the boiler
+    acknowledged = (trace.direction == FROM_BOILER) & fields["parity_ok"] & (trace.status <= STATUS_SUCCESS) \
+        & ((fields["message_type"] == READ_ACK) | (fields["message_type"] == WRITE_ACK))
+
+    result: Dict[str, Any] = {
+        "frames": len(trace),
+        "minutes": float(minutes),
+        "invalid_parity": int((~fields["parity_ok"]).sum()),
+        "boiler_response_time": percentiles(response_time[~np.isnan(response_time)]),
+        "forward_latency": percentiles(forward_latency[~np.isnan(forward_latency)]),
+        "ids": {},
+    }
+    for data_id in np.unique(fields["data_id"]):
+        of_id = fields["data_id"] == data_id
+        stats: Dict[str, Any] = {
+            "message": messages_by_id.get(int(data_id), f"Unknown{data_id}"),
+            "frames": int(of_id.sum()),
+            "per_minute": float(of_id.sum() / minutes) if minutes > 0 else None,
+            "message_types": { MESSAGE_TYPES[message_type]: int(count) for message_type, count in enumerate(np.bincount(fields["message_type"][of_id], minlength=8)) if count > 0 },
+            "boiler_response_time": percentiles(response_time[of_id & ~np.isnan(response_time)]),
+            "values": {},
+        }
+        data = fields["data"][of_id & acknowledged]
+        for key, message_data in entities.get(int(data_id), []):
+            values = parse_value(message_data, data.astype(np.int32))
+            if values is not None and len(values) > 0:
+                stats["values"][key] = {
+                    "min": float(values.min()), "mean": float(values.mean()), "max": float(values.max()),
+                    "last": float(values[-1]), "changes": int((np.diff(values) != 0).sum()),
+                }
+        result["ids"][int(data_id)] = stats
+    return result
+
+def format_percentiles(stats: Dict[str, float]) -> str:
+    return f"p50 {stats['p50']:.0f} ms, p95 {stats['p95']:.0f} ms, max {stats['max']:.0f} ms" if stats else "-"
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"{result['frames']} frames over {result['minutes']:.1f} minutes, {result['invalid_parity']} with invalid parity")
+    print(f"Boiler response time: {format_percentiles(result['boiler_response_time'])}")
+    print(f"Forward latency: {format_percentiles(result['forward_latency'])}")
+    print()
+    for data_id, stats in result["ids"].items():
+        rate = f"{stats['per_minute']:.2f}/min" if stats["per_minute"] is not None else "-"
+        types = ", ".join(f"{message_type} {count}" for message_type, count in stats["message_types"].items())
+        print(f"{data_id:3d} {stats['message']:<28} {stats['frames']:8d} frames {rate:>12}  {types}")
+        if stats["boiler_response_time"]:
+            print(f"    response time: {format_percentiles(stats['boiler_response_time'])}")
+        for key, values in stats["values"].items():
+            print(f"    {key:<30} min {values['min']:g}, mean {values['mean']:.2f}, max {values['max']:g}, last {values['last']:g}, {values['changes']} changes")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Statistics of OpenTherm frames captured by the OpenThermGW component")
+    parser.add_argument("files", nargs="+", help="capture files (raw records or exported events) or ESPHome logs")
+    parser.add_argument("--format", choices=[ "auto", "capture", "events", "log" ], default="auto", help="format of the files (default: detected)")
+    parser.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    parser.add_argument("--csv", help="write the frames as CSV to this file for host/otgw-replay.yaml, - for stdout instead of the statistics")
+    args = parser.parse_args(argv)
+
+    trace = Trace.concatenate([ read_trace(path, args.format) for path in args.files ])
+    if args.csv == "-":
+        write_csv(trace, sys.stdout)
+        return 0
+    if args.csv:
+        with open(args.csv, "w") as file:
+            write_csv(trace, file)
+    result = analyze(trace, load_schema())
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(result)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())